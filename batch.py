@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator
+
+from chess import Board
+from constants import *
+
+_board = None  # reused by every chunk classified in a worker process
+
+
+def classify_fen(board: Board, fen: str) -> tuple[int, int, bool]:
+    """
+    Loads a FEN onto an existing board and classifies it
+    :param board: Board instance to reuse, its position is replaced
+    :param fen: the FEN string to classify
+    :return: (win state, number of legal moves, whether the side to move is in check)
+    """
+    board.load_fen(fen)
+    state, moves, in_check = board.get_position_state()
+    return state, len(moves), in_check
+
+
+def _classify_chunk(fens: list[str]) -> list[tuple[int, int, bool]]:
+    global _board
+    if _board is None: _board = Board()
+    return [classify_fen(_board, fen) for fen in fens]
+
+
+def _fens(lines: Iterable[str]) -> Iterator[str]:
+    # accepts open files as well as lists of FENs, skipping blank lines
+    for line in lines:
+        line = line.strip()
+        if line: yield line
+
+
+def classify(fens: Iterable[str], workers: int = 1, chunk_size: int = 1000,
+             executor: Executor = None) -> Iterator[tuple[str, int, int, bool]]:
+    """
+    Classifies a stream of FENs lazily and in order, so memory use does not grow with the input
+    :param fens: iterable of FEN strings, such as an open file with one per line
+    :param workers: number of processes; 1 classifies in this process with a single reused board
+    :param chunk_size: number of FENs sent to a worker at a time
+    :param executor: existing pool to submit to instead of starting one
+    :return: iterator of (FEN, win state, number of legal moves, whether the side to move is in check)
+    """
+    fens = _fens(fens)
+    if workers == 1 and executor is None:
+        board = Board()
+        for fen in fens:
+            yield (fen, *classify_fen(board, fen))
+        return
+
+    workers = workers or os.cpu_count() or 1
+    pool = executor or ProcessPoolExecutor(max_workers=workers)
+    pending = deque()  # (chunk, future), bounded so the input is read only as fast as results are consumed
+    try:
+        while True:
+            while len(pending) < workers * 2:
+                chunk = list(islice(fens, chunk_size))
+                if not chunk: break
+                pending.append((chunk, pool.submit(_classify_chunk, chunk)))
+            if not pending: break
+            chunk, future = pending.popleft()
+            for fen, result in zip(chunk, future.result()):
+                yield (fen, *result)
+    finally:
+        for _, future in pending:
+            future.cancel()
+        if executor is None: pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify FENs by win state, legal move count and check")
+    parser.add_argument("file", nargs="?", help="file of FENs, one per line, defaults to stdin")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes, 0 for the CPU count")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    names = {WHITE: "white", BLACK: "black", DRAW: "draw", NO_RESULT: "none"}
+    source = open(args.file) if args.file else sys.stdin
+    t1 = time.perf_counter()
+    count = 0
+    with source:
+        for fen, state, moves, check in classify(source, args.workers, args.chunk_size):
+            print(f"{fen}\t{names[state]}\t{moves}\t{int(check)}")
+            count += 1
+    t2 = time.perf_counter()
+    print(f"Positions: {count}  Time: {t2 - t1:.3f}s  Positions/s: {count / max(t2 - t1, 1e-9):.0f}", file=sys.stderr)
@@ -0,0 +1,501 @@
+from __future__ import annotations
+
+from typing import Iterator
+
+from chess import Board, Move, Piece, Square
+from constants import *
+from conversions import *
+from tables import *
+from zobrist import *
+
+FULL = (1 << 64) - 1
+PIECE_TYPES = [PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING]
+
+
+def squares_to_mask(squares: list[int]) -> int:
+    """
+    Converts a list of square indices to a bitboard
+    :param squares: indices from 0-63
+    :return: 64-bit int with the bit of every square set
+    """
+    mask = 0
+    for square in squares:
+        mask |= 1 << square
+    return mask
+
+
+def mask_to_squares(mask: int) -> list[int]:
+    """
+    Converts a bitboard to a list of square indices
+    :param mask: 64-bit int
+    :return: indices of the set bits, lowest first
+    """
+    squares = []
+    while mask:
+        lsb = mask & -mask
+        squares.append(lsb.bit_length() - 1)
+        mask ^= lsb
+    return squares
+
+
+KNIGHT_ATTACKS = [squares_to_mask(targets) for targets in KNIGHT_TARGETS]
+KING_ATTACKS = [squares_to_mask(targets) for targets in KING_TARGETS]
+PAWN_ATTACK_MASKS = {colour: [squares_to_mask(targets) for targets in PAWN_ATTACKS[colour]] for colour in [WHITE, BLACK]}
+
+
+def _ray_masks(dc: int, dr: int) -> list[int]:
+    """
+    Precomputes the ray leaving every square in one direction
+    :param dc: column step
+    :param dr: row step
+    :return: list indexed by square of ray bitboards, excluding the square itself
+    """
+    masks = []
+    for i in range(64):
+        c, r = index_to_coordinate(i)
+        mask = 0
+        c, r = c + dc, r + dr
+        while 0 <= c <= 7 and 0 <= r <= 7:
+            mask |= 1 << coordinate_to_index((c, r))
+            c, r = c + dc, r + dr
+        masks.append(mask)
+    return masks
+
+
+# RAY_MASKS[d][i] holds every square from i towards direction QUEEN_DIRECTIONS[d]
+RAY_MASKS = [_ray_masks(dc, dr) for dc, dr in QUEEN_DIRECTIONS]
+# rays running towards higher indices are cut at their lowest blocker, the others at their highest
+RAY_INCREASES = [dr > 0 or (dr == 0 and dc > 0) for dc, dr in QUEEN_DIRECTIONS]
+BISHOP_RAY_INDICES = [QUEEN_DIRECTIONS.index(d) for d in BISHOP_DIRECTIONS]
+ROOK_RAY_INDICES = [QUEEN_DIRECTIONS.index(d) for d in ROOK_DIRECTIONS]
+
+FILE_A = squares_to_mask(range(0, 64, 8))
+FILE_H = squares_to_mask(range(7, 64, 8))
+# rows counted from the 8th rank, matching square indices
+# squares of each colour as numbered by square_colour, to find bishops that can never meet
+SQUARE_COLOUR_MASKS = [squares_to_mask([i for i in range(64) if square_colour(i) == c]) for c in range(2)]
+ROW_MASKS = [squares_to_mask(range(8 * r, 8 * r + 8)) for r in range(8)]
+PROMOTION_ROWS = ROW_MASKS[0] | ROW_MASKS[7]
+
+CASTLING_EMPTY_MASKS = [squares_to_mask(empty) for _, _, _, _, empty in CASTLING_MOVES]
+
+
+def slider_attacks(square: int, occupied: int, ray_indices: list[int]) -> int:
+    """
+    Looks up the squares a slider attacks using the classical ray tables
+    :param square: index of the sliding piece
+    :param occupied: bitboard of every occupied square
+    :param ray_indices: which of RAY_MASKS the piece slides along
+    :return: bitboard of attacked squares, including the first blocker of each ray
+    """
+    attacks = 0
+    for d in ray_indices:
+        ray = RAY_MASKS[d][square]
+        blockers = ray & occupied
+        if blockers:
+            if RAY_INCREASES[d]:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= RAY_MASKS[d][first]
+        attacks |= ray
+    return attacks
+
+
+def bishop_attacks(square: int, occupied: int) -> int:
+    return slider_attacks(square, occupied, BISHOP_RAY_INDICES)
+
+
+def rook_attacks(square: int, occupied: int) -> int:
+    return slider_attacks(square, occupied, ROOK_RAY_INDICES)
+
+
+class BitBoard:
+    def __init__(self, fen: str = START_FEN) -> None:
+        """
+        Creates a board backed by one 64-bit int per piece type and colour
+        :param fen: the FEN string for the position to load
+        """
+        self.pieces = {WHITE: dict.fromkeys(PIECE_TYPES, 0), BLACK: dict.fromkeys(PIECE_TYPES, 0)}
+        self.occupancy = {WHITE: 0, BLACK: 0}
+        self.mailbox = [None] * 64  # Piece on each square for O(1) lookups when moving
+        self.turn = WHITE
+        self.castling = [False] * 4
+        self.en_passant = -1  # index of en passant square or -1
+        self.halfmoves = 0
+        self.moves = 0
+        self.zobrist_key = 0
+        self.history = []  # zobrist keys of the positions since the last capture or pawn move
+
+        self.saves = []
+
+        self.load_fen(fen)
+
+    def load_fen(self, fen_to_load: str) -> None:
+        """
+        Loads a FEN notation onto the board
+        :param fen_to_load: the FEN string to load onto the board
+        """
+        fen_string = fen_to_load.split(" ")
+        position = [None] * 64
+        index = 0
+        for char in fen_string[0]:
+            if char.isnumeric():
+                index += int(char)
+            elif char != "/":
+                position[index] = Piece.from_str(char)
+                index += 1
+        castling = [char in fen_string[2] for char in "KQkq"]
+        en_passant = -1 if fen_string[3] == "-" else algebraic_to_index(fen_string[3])
+        turn = BLACK if fen_string[1] == "b" else WHITE
+        moves = int(fen_string[5]) * 2 - 2
+        if turn == BLACK: moves += 1
+        self._set_position(position, turn, castling, en_passant, int(fen_string[4]), moves)
+
+    def _set_position(self, position: list[Piece | None], turn: int, castling: list[bool], en_passant: int,
+                      halfmoves: int, moves: int) -> None:
+        """
+        Rebuilds every bitboard from a list of pieces
+        :param position: Piece or None for each square starting from a8
+        """
+        self.pieces = {WHITE: dict.fromkeys(PIECE_TYPES, 0), BLACK: dict.fromkeys(PIECE_TYPES, 0)}
+        self.occupancy = {WHITE: 0, BLACK: 0}
+        self.mailbox = list(position)
+        for index, piece in enumerate(position):
+            if piece is not None:
+                self.pieces[piece.colour][piece.type] |= 1 << index
+                self.occupancy[piece.colour] |= 1 << index
+        self.turn = turn
+        self.castling = list(castling)
+        self.en_passant = en_passant
+        self.halfmoves = halfmoves
+        self.moves = moves
+        self.saves = []
+        self.zobrist_key = hash_position(self.position, turn, self.castling, en_passant)
+        self.history = []
+
+    @staticmethod
+    def from_board(board: Board) -> BitBoard:
+        """
+        Creates a bitboard copy of a square based board
+        :param board: Board instance to convert
+        :return: an equivalent instance of BitBoard
+        """
+        b = BitBoard.__new__(BitBoard)
+        b._set_position([square.piece for square in board.position], board.turn, board.castling,
+                        board.en_passant.index, board.halfmoves, board.moves)
+        return b
+
+    def to_board(self) -> Board:
+        """
+        Creates a square based copy of the board
+        :return: an equivalent instance of Board
+        """
+        return Board(self.to_fen())
+
+    def to_fen(self) -> str:
+        """
+        Writes the position as a FEN string
+        :return: the FEN string of the position
+        """
+        rows = []
+        for r in range(8):
+            row, empty = "", 0
+            for piece in self.mailbox[8 * r:8 * r + 8]:
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty: row += str(empty)
+                row, empty = row + piece.printable, 0
+            if empty: row += str(empty)
+            rows.append(row)
+        castling = "".join(char for char, right in zip("KQkq", self.castling) if right) or "-"
+        en_passant = "-" if self.en_passant == -1 else index_to_algebraic(self.en_passant)
+        turn = "w" if self.turn == WHITE else "b"
+        return f"{'/'.join(rows)} {turn} {castling} {en_passant} {self.halfmoves} {self.moves // 2 + 1}"
+
+    @property
+    def position(self) -> list[Square]:
+        """
+        The Square/Piece view of the board, as held by Board.position
+        """
+        return [Square(index, piece) for index, piece in enumerate(self.mailbox)]
+
+    __str__ = Board.__str__
+
+    def attackers_mask(self, square: int, colour: int, occupied: int = None) -> int:
+        """
+        Finds every piece of a colour attacking a square by looking outwards from the square
+        :param square: index of the attacked square
+        :param colour: WHITE or BLACK constant of the attacking side
+        :param occupied: occupancy to slide through, defaults to the current one
+        :return: bitboard of attacking pieces
+        """
+        if occupied is None: occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+        pieces = self.pieces[colour]
+        diagonal = pieces[BISHOP] | pieces[QUEEN]
+        straight = pieces[ROOK] | pieces[QUEEN]
+        return ((PAWN_ATTACK_MASKS[-colour][square] & pieces[PAWN])
+                | (KNIGHT_ATTACKS[square] & pieces[KNIGHT])
+                | (KING_ATTACKS[square] & pieces[KING])
+                | (bishop_attacks(square, occupied) & diagonal)
+                | (rook_attacks(square, occupied) & straight))
+
+    def is_check(self, colour: WHITE | BLACK) -> bool:
+        """
+        Checks if specified colour's king is in check
+        :param colour: WHITE or BLACK constant of specified king
+        :return: true if given king is in check
+        """
+        king = self.pieces[colour][KING]
+        if not king: return False
+        return self.attackers_mask(king.bit_length() - 1, -colour) != 0
+
+    def get_pseudo_legal_moves(self) -> list[Move]:
+        """
+        Gets the moves of every piece of the side to move, including moves that leave its king in check
+        :return: a list of candidate moves as move instances
+        """
+        return list(self.iter_pseudo_legal_moves())
+
+    def iter_pseudo_legal_moves(self) -> Iterator[Move]:
+        """
+        Yields the moves of every piece of the side to move, including moves that leave its king in check
+        :return: a generator of candidate move instances
+        """
+        colour = self.turn
+        pieces = self.pieces[colour]
+        own = self.occupancy[colour]
+        enemy = self.occupancy[-colour]
+        occupied = own | enemy
+        empty = ~occupied & FULL
+
+        # pawns, every push and capture of one kind in a single shift
+        pawns = pieces[PAWN]
+        ep = 0 if self.en_passant == -1 else 1 << self.en_passant
+        if colour == WHITE:
+            single = (pawns >> 8) & empty
+            double = ((single & ROW_MASKS[5]) >> 8) & empty
+            pawn_targets = [(single, 8), (double, 16),
+                            (((pawns & ~FILE_A) >> 9) & (enemy | ep), 9),
+                            (((pawns & ~FILE_H) >> 7) & (enemy | ep), 7)]
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & ROW_MASKS[2]) << 8) & empty
+            pawn_targets = [(single, -8), (double, -16),
+                            (((pawns & ~FILE_H) << 9) & (enemy | ep) & FULL, -9),
+                            (((pawns & ~FILE_A) << 7) & (enemy | ep) & FULL, -7)]
+        for targets, offset in pawn_targets:
+            for target in mask_to_squares(targets & ~PROMOTION_ROWS):
+                flag = MOVE_EN_PASSANT if target == self.en_passant else MOVE_NORMAL
+                yield Move(target + offset, target, flag=flag)
+            for target in mask_to_squares(targets & PROMOTION_ROWS):
+                for piece_type in LEGAL_PROMOTE_PIECES:
+                    yield Move(target + offset, target, Piece(piece_type, colour))
+
+        for piece_type in [KNIGHT, BISHOP, ROOK, QUEEN, KING]:
+            for start in mask_to_squares(pieces[piece_type]):
+                if piece_type == KNIGHT:
+                    attacks = KNIGHT_ATTACKS[start]
+                elif piece_type == BISHOP:
+                    attacks = bishop_attacks(start, occupied)
+                elif piece_type == ROOK:
+                    attacks = rook_attacks(start, occupied)
+                elif piece_type == QUEEN:
+                    attacks = bishop_attacks(start, occupied) | rook_attacks(start, occupied)
+                else:
+                    attacks = KING_ATTACKS[start]
+                for target in mask_to_squares(attacks & ~own):
+                    yield Move(start, target)
+
+        for i, (king_start, king_target, rook_start, rook_target, _) in enumerate(CASTLING_MOVES):
+            if not self.castling[i] or (colour == WHITE) != (i < 2):
+                continue
+            if not pieces[KING] >> king_start & 1 or not pieces[ROOK] >> rook_start & 1:
+                continue
+            if occupied & CASTLING_EMPTY_MASKS[i]:
+                continue
+            if self.attackers_mask(king_start, -colour) or self.attackers_mask(rook_target, -colour):
+                continue
+            yield Move(king_start, king_target, flag=MOVE_CASTLING)
+
+    def is_king_safe_after(self, move: Move) -> bool:
+        """
+        Checks that a pseudo-legal move does not leave the mover's king in check, without making it
+        :param move: Move instance to test
+        :return: true if the move is legal
+        """
+        colour = self.turn
+        start, target = move.data & 63, move.data >> 6 & 63
+        piece = self.mailbox[start]
+        captured_pos = target
+        if piece.type == PAWN and target == self.en_passant:
+            captured_pos = target + 8 * colour
+        captured = 1 << captured_pos if self.mailbox[captured_pos] is not None else 0
+        occupied = ((self.occupancy[WHITE] | self.occupancy[BLACK]) & ~(1 << start) & ~captured) | 1 << target
+        if piece.type == KING:
+            king = target
+        else:
+            king = self.pieces[colour][KING].bit_length() - 1
+        enemy = self.pieces[-colour]
+        remaining = ~captured
+        diagonal = (enemy[BISHOP] | enemy[QUEEN]) & remaining
+        straight = (enemy[ROOK] | enemy[QUEEN]) & remaining
+        return not ((PAWN_ATTACK_MASKS[colour][king] & enemy[PAWN] & remaining)
+                    or (KNIGHT_ATTACKS[king] & enemy[KNIGHT] & remaining)
+                    or (KING_ATTACKS[king] & enemy[KING])
+                    or (bishop_attacks(king, occupied) & diagonal)
+                    or (rook_attacks(king, occupied) & straight))
+
+    def get_legal_moves(self) -> list[Move]:
+        """
+        Gets an array of all legal moves
+        :return: a list of all the legal moves as move instances
+        """
+        return [move for move in self.iter_pseudo_legal_moves() if self.is_king_safe_after(move)]
+
+    def has_legal_move(self) -> bool:
+        """
+        Checks if the side to move has any legal move, stopping at the first one found
+        :return: true if at least one legal move exists
+        """
+        return any(self.is_king_safe_after(move) for move in self.iter_pseudo_legal_moves())
+
+    def get_win_state(self) -> int:
+        """
+        Checks if game has ended
+        :return: Constant: either WHITE, BLACK, DRAW or NO_RESULT
+        """
+        if not self.has_legal_move():
+            if self.is_check(self.turn):
+                return -self.turn
+            return DRAW
+        if self.halfmoves >= 100 or self.is_repetition() or self.is_insufficient_material(): return DRAW
+        return NO_RESULT
+
+    def repetition_count(self) -> int:
+        """
+        Counts how many times the current position has occurred since the last capture or pawn move
+        :return: number of occurrences, including the current one
+        """
+        return self.history[-2::-2].count(self.zobrist_key) + 1
+
+    def is_repetition(self, count: int = 3) -> bool:
+        """
+        Checks if the current position has occurred at least a number of times
+        :param count: number of occurrences, 3 for the threefold repetition rule
+        :return: true if the position has been repeated enough times
+        """
+        return len(self.history) >= 2 * count - 2 and self.repetition_count() >= count
+
+    def is_insufficient_material(self) -> bool:
+        """
+        Checks if neither side can possibly checkmate: bare kings with at most one minor piece, or only bishops that
+        all stand on squares of one colour
+        :return: true if the position is dead
+        """
+        white, black = self.pieces[WHITE], self.pieces[BLACK]
+        if white[PAWN] | black[PAWN] | white[ROOK] | black[ROOK] | white[QUEEN] | black[QUEEN]: return False
+        knights = white[KNIGHT] | black[KNIGHT]
+        bishops = white[BISHOP] | black[BISHOP]
+        if (knights | bishops).bit_count() <= 1: return True
+        return not knights and not (bishops & SQUARE_COLOUR_MASKS[0] and bishops & SQUARE_COLOUR_MASKS[1])
+
+    def _en_passant_key(self) -> int:
+        # as zobrist.en_passant_key, the file only counts when a pawn of the side to move can capture onto it
+        if self.en_passant == -1: return 0
+        if PAWN_ATTACK_MASKS[-self.turn][self.en_passant] & self.pieces[self.turn][PAWN]:
+            return EN_PASSANT_KEYS[self.en_passant % 8]
+        return 0
+
+    def _toggle(self, piece: Piece, square: int) -> None:
+        bit = 1 << square
+        self.pieces[piece.colour][piece.type] ^= bit
+        self.occupancy[piece.colour] ^= bit
+        self.zobrist_key ^= PIECE_KEYS[piece.type][piece.colour][square]
+
+    def make_move(self, move: Move) -> None:
+        """
+        Makes a move on the board
+        :param move: Move instance to make
+        """
+        start, target = move.data & 63, move.data >> 6 & 63
+        mailbox = self.mailbox
+        piece = mailbox[start]
+
+        captured_pos = target
+        if piece.type == PAWN and target == self.en_passant:
+            captured_pos = target + 8 * piece.colour
+        captured = mailbox[captured_pos]
+        key = self.zobrist_key
+        self.saves.append((move, piece, captured, captured_pos, self.castling.copy(), self.en_passant,
+                           self.halfmoves, key, None if piece.type != PAWN and captured is None else self.history))
+        self.zobrist_key ^= TURN_KEY ^ self._en_passant_key()
+
+        if captured is not None:
+            self._toggle(captured, captured_pos)
+            mailbox[captured_pos] = None
+        self._toggle(piece, start)
+        mailbox[start] = None
+        placed = piece
+        if piece.type == PAWN and (target < 8 or target > 55):
+            placed = move.promotion_piece or Piece(QUEEN, piece.colour)
+        self._toggle(placed, target)
+        mailbox[target] = placed
+
+        if piece.type == KING and abs(start - target) == 2:
+            for king_start, king_target, rook_start, rook_target, _ in CASTLING_MOVES:
+                if start == king_start and target == king_target:
+                    rook = mailbox[rook_start]
+                    self._toggle(rook, rook_start)
+                    self._toggle(rook, rook_target)
+                    mailbox[rook_target], mailbox[rook_start] = rook, None
+        for i, (king_start, _, rook_start, _, _) in enumerate(CASTLING_MOVES):
+            if self.castling[i] and (start == king_start or start == rook_start or target == rook_start):
+                self.castling[i] = False
+                self.zobrist_key ^= CASTLING_KEYS[i]
+
+        self.en_passant = target + 8 * piece.colour if piece.type == PAWN and abs(start - target) == 16 else -1
+        self.turn = -self.turn
+        self.zobrist_key ^= self._en_passant_key()
+        self.moves += 1
+        self.halfmoves += 1
+        if piece.type == PAWN or captured is not None:
+            self.halfmoves = 0
+            self.history = []  # the earlier positions can never occur again
+        else:
+            self.history.append(key)
+
+    def unmake_move(self) -> None:
+        """
+        Unmakes the last move unless there are no previous recorded positions
+        """
+        if len(self.saves) == 0: raise Exception("Cannot undo move: No previous position exists")
+        move, piece, captured, captured_pos, castling, en_passant, halfmoves, key, history = self.saves.pop()
+        start, target = move.data & 63, move.data >> 6 & 63
+        mailbox = self.mailbox
+
+        self._toggle(mailbox[target], target)
+        mailbox[target] = None
+        self._toggle(piece, start)
+        mailbox[start] = piece
+        if captured is not None:
+            self._toggle(captured, captured_pos)
+            mailbox[captured_pos] = captured
+
+        if piece.type == KING and abs(start - target) == 2:
+            for king_start, king_target, rook_start, rook_target, _ in CASTLING_MOVES:
+                if start == king_start and target == king_target:
+                    rook = mailbox[rook_target]
+                    self._toggle(rook, rook_target)
+                    self._toggle(rook, rook_start)
+                    mailbox[rook_start], mailbox[rook_target] = rook, None
+
+        self.castling = castling
+        self.en_passant = en_passant
+        self.halfmoves = halfmoves
+        self.turn = -self.turn
+        self.moves -= 1
+        self.zobrist_key = key
+        if history is None: self.history.pop()
+        else: self.history = history
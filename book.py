@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from typing import Iterable
+
+from chess import Board, Move
+from constants import *
+from pgn import PGNError, move_to_san, read_games, san_to_move
+
+# an entry is a zobrist key, packed Move data and a weight, little endian; the file holds entries sorted by key and
+# then by descending weight, so the moves of a position are contiguous and the most played comes first
+ENTRY_FORMAT = struct.Struct("<QHI")
+ENTRY_SIZE = ENTRY_FORMAT.size
+KEY_FORMAT = struct.Struct("<Q")
+MAX_WEIGHT = (1 << 32) - 1
+
+
+class OpeningBook:
+    def __init__(self, path: str) -> None:
+        """
+        Opens a book file written by BookBuilder; entries are read through a memory map, so opening is immediate and
+        only the pages touched by lookups are loaded
+        :param path: path of the book file
+        """
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size % ENTRY_SIZE:
+            self.file.close()
+            raise Exception(f"{path} is not an opening book: its size is not a multiple of {ENTRY_SIZE} bytes")
+        self.count = size // ENTRY_SIZE
+        # an empty file cannot be mapped
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def lookup(self, key: int) -> list[tuple[int, int]]:
+        """
+        Binary searches the book for a position
+        :param key: Zobrist key of the position
+        :return: list of (packed Move data, weight), most played first
+        """
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if KEY_FORMAT.unpack_from(self.map, mid * ENTRY_SIZE)[0] < key: lo = mid + 1
+            else: hi = mid
+        entries = []
+        for index in range(lo, self.count):
+            entry_key, data, weight = ENTRY_FORMAT.unpack_from(self.map, index * ENTRY_SIZE)
+            if entry_key != key: break
+            entries.append((data, weight))
+        return entries
+
+    def choose(self, board: Board, rng: random.Random = random) -> Move | None:
+        """
+        Picks a book move at random in proportion to its weight
+        :param board: Board instance to pick a move for
+        :param rng: source of randomness
+        :return: a legal Move or None if the position is not in the book
+        """
+        moves = board.get_book_moves(self)
+        if not moves: return None
+        return rng.choices([move for move, _ in moves], [weight for _, weight in moves])[0]
+
+    def close(self) -> None:
+        if isinstance(self.map, mmap.mmap): self.map.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self) -> OpeningBook:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class BookBuilder:
+    def __init__(self) -> None:
+        """
+        Collects weighted moves in memory before they are sorted and written to a book file
+        """
+        self.weights = {}  # (zobrist key, packed Move data) -> weight
+
+    def add(self, board: Board, move: Move, weight: int = 1) -> None:
+        """
+        Adds weight to a move in a position
+        :param board: Board instance with the position
+        :param move: legal Move in the position
+        :param weight: weight to add
+        """
+        key = (board.zobrist_key, move.data)
+        self.weights[key] = self.weights.get(key, 0) + weight
+
+    def add_game(self, game, plies: int = 20, board: Board = None) -> None:
+        """
+        Adds the opening moves of a game, one weight per move
+        :param game: pgn.Game instance
+        :param plies: number of moves from the start of the game to add
+        :param board: Board instance to reuse
+        """
+        if board is None: board = Board(game.fen)
+        else: board.load_fen(game.fen)
+        for san in game.moves[:plies]:
+            move = san_to_move(board, san)
+            self.add(board, move)
+            board.make_move(move)
+
+    def add_pgn(self, lines: Iterable[str], plies: int = 20) -> int:
+        """
+        Adds the opening moves of every game in a PGN stream, skipping games with illegal moves
+        :param lines: iterable of lines, such as an open file
+        :param plies: number of moves from the start of each game to add
+        :return: number of games added
+        """
+        board = Board()
+        games = 0
+        for game in read_games(lines):
+            try:
+                self.add_game(game, plies, board)
+            except PGNError:
+                continue
+            games += 1
+        return games
+
+    def add_fens(self, lines: Iterable[str]) -> None:
+        """
+        Adds moves given as lines of "FEN;SAN" or "FEN;SAN;weight"
+        :param lines: iterable of lines, such as an open file
+        """
+        board = Board()
+        for line in lines:
+            line = line.strip()
+            if not line: continue
+            fen, san, *weight = line.split(";")
+            board.load_fen(fen.strip())
+            self.add(board, san_to_move(board, san.strip()), int(weight[0]) if weight else 1)
+
+    def write(self, path: str, min_weight: int = 1) -> int:
+        """
+        Writes the book sorted by key
+        :param path: path of the book file, overwritten if it exists
+        :param min_weight: weight below which moves are left out
+        :return: number of entries written
+        """
+        entries = sorted(((key, data, min(weight, MAX_WEIGHT)) for (key, data), weight in self.weights.items()
+                          if weight >= min_weight), key=lambda entry: (entry[0], -entry[2]))
+        with open(path, "wb") as file:
+            for entry in entries:
+                file.write(ENTRY_FORMAT.pack(*entry))
+        return len(entries)
+
+    def __len__(self):
+        return len(self.weights)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or probe an opening book")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="build a book from PGN games or FEN;SAN lines")
+    build.add_argument("book")
+    build.add_argument("files", nargs="+")
+    build.add_argument("--plies", type=int, default=20, help="number of moves from the start of each game")
+    build.add_argument("--min-weight", type=int, default=1)
+    probe = subparsers.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("fen", nargs="*")
+    args = parser.parse_args()
+
+    t1 = time.perf_counter()
+    if args.command == "build":
+        builder = BookBuilder()
+        for name in args.files:
+            with open(name, encoding="utf-8", errors="replace") as f:
+                if name.endswith(".pgn"): builder.add_pgn(f, args.plies)
+                else: builder.add_fens(f)
+        n = builder.write(args.book, args.min_weight)
+        print(f"Entries: {n}  Time: {time.perf_counter() - t1:.3f}s", file=sys.stderr)
+    else:
+        b = Board(" ".join(args.fen) or START_FEN)
+        with OpeningBook(args.book) as book:
+            for m, w in b.get_book_moves(book):
+                print(f"{move_to_san(b, m)} {w}")
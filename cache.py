@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+
+# slots of a cache entry
+MOVES = 0
+WIN_STATE = 1
+
+
+class PositionCache:
+    def __init__(self, maxsize: int = 100000) -> None:
+        """
+        Creates a least recently used cache of legal moves and win states keyed by Zobrist key; it can be shared by
+        any number of boards
+        :param maxsize: maximum number of positions held before the least recently used is evicted
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # zobrist key -> [packed legal moves or None, win state or None]
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: int, slot: int):
+        """
+        Looks up one result for a position, marking the position as recently used
+        :param key: Zobrist key of the position
+        :param slot: MOVES or WIN_STATE
+        :return: the stored value or None if it has not been cached
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[slot] is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[slot]
+
+    def put(self, key: int, slot: int, value) -> None:
+        """
+        Stores one result for a position, evicting the least recently used position if the cache is full
+        :param key: Zobrist key of the position
+        :param slot: MOVES or WIN_STATE
+        :param value: the value to store
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [None, None]
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        entry[slot] = value
+
+    def clear(self) -> None:
+        """
+        Removes every cached position and resets the counters
+        """
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Gets the cache counters
+        :return: dictionary of size, hits, misses and hit rate
+        """
+        lookups = self.hits + self.misses
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def __len__(self):
+        return len(self.entries)
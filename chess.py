@@ -1,12 +1,23 @@
 from __future__ import annotations
 
-from copy import deepcopy
+from copy import copy
+from typing import TYPE_CHECKING, Iterator
 
+from cache import MOVES, WIN_STATE, PositionCache
 from constants import *
 from conversions import *
+from encoding import *
+from evaluation import *
+from tables import *
+from zobrist import *
+
+if TYPE_CHECKING:
+    from book import OpeningBook
 
 
 class Square:
+    __slots__ = ("index", "piece")
+
     def __init__(self, pos: int = 0, piece: Piece = None) -> None:
         """
         Creates a square object that holds a position and piece
@@ -51,16 +62,37 @@ class Square:
 
 
 class Piece:
+    __slots__ = ("colour", "type")
+
+    _instances = {}  # one shared instance per (type, colour)
+
+    def __new__(cls, piece_type: int, colour: int) -> Piece:
+        piece = cls._instances.get((piece_type, colour))
+        if piece is None:
+            piece = cls._instances[(piece_type, colour)] = super().__new__(cls)
+        return piece
+
     def __init__(self, piece_type: int, colour: int) -> None:
         """
-        Creates a piece from a colour and type
+        Gets the shared piece of a colour and type; pieces are flyweights, so never modify one
         :param piece_type: use PAWN, KNIGHT etc. constants
         :param colour: -1 for black, 1 for white; Note: Use WHITE and BLACK constants for readability
         """
         self.colour = colour
         self.type = piece_type
 
-        self.printable = PIECES[self.type][self.colour]
+    @property
+    def printable(self) -> str:
+        return PIECES[self.type][self.colour]
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return Piece, (self.type, self.colour)
 
     @staticmethod
     def from_str(char: str) -> Piece:
@@ -159,21 +191,6 @@ class Piece:
             if o in [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)] and not board.position[
                 target_pos].has_ally_piece(self.colour):
                 return True
-            if self.colour == 1:
-                if target_pos == 62 and board.castling[0]:
-                    if not board.position[62].has_piece() and not board.position[61].has_piece():
-                        return True
-                if target_pos == 28 and board.castling[1]:
-                    if not board.position[59].has_piece() and not board.position[58].has_piece() and not board.position[
-                        57].has_piece():
-                        return True
-                if target_pos == 6 and board.castling[2]:
-                    if not board.position[6].has_piece() and not board.position[5].has_piece():
-                        return True
-                if target_pos == 2 and board.castling[3]:
-                    if not board.position[1].has_piece() and not board.position[2].has_piece() and not board.position[
-                        3].has_piece():
-                        return True
         # print(f"{self} cannot move to {indexToAlgebraic(target_pos)}")
         return False
 
@@ -189,41 +206,63 @@ class Piece:
             # c = ["", "White", "Black"][board.turn]
             # print(f"{self} cannot move because it is {c}'s turn")
             return False
-        if self.type == PAWN and self.colour == WHITE:
-            if cur_pos - target_pos == 8:
-                if not board.position[target_pos].has_piece():
-                    return True
-            elif cur_pos - target_pos == 16 and cur_pos > 47:
-                if not board.position[target_pos].has_piece() and not board.position[cur_pos - 8].has_piece():
-                    return True
-            elif (cur_pos - target_pos == 7 or cur_pos - target_pos == 9) and board.en_passant.index == target_pos:
-                    return True
-        if self.type == PAWN and self.colour == BLACK:
-            if cur_pos - target_pos == -8:
-                if not board.position[target_pos].has_piece():
-                    return True
-            elif cur_pos - target_pos == -16 and cur_pos < 16:
-                if not board.position[target_pos].has_piece() and not board.position[cur_pos + 8].has_piece():
-                    return True
-            elif cur_pos - target_pos == -7 or cur_pos - target_pos == -9:
-                if board.position[target_pos].has_enemy_piece(self.colour):
-                    return True
-                elif board.en_passant.index == target_pos:
-                    return True
-        return self.is_attacking(board, cur_pos, target_pos)
+        return any(move.target_pos == target_pos for move in board.get_piece_moves(cur_pos))
 
 
 class Move:
-    def __init__(self, start_pos: int, target_pos: int, promotion_piece: Piece = None) -> None:
+    __slots__ = ("data",)
+
+    def __init__(self, start_pos: int, target_pos: int, promotion_piece: Piece = None, flag: int = MOVE_NORMAL) -> None:
         """
-        Creates an instance of a move holding a start and end pos
+        Creates an instance of a move holding a start and end pos, packed into a 16-bit int: bits 0-5 hold the start
+        index, 6-11 the target index, 12-13 the promotion piece and 14-15 one of the MOVE_ flag constants
         :param start_pos: index of starting square
         :param target_pos: index of target square
         :param promotion_piece: Piece to promote to
+        :param flag: MOVE_EN_PASSANT or MOVE_CASTLING for special moves, set by move generation
         """
-        self.current_pos = start_pos
-        self.target_pos = target_pos
-        self.promotion_piece = promotion_piece
+        self.data = start_pos | target_pos << 6 | flag << 14
+        if promotion_piece is not None:
+            self.promotion_piece = promotion_piece
+
+    @staticmethod
+    def from_data(data: int) -> Move:
+        """
+        Creates a move from its packed 16-bit form
+        :param data: the data attribute of a move
+        :return: an instance of move
+        """
+        move = Move.__new__(Move)
+        move.data = data
+        return move
+
+    @property
+    def current_pos(self) -> int:
+        return self.data & 63
+
+    @property
+    def target_pos(self) -> int:
+        return self.data >> 6 & 63
+
+    @property
+    def flag(self) -> int:
+        return self.data >> 14
+
+    @property
+    def promotion_piece(self) -> Piece | None:
+        if self.data >> 14 != MOVE_PROMOTION: return None
+        # the colour follows from the promotion rank
+        return Piece(LEGAL_PROMOTE_PIECES[self.data >> 12 & 3], WHITE if self.data >> 6 & 63 < 8 else BLACK)
+
+    @promotion_piece.setter
+    def promotion_piece(self, piece: Piece | None) -> None:
+        if piece is None:
+            if self.flag == MOVE_PROMOTION: self.data &= 0xFFF
+            return
+        # the packed form only has room for the four legal piece types, so anything else is rejected here
+        if piece.type not in LEGAL_PROMOTE_PIECES:
+            raise ValueError(f"Invalid promotion: cannot promote to {piece}")
+        self.data = self.data & 0xFFF | LEGAL_PROMOTE_PIECES.index(piece.type) << 12 | MOVE_PROMOTION << 14
 
     def __str__(self):
         promotion = ""
@@ -234,7 +273,10 @@ class Move:
     def __eq__(self, move):
         if not isinstance(move, Move):
             raise NotImplemented
-        return move.current_pos == self.current_pos and move.target_pos == self.target_pos
+        return move.data & 0xFFF == self.data & 0xFFF
+
+    def __hash__(self):
+        return self.data & 0xFFF
 
     def is_valid(self, board: Board) -> bool:
         """
@@ -242,47 +284,50 @@ class Move:
         :param board: Board instance
         :return: true if the move is legal
         """
-        try:
-            if not board.position[self.current_pos].has_piece():
-                return False
-            if not board.position[self.current_pos].piece.can_move(board, self.current_pos, self.target_pos):
-                return False
-        except AttributeError:
-            print("Tried to move a piece that didn't exist")
+        piece = board.position[self.current_pos].piece
+        if piece is None or piece.colour != board.turn:
             return False
-        
+
         # set promotion piece to queen if no piece specified
-        if index_to_coordinate(self.target_pos)[1] in [0, 7]:
-            if self.promotion_piece == None:
-                self.promotion_piece = Piece(QUEEN, board.position[self.current_pos].piece.colour)
-
-        board.make_move(self)
-        is_check = board.is_check(-board.turn)
-        board.unmake_move()
-        if is_check:
-            # print(f"Invalid move: {-board.turn} would be in check")
-            return False
-        target_rank = index_to_coordinate(self.target_pos)[1]
-        if board.position[self.current_pos].piece.type == PAWN and (target_rank == 0 or target_rank == 7):
-            if self.promotion_piece.colour != board.turn: return False
-            if self.promotion_piece.type == KING: return False
-        return True
+        if piece.type == PAWN and index_to_coordinate(self.target_pos)[1] in [0, 7]:
+            if self.promotion_piece is None:
+                self.promotion_piece = Piece(QUEEN, piece.colour)
+
+        for move in board.get_piece_moves(self.current_pos):
+            if move.target_pos != self.target_pos:
+                continue
+            # the promotion colour follows from the target rank, so only the type needs comparing
+            if move.promotion_piece is not None and self.promotion_piece.type != move.promotion_piece.type: continue
+            return board.is_legal(self)
+        return False
 
 
 class Board:
-    def __init__(self, fen: str = START_FEN) -> None:
+    def __init__(self, fen: str = START_FEN, cache: PositionCache = None) -> None:
         """
         Creates an instance of the game
         :param fen: the FEN string for the position to load
+        :param cache: optional PositionCache to serve legal moves and win states from, which may be shared by boards
         """
-        self.position = [Square()] * 64  # empty board
+        self.position = [Square(i) for i in range(64)]  # empty board
         self.turn = WHITE
         self.castling = [False] * 4
         self.en_passant = Square(-1)  # no en passant square
         self.halfmoves = 0  # counts to 100 halfmoves (50 move rule)
         self.moves = 0
+        self.zobrist_key = 0  # 64-bit hash of the position, kept up to date by make_move/unmake_move
+        self.king_squares = {WHITE: -1, BLACK: -1}
+        # piece-square evaluation from white's point of view, kept up to date by make_move/unmake_move
+        self.mg_score = 0
+        self.eg_score = 0
+        self.phase = 0
+        self.piece_counts = {}  # number of each piece on the board
+        self.bishop_colours = [0, 0]  # number of bishops on dark and light squares
+        self.history = []  # zobrist keys of the positions since the last capture or pawn move
 
         self.saves = []
+        # entries are keyed by zobrist_key, so load_fen and make_move never need to invalidate them
+        self.cache = cache
 
         self.load_fen(fen)
 
@@ -292,20 +337,20 @@ class Board:
         :param fen_to_load: the FEN string to load onto the board
         """
         fen_string = fen_to_load.split(" ")
-        # pieces
-        pieces = []
+        # saves only record changes, so they cannot be undone onto a different position
+        self.saves = []
+        # pieces, filled into the existing squares so reloading a board allocates no new ones
+        position = self.position
         index = 0
         for char in fen_string[0]:
             if char.isnumeric():
                 for _ in range(int(char)):
-                    pieces.append(Square(index))
+                    position[index].piece = None
                     index += 1
             else:
                 if not char == "/":
-                    p = Piece.from_str(char)
-                    pieces.append(Square(index, p))
+                    position[index].piece = Piece.from_str(char)
                     index += 1
-        self.position = pieces
         # turn
         turn = WHITE
         if fen_string[1] == "b": turn = BLACK
@@ -326,7 +371,87 @@ class Board:
         self.halfmoves = int(fen_string[4])
         # moves
         self.moves = int(fen_string[5]) * 2 - 2
-        if not self.turn: self.moves += 1
+        if self.turn == BLACK: self.moves += 1
+        self._load_derived_state()
+
+    def load_bytes(self, data: bytes) -> None:
+        """
+        Loads a position written by to_bytes onto the board
+        :param data: POSITION_SIZE bytes
+        """
+        pieces, self.turn, self.castling, en_passant, self.halfmoves, fullmoves = decode_position(data)
+        self.saves = []
+        for square, piece in zip(self.position, pieces):
+            square.piece = None if piece is None else Piece(*piece)
+        self.en_passant = Square(en_passant)
+        self.moves = fullmoves * 2 - 2
+        if self.turn == BLACK: self.moves += 1
+        self._load_derived_state()
+
+    def _load_derived_state(self) -> None:
+        """
+        Recomputes everything kept up to date by make_move from the pieces, turn, castling rights and en passant square
+        """
+        # hash
+        self.zobrist_key = self.compute_zobrist_key()
+        # evaluation
+        self.mg_score, self.eg_score, self.phase = score_position(self.position)
+        # kings and material
+        self.king_squares = {WHITE: -1, BLACK: -1}
+        self.piece_counts = {Piece(piece_type, colour): 0 for piece_type in PIECES for colour in [WHITE, BLACK]}
+        self.bishop_colours = [0, 0]
+        for square in self.position:
+            if not square.has_piece(): continue
+            self.piece_counts[square.piece] += 1
+            if square.piece.type == KING:
+                self.king_squares[square.piece.colour] = square.index
+            if square.piece.type == BISHOP:
+                self.bishop_colours[square_colour(square.index)] += 1
+        # repetition
+        self.history = []
+
+    def evaluate(self) -> int:
+        """
+        Scores the position from its incrementally updated material and piece-square totals, tapered by game phase
+        :return: score in centipawns from the side to move's point of view
+        """
+        return taper(self.mg_score, self.eg_score, self.phase) * self.turn
+
+    def to_fen(self) -> str:
+        """
+        Writes the position as a FEN string
+        :return: the FEN string of the position
+        """
+        rows = []
+        for r in range(8):
+            row, empty = "", 0
+            for square in self.position[8 * r:8 * r + 8]:
+                if square.piece is None:
+                    empty += 1
+                    continue
+                if empty: row += str(empty)
+                row, empty = row + square.piece.printable, 0
+            if empty: row += str(empty)
+            rows.append(row)
+        castling = "".join(char for char, right in zip("KQkq", self.castling) if right) or "-"
+        en_passant = "-" if self.en_passant.index == -1 else index_to_algebraic(self.en_passant.index)
+        turn = "w" if self.turn == WHITE else "b"
+        return f"{'/'.join(rows)} {turn} {castling} {en_passant} {self.halfmoves} {self.moves // 2 + 1}"
+
+    def to_bytes(self) -> bytes:
+        """
+        Packs the position into POSITION_SIZE bytes, see encoding.py for the layout
+        :return: the encoded position
+        """
+        return encode_position(self.position, self.turn, self.castling, self.en_passant.index, self.halfmoves,
+                               self.moves // 2 + 1)
+
+    def compute_zobrist_key(self) -> int:
+        """
+        Computes the Zobrist key of the position from scratch
+        :return: 64-bit hash of the pieces, turn, castling rights and en passant file
+        """
+        return hash_position(self.position, self.turn, self.castling, self.en_passant.index)
 
     def __str__(self):
         t = "\n    a   b   c   d   e   f   g   h  \n  +---+---+---+---+---+---+---+---+\n8 | # | # | # | # | # | # | " \
@@ -347,68 +472,88 @@ class Board:
 
     def make_move(self, move: Move) -> None:
         """
-        Makes a move on the board
+        Makes a move on the board, recording only what it changes so that it can be undone
         :param move: Move instance to make
         """
+        position = self.position
+        start, target = move.data & 63, move.data >> 6 & 63
+        p = position[start].piece
 
-        self.saves.append(SaveState(self))
+        state = SaveState(self, move)
+        self.saves.append(state)
 
-        p = self.position[move.current_pos].piece
+        key = self.zobrist_key ^ TURN_KEY ^ en_passant_key(position, self.en_passant.index, self.turn)
 
-        # print(p,self.board[move.target_pos], sep="")
+        # capture, including the pawn taken en passant
+        captured_pos = target
+        if p.type == PAWN and target == self.en_passant.index:
+            captured_pos = target + 8 * p.colour
+        state.captured_pos = captured_pos
+        captured = state.captured = position[captured_pos].piece
+        position[captured_pos].piece = None
+        key ^= PIECE_KEYS[p.type][p.colour][start]
+        mg = self.mg_score - MG_TABLE[p.type][p.colour][start]
+        eg = self.eg_score - EG_TABLE[p.type][p.colour][start]
+        if captured is not None:
+            key ^= PIECE_KEYS[captured.type][captured.colour][captured_pos]
+            mg -= MG_TABLE[captured.type][captured.colour][captured_pos]
+            eg -= EG_TABLE[captured.type][captured.colour][captured_pos]
+            self.phase -= PHASE_WEIGHTS[captured.type]
 
-        # en passant
-        if self.en_passant.index == move.target_pos:
-            self.position[move.target_pos + 8 * p.colour].piece = None
-        if p.type == PAWN and abs(move.current_pos - move.target_pos) == 16:
-            self.en_passant = Square(move.target_pos + 8 * p.colour)
-        else:
+        if p.type == PAWN and abs(start - target) == 16:
+            self.en_passant = Square(target + 8 * p.colour)
+            key ^= en_passant_key(position, self.en_passant.index, -p.colour)
+        elif self.en_passant.index != -1:
             self.en_passant = Square(-1)
 
         # castling
         if p.type == KING:
-            if p.colour == WHITE:
-                self.castling[0] = False
-                self.castling[1] = False
-            if p.colour == BLACK:
-                self.castling[2] = False
-                self.castling[3] = False
-        if p.type == ROOK:
-            if p.colour == WHITE:
-                if move.current_pos == 63: self.castling[0] = False
-                if move.current_pos == 56: self.castling[1] = False
-            if p.colour == BLACK:
-                if move.current_pos == 7: self.castling[2] = False
-                if move.current_pos == 0: self.castling[3] = False
-        if p.type == KING and abs(move.current_pos - move.target_pos) == 2:
-            if move.target_pos == 62:  # White KS
-                self.position[61].piece = self.position[63].piece
-                self.position[63].piece = None
-            if move.target_pos == 58:  # White QS
-                self.position[59].piece = self.position[56].piece
-                self.position[56].piece = None
-            if move.target_pos == 6:  # Black KS
-                self.position[5].piece = self.position[5].piece
-                self.position[7].piece = None
-            if move.target_pos == 2:  # Black QS
-                self.position[3].piece = self.position[0].piece
-                self.position[0].piece = None
-
-        self.position[move.target_pos].piece = self.position[move.current_pos].piece
-        self.position[move.current_pos].piece = None
+            self.king_squares[p.colour] = target
+        if p.type == KING and abs(start - target) == 2:
+            for king_start, king_target, rook_start, rook_target, _ in CASTLING_MOVES:
+                if start == king_start and target == king_target:
+                    rook = position[rook_target].piece = position[rook_start].piece
+                    position[rook_start].piece = None
+                    state.rook_move = (rook_start, rook_target)
+                    key ^= PIECE_KEYS[ROOK][rook.colour][rook_start] ^ PIECE_KEYS[ROOK][rook.colour][rook_target]
+                    mg += MG_TABLE[ROOK][rook.colour][rook_target] - MG_TABLE[ROOK][rook.colour][rook_start]
+                    eg += EG_TABLE[ROOK][rook.colour][rook_target] - EG_TABLE[ROOK][rook.colour][rook_start]
+        # the castling list is replaced rather than modified so saves and clones can share it
+        for i, (king_start, _, rook_start, _, _) in enumerate(CASTLING_MOVES):
+            if self.castling[i] and (start == king_start or start == rook_start or target == rook_start):
+                if self.castling is state.castling: self.castling = self.castling.copy()
+                self.castling[i] = False
+                key ^= CASTLING_KEYS[i]
+
+        placed = p
+        if p.type == PAWN and (target < 8 or target > 55):
+            placed = move.promotion_piece or Piece(QUEEN, p.colour)
+            self.phase += PHASE_WEIGHTS[placed.type]
+        position[target].piece = placed
+        position[start].piece = None
+        self.zobrist_key = key ^ PIECE_KEYS[placed.type][placed.colour][target]
+        self.mg_score = mg + MG_TABLE[placed.type][placed.colour][target]
+        self.eg_score = eg + EG_TABLE[placed.type][placed.colour][target]
+
+        # material counts only change on captures and promotions
+        if captured is not None:
+            self.piece_counts[captured] -= 1
+            if captured.type == BISHOP: self.bishop_colours[square_colour(captured_pos)] -= 1
+        if placed is not p:
+            self.piece_counts[p] -= 1
+            self.piece_counts[placed] += 1
+            if placed.type == BISHOP: self.bishop_colours[square_colour(target)] += 1
+        # a position cannot repeat one from before a capture or pawn move
+        if p.type == PAWN or captured is not None:
+            state.history = self.history
+            self.history = []
+        else:
+            self.history.append(state.zobrist_key)
 
         self.turn *= -1
         self.moves += 1
         self.halfmoves += 1
-
-        if p.type == PAWN: self.halfmoves = 0
-        if self.is_check(self.turn): self.halfmoves = 0
-
-        if p.type == PAWN:
-            if p.colour == WHITE and index_to_coordinate(move.target_pos)[1] == 0:
-                self.position[move.target_pos].piece = move.promotion_piece
-            if p.colour == BLACK and index_to_coordinate(move.target_pos)[1] == 7:
-                self.position[move.target_pos].piece = move.promotion_piece
+        if p.type == PAWN or state.captured is not None: self.halfmoves = 0
 
     def unmake_move(self) -> None:
         """
@@ -419,97 +564,558 @@ class Board:
 
     def load_state(self, state: SaveState) -> None:
         """
-        Loads a previous position onto the board
-        :param state: The save instance to go back to
+        Reverts the move recorded by a save; it must be the most recent move made on the board
+        :param state: The save instance of the move to undo
         """
-        self.position = deepcopy(state.position)
-        self.turn = state.turn
+        position = self.position
+        move = state.move
+        start, target = move.data & 63, move.data >> 6 & 63
+        placed = position[target].piece
+        position[start].piece = state.piece
+        position[target].piece = None
+        position[state.captured_pos].piece = state.captured
+        if state.piece.type == KING:
+            self.king_squares[state.piece.colour] = start
+        if state.rook_move is not None:
+            rook_start, rook_target = state.rook_move
+            position[rook_start].piece = position[rook_target].piece
+            position[rook_target].piece = None
+        self.turn = -self.turn
         self.castling = state.castling
         self.en_passant = state.en_passant
         self.halfmoves = state.halfmoves
         self.moves = state.moves
+        self.zobrist_key = state.zobrist_key
+        self.mg_score, self.eg_score, self.phase = state.mg_score, state.eg_score, state.phase
+        captured = state.captured
+        if captured is not None:
+            self.piece_counts[captured] += 1
+            if captured.type == BISHOP: self.bishop_colours[square_colour(state.captured_pos)] += 1
+        if placed is not state.piece:
+            self.piece_counts[placed] -= 1
+            self.piece_counts[state.piece] += 1
+            if placed.type == BISHOP: self.bishop_colours[square_colour(target)] -= 1
+        if state.history is None:
+            self.history.pop()
+        else:
+            # copied because this board will append to it while clones may still hold the same save
+            self.history = state.history.copy()
 
     def get_win_state(self) -> int:
         """
         Checks if game has ended
         :return: Constant: either WHITE, BLACK, DRAW or NO_RESULT
         """
-        l = self.get_legal_moves()
-        if len(l) == 0:
-            if self.is_check(self.turn):
-                return -self.turn
-            else:
-                return DRAW
-        if self.halfmoves >= 100: return 0
-        return NO_RESULT
+        result = None if self.cache is None else self.cache.get(self.zobrist_key, WIN_STATE)
+        if result is None:
+            result = NO_RESULT
+            if not self.has_legal_move():
+                result = -self.turn if self.is_check(self.turn) else DRAW
+            if self.cache is not None: self.cache.put(self.zobrist_key, WIN_STATE, result)
+        # the clocks and history are not part of the key, so these draws are applied after the cache
+        if result == NO_RESULT:
+            if self.halfmoves >= 100 or self.is_repetition() or self.is_insufficient_material(): return DRAW
+        return result
+
+    def get_position_state(self) -> tuple[int, list[Move], bool]:
+        """
+        Gets the win state along with the legal moves and check it follows from, generating the moves only once
+        :return: (WHITE, BLACK, DRAW or NO_RESULT constant, list of legal moves, whether the side to move is in check)
+        """
+        moves = self.get_legal_moves()
+        in_check = self.is_check(self.turn)
+        if not moves: return (-self.turn if in_check else DRAW), moves, in_check
+        if self.halfmoves >= 100 or self.is_repetition() or self.is_insufficient_material():
+            return DRAW, moves, in_check
+        return NO_RESULT, moves, in_check
+
+    def get_book_moves(self, book: OpeningBook) -> list[tuple[Move, int]]:
+        """
+        Looks up the current position in an opening book
+        :param book: OpeningBook instance
+        :return: list of (Move, weight) for the legal book moves, most played first
+        """
+        entries = book.lookup(self.zobrist_key)
+        if not entries: return []
+        # a key collision could return moves from another position
+        legal = {move.data for move in self.get_legal_moves()}
+        return [(Move.from_data(data), weight) for data, weight in entries if data in legal]
+
+    def repetition_count(self) -> int:
+        """
+        Counts how many times the current position has occurred since the last capture or pawn move
+        :return: number of occurrences, including the current one
+        """
+        # positions with the same side to move are an even number of plies apart
+        return self.history[-2::-2].count(self.zobrist_key) + 1
+
+    def is_repetition(self, count: int = 3) -> bool:
+        """
+        Checks if the current position has occurred at least a number of times
+        :param count: number of occurrences, 3 for the threefold repetition rule
+        :return: true if the position has been repeated enough times
+        """
+        return len(self.history) >= 2 * count - 2 and self.repetition_count() >= count
+
+    def is_insufficient_material(self) -> bool:
+        """
+        Checks if neither side can possibly checkmate: bare kings with at most one minor piece, or only bishops that
+        all stand on squares of one colour
+        :return: true if the position is dead
+        """
+        counts = self.piece_counts
+        for colour in [WHITE, BLACK]:
+            if counts[Piece(PAWN, colour)] or counts[Piece(ROOK, colour)] or counts[Piece(QUEEN, colour)]:
+                return False
+        knights = counts[Piece(KNIGHT, WHITE)] + counts[Piece(KNIGHT, BLACK)]
+        bishops = self.bishop_colours[0] + self.bishop_colours[1]
+        if knights + bishops <= 1: return True
+        return knights == 0 and (self.bishop_colours[0] == 0 or self.bishop_colours[1] == 0)
 
     def get_legal_moves(self) -> list[Move]:
         """
         Gets an array of all legal moves
         :return: a list of all the legal moves as move instances
         """
+        if self.cache is None:
+            return list(self.iter_legal_moves())
+        packed = self.cache.get(self.zobrist_key, MOVES)
+        if packed is None:
+            moves = list(self.iter_legal_moves())
+            self.cache.put(self.zobrist_key, MOVES, tuple(move.data for move in moves))
+            return moves
+        return [Move.from_data(data) for data in packed]
+
+    def iter_legal_moves(self) -> Iterator[Move]:
+        """
+        Yields the legal moves one at a time, only generating a piece's moves once the previous pieces are exhausted;
+        any move made between yields must be unmade before resuming
+        :return: a generator of legal move instances
+        """
+        analysis = self.analyse_checks()
+        if len(analysis.checkers) > 1:
+            # only the king can escape a double check
+            for move in self.get_piece_moves(analysis.king):
+                if self.is_legal(move, analysis):
+                    yield move
+            return
+        for square in self.position:
+            if square.has_ally_piece(self.turn):
+                for move in self.get_piece_moves(square.index):
+                    if self.is_legal(move, analysis):
+                        yield move
+
+    def get_tactical_moves(self) -> list[Move]:
+        """
+        Gets the legal captures and promotions, ordered by most valuable victim and then least valuable attacker, by
+        looking outwards from each enemy piece for its attackers rather than generating every move
+        :return: a list of capture and promotion move instances
+        """
+        analysis = self.analyse_checks()
+        position = self.position
+        colour = self.turn
+        promotion_row = range(8, 16) if colour == WHITE else range(48, 56)
+        candidates = []  # (victim type, attacker type, move); piece types double as their values
+        for square in position:
+            victim = square.piece
+            if victim is None or victim.colour == colour or victim.type == KING: continue
+            for start in self._iter_attackers(square.index, colour):
+                attacker = position[start].piece.type
+                if attacker == PAWN and start in promotion_row:
+                    for piece_type in LEGAL_PROMOTE_PIECES:
+                        candidates.append((victim.type + piece_type, attacker,
+                                           Move(start, square.index, Piece(piece_type, colour))))
+                else:
+                    candidates.append((victim.type, attacker, Move(start, square.index)))
+        en_passant = self.en_passant.index
+        if en_passant != -1:
+            for start in PAWN_ATTACKS[-colour][en_passant]:
+                piece = position[start].piece
+                if piece is not None and piece.type == PAWN and piece.colour == colour:
+                    candidates.append((PAWN, PAWN, Move(start, en_passant, flag=MOVE_EN_PASSANT)))
+        for start in promotion_row:
+            piece = position[start].piece
+            if piece is not None and piece.type == PAWN and piece.colour == colour and \
+                    position[start - 8 * colour].piece is None:
+                for piece_type in LEGAL_PROMOTE_PIECES:
+                    candidates.append((piece_type, PAWN, Move(start, start - 8 * colour, Piece(piece_type, colour))))
+        candidates.sort(key=lambda candidate: candidate[1] - 16 * candidate[0])
+        return [move for _, _, move in candidates if self.is_legal(move, analysis)]
+
+    def see(self, move: Move) -> int:
+        """
+        Statically evaluates the exchange a capture starts on its target square, with both sides recapturing with their
+        least valuable attacker for as long as it pays, without making any moves
+        :param move: a legal capture or promotion of the side to move
+        :return: the material the side to move wins, in the piece values of constants.py
+        """
+        position = self.position
+        start, target = move.data & 63, move.data >> 6 & 63
+        piece = position[start].piece
+        removed = {start}  # squares whose pieces have joined the exchange, uncovering any slider behind them
+        victim = position[target].piece
+        gain = [0 if victim is None else victim.type]
+        if piece.type == PAWN and target == self.en_passant.index:
+            gain[0] = PAWN
+            removed.add(target + 8 * piece.colour)
+        promotes = target < 8 or target > 55
+        on_target = piece.type
+        if piece.type == PAWN and promotes:
+            on_target = QUEEN if move.promotion_piece is None else move.promotion_piece.type
+            gain[0] += on_target - PAWN
+
+        colour = -piece.colour
+        while True:
+            attacker = self._least_valuable_attacker(target, colour, removed)
+            if attacker is None: break
+            index, attacker_type = attacker
+            # the king can only recapture onto an undefended square
+            if attacker_type == KING and self._least_valuable_attacker(target, -colour, removed | {index}): break
+            gain.append(on_target - gain[-1])
+            if max(-gain[-2], gain[-1]) < 0: break  # neither side would choose to continue
+            removed.add(index)
+            on_target = attacker_type
+            if attacker_type == PAWN and promotes:
+                gain[-1] += QUEEN - PAWN
+                on_target = QUEEN
+            colour = -colour
+        for i in range(len(gain) - 1, 0, -1):
+            gain[i - 1] = -max(-gain[i - 1], gain[i])
+        return gain[0]
+
+    def _least_valuable_attacker(self, square: int, colour: WHITE | BLACK, removed: set[int]) -> tuple[int, int] | None:
+        """
+        Finds the cheapest piece of a colour attacking a square, treating some squares as empty
+        :param square: index of the attacked square
+        :param colour: WHITE or BLACK constant of the attacking side
+        :param removed: indices of squares to treat as empty
+        :return: (index, piece type) of the attacker, or None if there is none
+        """
+        position = self.position
+        for targets, piece_type in [(PAWN_ATTACKS[-colour][square], PAWN), (KNIGHT_TARGETS[square], KNIGHT)]:
+            for index in targets:
+                piece = position[index].piece
+                if piece is not None and piece.type == piece_type and piece.colour == colour and index not in removed:
+                    return index, piece_type
+        best = None
+        for rays, slider in [(BISHOP_RAYS[square], BISHOP), (ROOK_RAYS[square], ROOK)]:
+            for ray in rays:
+                for index in ray:
+                    piece = position[index].piece
+                    if piece is None or index in removed: continue
+                    if piece.colour == colour and (piece.type == slider or piece.type == QUEEN) and \
+                            (best is None or piece.type < best[1]):
+                        best = index, piece.type
+                    break
+        if best is not None: return best
+        for index in KING_TARGETS[square]:
+            piece = position[index].piece
+            if piece is not None and piece.type == KING and piece.colour == colour and index not in removed:
+                return index, KING
+        return None
+
+    def has_legal_move(self) -> bool:
+        """
+        Checks if the side to move has any legal move, stopping at the first one found
+        :return: true if at least one legal move exists
+        """
+        return next(self.iter_legal_moves(), None) is not None
+
+    def get_pseudo_legal_moves(self) -> list[Move]:
+        """
+        Gets the moves of every piece of the side to move, including moves that leave its king in check
+        :return: a list of candidate moves as move instances
+        """
         moves = []
-        for si in range(64):
-            for ti in range(64):
-                start_square = self.position[si]
-                if start_square.has_piece():
-                    target_rank = index_to_coordinate(ti)[1]
-                    if start_square.piece.type == PAWN and (target_rank == 0 or target_rank == 7):
-                        for piece_type in LEGAL_PROMOTE_PIECES:
-                            move = Move(si, ti, Piece(piece_type, self.turn))
-                            if move.is_valid(self):
-                                moves.append(move)
+        for square in self.position:
+            if square.has_ally_piece(self.turn):
+                moves += self.get_piece_moves(square.index)
+        return moves
+
+    def get_piece_moves(self, index: int) -> list[Move]:
+        """
+        Gets the pseudo-legal moves of the piece on a square by walking its offsets and rays
+        :param index: index of the square holding the piece
+        :return: a list of candidate moves as move instances
+        """
+        moves = []
+        position = self.position
+        piece = position[index].piece
+        if piece is None: return moves
+        colour = piece.colour
+
+        if piece.type == PAWN:
+            targets = []
+            forward = index - 8 * colour
+            if 0 <= forward < 64 and not position[forward].has_piece():
+                targets.append(forward)
+                start_row = 6 if colour == WHITE else 1
+                if index // 8 == start_row and not position[forward - 8 * colour].has_piece():
+                    targets.append(forward - 8 * colour)
+            for target in PAWN_ATTACKS[colour][index]:
+                if position[target].has_enemy_piece(colour) or target == self.en_passant.index:
+                    targets.append(target)
+            for target in targets:
+                if target < 8 or target > 55:
+                    for piece_type in LEGAL_PROMOTE_PIECES:
+                        moves.append(Move(index, target, Piece(piece_type, colour)))
+                elif target == self.en_passant.index:
+                    moves.append(Move(index, target, flag=MOVE_EN_PASSANT))
+                else:
+                    moves.append(Move(index, target))
+        elif piece.type == KNIGHT or piece.type == KING:
+            for target in (KNIGHT_TARGETS if piece.type == KNIGHT else KING_TARGETS)[index]:
+                if not position[target].has_ally_piece(colour):
+                    moves.append(Move(index, target))
+            if piece.type == KING:
+                moves += self.get_castling_moves(colour)
+        else:
+            for ray in SLIDER_RAYS[piece.type][index]:
+                for target in ray:
+                    target_piece = position[target].piece
+                    if target_piece is None:
+                        moves.append(Move(index, target))
                     else:
-                        move = Move(si, ti)
-                        if move.is_valid(self):
-                            moves.append(move)
+                        if target_piece.colour != colour:
+                            moves.append(Move(index, target))
+                        break
+        return moves
+
+    def get_castling_moves(self, colour: WHITE | BLACK) -> list[Move]:
+        """
+        Gets the castling moves allowed by a colour's castling rights and empty squares; whether the king castles out
+        of or through check is left to the legality filter
+        :param colour: WHITE or BLACK constant of the castling side
+        :return: a list of castling moves as move instances
+        """
+        moves = []
+        for i, (king_start, king_target, rook_start, rook_target, empty) in enumerate(CASTLING_MOVES):
+            if not self.castling[i] or (colour == WHITE) != (i < 2):
+                continue
+            king = self.position[king_start].piece
+            rook = self.position[rook_start].piece
+            if king is None or king.type != KING or king.colour != colour:
+                continue
+            if rook is None or rook.type != ROOK or rook.colour != colour:
+                continue
+            if any(self.position[s].has_piece() for s in empty):
+                continue
+            moves.append(Move(king_start, king_target, flag=MOVE_CASTLING))
         return moves
 
+    def analyse_checks(self) -> CheckAnalysis:
+        """
+        Finds the pieces checking the side to move, its pinned pieces and the squares its king may not step onto
+        :return: a CheckAnalysis of the current position
+        """
+        colour = self.turn
+        position = self.position
+        king = self.king_squares[colour]
+        analysis = CheckAnalysis(king)
+
+        for target in PAWN_ATTACKS[colour][king]:
+            piece = position[target].piece
+            if piece is not None and piece.type == PAWN and piece.colour != colour:
+                analysis.add_checker(target, [target])
+        for target in KNIGHT_TARGETS[king]:
+            piece = position[target].piece
+            if piece is not None and piece.type == KNIGHT and piece.colour != colour:
+                analysis.add_checker(target, [target])
+        for rays, slider in [(BISHOP_RAYS[king], BISHOP), (ROOK_RAYS[king], ROOK)]:
+            for ray in rays:
+                pinned = None
+                for distance, target in enumerate(ray):
+                    piece = position[target].piece
+                    if piece is None:
+                        continue
+                    if piece.colour == colour:
+                        if pinned is not None: break
+                        pinned = target
+                        continue
+                    if piece.type == slider or piece.type == QUEEN:
+                        if pinned is None:
+                            analysis.add_checker(target, ray[:distance + 1])
+                        else:
+                            analysis.pins[pinned] = set(ray[:distance + 1])
+                    break
+
+        analysis.danger = self.get_attacked_squares(-colour, ignore=king)
+        return analysis
+
+    def get_attacked_squares(self, colour: WHITE | BLACK, ignore: int = -1) -> set[int]:
+        """
+        Gets every square attacked by a colour
+        :param colour: WHITE or BLACK constant of the attacking side
+        :param ignore: index of a square sliders can see through, e.g. the king they are attacking
+        :return: set of attacked square indices
+        """
+        attacked = set()
+        position = self.position
+        for square in position:
+            piece = square.piece
+            if piece is None or piece.colour != colour:
+                continue
+            index = square.index
+            if piece.type == PAWN:
+                attacked.update(PAWN_ATTACKS[colour][index])
+            elif piece.type == KNIGHT:
+                attacked.update(KNIGHT_TARGETS[index])
+            elif piece.type == KING:
+                attacked.update(KING_TARGETS[index])
+            else:
+                for ray in SLIDER_RAYS[piece.type][index]:
+                    for target in ray:
+                        attacked.add(target)
+                        if target != ignore and position[target].piece is not None:
+                            break
+        return attacked
+
+    def is_legal(self, move: Move, analysis: CheckAnalysis = None) -> bool:
+        """
+        Checks that a pseudo-legal move of the side to move does not leave its king in check, using the position's
+        checks and pins rather than making the move
+        :param move: Move instance to test
+        :param analysis: the result of analyse_checks for this position, computed if not given
+        :return: true if the move is legal
+        """
+        if analysis is None: analysis = self.analyse_checks()
+        start, target = move.data & 63, move.data >> 6 & 63
+        piece = self.position[start].piece
+        if piece.type == KING:
+            if abs(start - target) == 2:
+                pass_square = (start + target) // 2
+                return not analysis.checkers and pass_square not in analysis.danger and target not in analysis.danger
+            return target not in analysis.danger
+        if len(analysis.checkers) > 1:
+            return False
+        if piece.type == PAWN and target == self.en_passant.index:
+            # the captured pawn leaves its square too, which can uncover a check along the rank
+            return self.is_king_safe_after(move)
+        if analysis.checkers and target not in analysis.block:
+            return False
+        if start in analysis.pins and target not in analysis.pins[start]:
+            return False
+        return True
+
+    def is_king_safe_after(self, move: Move) -> bool:
+        """
+        Checks that a pseudo-legal move does not leave the mover's king in check
+        :param move: Move instance to test
+        :return: true if the move is legal
+        """
+        self.make_move(move)
+        is_check = self.is_check(-self.turn)
+        self.unmake_move()
+        return not is_check
+
     def is_check(self, colour: WHITE | BLACK) -> bool:
         """
         Checks if specified colour's king is in check
         :param colour: WHITE or BLACK constant of specified king
         :return: true if given king is in check
         """
-        king_pos = None
-        for square in self.position:
-            if square.has_piece():
-                if square.piece.type == KING and square.piece.colour == colour:
-                    king_pos = square.index
-                    break
-        for square in self.position:
-            if square.has_piece() and square.piece.colour == -colour:
-                if square.piece.is_attacking(self, square.index, king_pos):
-                    return True
-        return False
+        return self.is_attacked(self.king_squares[colour], -colour)
+
+    def attackers_of(self, square: int, colour: WHITE | BLACK) -> set[int]:
+        """
+        Finds the pieces of a colour attacking a square, whatever stands on it, by looking outwards from the square
+        :param square: index of the attacked square
+        :param colour: WHITE or BLACK constant of the attacking side
+        :return: set of indices of the attacking pieces
+        """
+        return set(self._iter_attackers(square, colour))
+
+    def is_attacked(self, square: int, colour: WHITE | BLACK) -> bool:
+        """
+        Checks if any piece of a colour attacks a square, stopping at the first attacker found
+        :param square: index of the attacked square
+        :param colour: WHITE or BLACK constant of the attacking side
+        :return: true if the square is attacked
+        """
+        return next(self._iter_attackers(square, colour), None) is not None
+
+    def _iter_attackers(self, square: int, colour: WHITE | BLACK) -> Iterator[int]:
+        """
+        Yields the pieces of a colour attacking a square by casting rays and piece offsets from the square
+        :param square: index of the attacked square
+        :param colour: WHITE or BLACK constant of the attacking side
+        :return: a generator of attacking piece indices
+        """
+        position = self.position
+        # a pawn of the other colour on the square would attack exactly the squares attacking pawns stand on
+        for targets, piece_type in [(PAWN_ATTACKS[-colour][square], PAWN), (KNIGHT_TARGETS[square], KNIGHT),
+                                    (KING_TARGETS[square], KING)]:
+            for index in targets:
+                piece = position[index].piece
+                if piece is not None and piece.type == piece_type and piece.colour == colour:
+                    yield index
+        for rays, slider in [(BISHOP_RAYS[square], BISHOP), (ROOK_RAYS[square], ROOK)]:
+            for ray in rays:
+                for index in ray:
+                    piece = position[index].piece
+                    if piece is not None:
+                        if piece.colour == colour and (piece.type == slider or piece.type == QUEEN):
+                            yield index
+                        break
 
-    def clone(self) -> Board:
+    def clone(self, history: bool = True) -> Board:
         """
-        Copies all the data in the board
+        Copies the board by copying its 64 squares and scalar state; pieces, saves and the castling list are never
+        modified in place so they are shared rather than copied
+        :param history: whether the clone can unmake the moves already made, at the cost of copying the list of saves
         :return: a different identical instance of Board
         """
-        return deepcopy(self)
+        board = copy(self)
+        board.position = [Square(square.index, square.piece) for square in self.position]
+        board.king_squares = self.king_squares.copy()
+        board.piece_counts = self.piece_counts.copy()
+        board.bishop_colours = self.bishop_colours.copy()
+        board.history = self.history.copy()
+        board.saves = self.saves.copy() if history else []
+        return board
+
+
+class CheckAnalysis:
+    def __init__(self, king: int) -> None:
+        """
+        Creates an empty record of the checks and pins against the side to move
+        :param king: index of the side to move's king
+        """
+        self.king = king
+        self.checkers = []  # indices of the pieces giving check
+        self.block = set()  # squares that capture or block a single checker
+        self.pins = {}  # index of each pinned piece to the squares it can move to along its pin
+        self.danger = set()  # squares attacked by the opponent, seeing through the king
+
+    def add_checker(self, index: int, block: list[int]) -> None:
+        """
+        Records a piece giving check
+        :param index: index of the checking piece
+        :param block: squares from the king up to and including the checker
+        """
+        self.checkers.append(index)
+        self.block.update(block)
 
 
 class SaveState:
-    def __init__(self, board: Board) -> None:
+    def __init__(self, board: Board, move: Move) -> None:
         """
-        Creates a save instance from a position
-        :param board: Board instance to save
+        Creates a save instance holding just what a move is about to change on the board
+        :param board: Board instance the move is made on
+        :param move: Move instance being made
         """
-        self.position = deepcopy(board.position)
-        self.turn = board.turn
-        self.castling = board.castling.copy()
+        self.move = move
+        self.piece = board.position[move.data & 63].piece
+        self.captured = None
+        self.captured_pos = move.data >> 6 & 63
+        self.rook_move = None
+        self.castling = board.castling
         self.en_passant = board.en_passant
         self.halfmoves = board.halfmoves
         self.moves = board.moves
-
-    def __eq__(self, other):
-        if not isinstance(other, (SaveState, Board)):
-            return NotImplemented
-        return self.position == other.position
-
-    __str__ = Board.__str__
+        self.zobrist_key = board.zobrist_key
+        self.mg_score, self.eg_score, self.phase = board.mg_score, board.eg_score, board.phase
+        self.history = None  # the board's history, kept here when the move clears it
 
 
 if __name__ == '__main__':
@@ -536,12 +1142,3 @@ if __name__ == '__main__':
             print(f"{mv} is not legal")
 
     print(["Draw", "White won", "Black won"][r])
-
-# Alternate main for benchmarking move generation
-#if __name__ == "__main__":
-#    import time
-#    b = Board()  # change fen to benchmark different positions
-#    t1 = time.time()
-#    b.get_legal_moves()
-#    t2 = time.time()
-#    print(f"Total time = {t2-t1}")
@@ -40,4 +40,25 @@ LEGAL_PROMOTE_PIECES = [
     BISHOP,
     ROOK,
     QUEEN
-]
\ No newline at end of file
+]
+
+# (col, row) offsets used by move generation
+KNIGHT_OFFSETS = [(1, 2), (1, -2), (-1, 2), (-1, -2), (2, 1), (2, -1), (-2, 1), (-2, -1)]
+KING_OFFSETS = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)]
+BISHOP_DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+ROOK_DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+QUEEN_DIRECTIONS = BISHOP_DIRECTIONS + ROOK_DIRECTIONS
+
+# (king start, king target, rook start, rook target, squares that must be empty) indexed like Board.castling
+CASTLING_MOVES = [
+    (60, 62, 63, 61, (61, 62)),
+    (60, 58, 56, 59, (57, 58, 59)),
+    (4, 6, 7, 5, (5, 6)),
+    (4, 2, 0, 3, (1, 2, 3)),
+]
+
+# Move flags stored in the top two bits of a packed move
+MOVE_NORMAL = 0
+MOVE_PROMOTION = 1
+MOVE_EN_PASSANT = 2
+MOVE_CASTLING = 3
@@ -39,4 +39,14 @@ def coordinate_to_index(square: Tuple[int, int]) -> int:
     :return: index from 0-63
     """
     c, r = square
-    return c + r * 8
\ No newline at end of file
+    return c + r * 8
+
+
+def square_colour(i: int) -> int:
+    """
+    Gets the colour of a square
+    :param i: index from 0-63
+    :return: 0 for a dark square, 1 for a light square
+    """
+    c, r = index_to_coordinate(i)
+    return (c + r + 1) % 2
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import struct
+
+from constants import *
+
+# a position is packed into POSITION_SIZE bytes, little endian:
+#   8 bytes   occupancy, bit i set if square i (from a8) holds a piece
+#   16 bytes  a 4-bit code for each occupied square in index order, low nibble first; a legal position has at most
+#             32 pieces
+#   1 byte    bit 0 set if black is to move, bits 1-4 the castling rights KQkq
+#   1 byte    en passant square index, 255 if there is none
+#   1 byte    halfmove clock, saturating at 255
+#   2 bytes   fullmove number, saturating at 65535
+#   3 bytes   zero padding
+POSITION_FORMAT = struct.Struct("<Q16sBBBH3x")
+POSITION_SIZE = POSITION_FORMAT.size
+MAX_ENCODED_PIECES = 32
+
+NO_EN_PASSANT = 255
+
+# piece codes: the type in the low 3 bits, bit 3 set for black
+TYPE_CODES = {PAWN: 1, KNIGHT: 2, BISHOP: 3, ROOK: 4, QUEEN: 5, KING: 6}
+CODE_TYPES = {code: piece_type for piece_type, code in TYPE_CODES.items()}
+
+
+def encode_position(position: list, turn: int, castling: list[bool], en_passant: int, halfmoves: int,
+                    fullmoves: int) -> bytes:
+    """
+    Packs a position into POSITION_SIZE bytes
+    :param position: list of Square instances starting from a8
+    :param turn: WHITE or BLACK
+    :param castling: castling rights in the order KQkq
+    :param en_passant: index of the en passant square, -1 if there is none
+    :param halfmoves: halfmove clock
+    :param fullmoves: fullmove number
+    :return: the encoded position
+    """
+    occupancy = 0
+    codes = []
+    for square in position:
+        piece = square.piece
+        if piece is not None:
+            occupancy |= 1 << square.index
+            codes.append(TYPE_CODES[piece.type] | (8 if piece.colour == BLACK else 0))
+    if len(codes) > MAX_ENCODED_PIECES:
+        raise Exception(f"cannot encode a position with more than {MAX_ENCODED_PIECES} pieces")
+    codes += [0] * (MAX_ENCODED_PIECES - len(codes))
+    packed = bytes(codes[i] | codes[i + 1] << 4 for i in range(0, MAX_ENCODED_PIECES, 2))
+    flags = (turn == BLACK) | sum(right << (i + 1) for i, right in enumerate(castling))
+    return POSITION_FORMAT.pack(occupancy, packed, flags, NO_EN_PASSANT if en_passant == -1 else en_passant,
+                                min(halfmoves, 255), min(fullmoves, 65535))
+
+
+def decode_position(data: bytes) -> tuple[list[tuple[int, int] | None], int, list[bool], int, int, int]:
+    """
+    Unpacks a position written by encode_position
+    :param data: POSITION_SIZE bytes
+    :return: ((type, colour) or None for each square from a8, turn, castling rights KQkq, en passant index or -1,
+             halfmove clock, fullmove number)
+    """
+    occupancy, packed, flags, en_passant, halfmoves, fullmoves = POSITION_FORMAT.unpack(data)
+    pieces = [None] * 64
+    n = 0
+    while occupancy:
+        low = occupancy & -occupancy
+        code = packed[n >> 1] >> (n & 1) * 4 & 15
+        pieces[low.bit_length() - 1] = (CODE_TYPES[code & 7], BLACK if code & 8 else WHITE)
+        occupancy ^= low
+        n += 1
+    castling = [bool(flags >> (i + 1) & 1) for i in range(4)]
+    return (pieces, BLACK if flags & 1 else WHITE, castling, -1 if en_passant == NO_EN_PASSANT else en_passant,
+            halfmoves, fullmoves)
@@ -0,0 +1,137 @@
+from constants import *
+
+# middlegame and endgame piece values in centipawns
+MG_VALUES = {PAWN: 82, KNIGHT: 337, BISHOP: 365, ROOK: 477, QUEEN: 1025, KING: 0}
+EG_VALUES = {PAWN: 94, KNIGHT: 281, BISHOP: 297, ROOK: 512, QUEEN: 936, KING: 0}
+
+# contribution of each piece to the game phase; the phase runs from MAX_PHASE (all pieces) to 0 (bare kings and pawns)
+PHASE_WEIGHTS = {PAWN: 0, KNIGHT: 1, BISHOP: 1, ROOK: 2, QUEEN: 4, KING: 0}
+MAX_PHASE = 24
+
+# piece-square tables from white's point of view, laid out like the board with a8 first
+PAWN_MG = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5, 5, 10, 25, 25, 10, 5, 5,
+    0, 0, 0, 20, 20, 0, 0, 0,
+    5, -5, -10, 0, 0, -10, -5, 5,
+    5, 10, 10, -20, -20, 10, 10, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+PAWN_EG = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    80, 80, 80, 80, 80, 80, 80, 80,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    30, 30, 30, 30, 30, 30, 30, 30,
+    20, 20, 20, 20, 20, 20, 20, 20,
+    10, 10, 10, 10, 10, 10, 10, 10,
+    10, 10, 10, 10, 10, 10, 10, 10,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+KNIGHT_PST = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20, 0, 0, 0, 0, -20, -40,
+    -30, 0, 10, 15, 15, 10, 0, -30,
+    -30, 5, 15, 20, 20, 15, 5, -30,
+    -30, 0, 15, 20, 20, 15, 0, -30,
+    -30, 5, 10, 15, 15, 10, 5, -30,
+    -40, -20, 0, 5, 5, 0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50,
+]
+BISHOP_PST = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 10, 10, 5, 0, -10,
+    -10, 5, 5, 10, 10, 5, 5, -10,
+    -10, 0, 10, 10, 10, 10, 0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10, 5, 0, 0, 0, 0, 5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20,
+]
+ROOK_PST = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    5, 10, 10, 10, 10, 10, 10, 5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    0, 0, 0, 5, 5, 0, 0, 0,
+]
+QUEEN_PST = [
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 5, 5, 5, 0, -10,
+    -5, 0, 5, 5, 5, 5, 0, -5,
+    0, 0, 5, 5, 5, 5, 0, -5,
+    -10, 5, 5, 5, 5, 5, 0, -10,
+    -10, 0, 5, 0, 0, 0, 0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20,
+]
+KING_MG = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20,
+]
+KING_EG = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+]
+
+MG_PST = {PAWN: PAWN_MG, KNIGHT: KNIGHT_PST, BISHOP: BISHOP_PST, ROOK: ROOK_PST, QUEEN: QUEEN_PST, KING: KING_MG}
+EG_PST = {PAWN: PAWN_EG, KNIGHT: KNIGHT_PST, BISHOP: BISHOP_PST, ROOK: ROOK_PST, QUEEN: QUEEN_PST, KING: KING_EG}
+
+
+def _signed_tables(values: dict[int, int], pst: dict[int, list[int]]) -> dict[int, dict[int, list[int]]]:
+    """
+    Combines piece values and piece-square tables into per-colour tables signed from white's point of view
+    :return: table[piece type][colour][square index]
+    """
+    # black reads the table mirrored vertically, which flips the row bits of the index
+    return {piece_type: {WHITE: [values[piece_type] + pst[piece_type][i] for i in range(64)],
+                         BLACK: [-values[piece_type] - pst[piece_type][i ^ 56] for i in range(64)]}
+            for piece_type in values}
+
+
+MG_TABLE = _signed_tables(MG_VALUES, MG_PST)
+EG_TABLE = _signed_tables(EG_VALUES, EG_PST)
+
+
+def score_position(position: list) -> tuple[int, int, int]:
+    """
+    Scores every piece on the board from scratch
+    :param position: list of Square instances starting from a8
+    :return: (middlegame score, endgame score, phase) with scores from white's point of view
+    """
+    mg, eg, phase = 0, 0, 0
+    for square in position:
+        piece = square.piece
+        if piece is not None:
+            mg += MG_TABLE[piece.type][piece.colour][square.index]
+            eg += EG_TABLE[piece.type][piece.colour][square.index]
+            phase += PHASE_WEIGHTS[piece.type]
+    return mg, eg, phase
+
+
+def taper(mg: int, eg: int, phase: int) -> int:
+    """
+    Blends middlegame and endgame scores by game phase
+    :param mg: middlegame score
+    :param eg: endgame score
+    :param phase: sum of PHASE_WEIGHTS of the pieces on the board
+    :return: blended score
+    """
+    phase = min(phase, MAX_PHASE)
+    return (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from itertools import islice
+from typing import Iterable, Sequence
+
+import numpy as np
+
+from constants import *
+from conversions import algebraic_to_index
+
+# order of the piece planes; within a plane row 0 is the eighth rank, matching square indices
+PLANE_PIECES = [(colour, piece_type) for colour in [WHITE, BLACK]
+                for piece_type in [PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING]]
+# values of the pieces of each plane, the king counting for nothing
+PLANE_VALUES = np.array([0 if piece_type == KING else piece_type for _, piece_type in PLANE_PIECES], np.int16)
+# arrays saved by save and write, each to "<prefix>_<field>.npy"
+FIELDS = ["planes", "turn", "castling", "en_passant", "halfmoves", "fullmoves", "attacks", "mobility", "material"]
+
+_EMPTY = 255
+_PLANE_CODES = np.full(256, _EMPTY, np.uint8)  # FEN character code -> plane index
+for _plane, (_colour, _piece_type) in enumerate(PLANE_PIECES):
+    _PLANE_CODES[ord(PIECES[_piece_type][_colour])] = _plane
+# expands the digits of a FEN's piece placement to one character per square
+_EXPAND = str.maketrans({**{str(n): "." * n for n in range(1, 9)}, "/": ""})
+
+# _FILE_MASKS[dc] keeps the files a shift of dc columns can land on without wrapping to the other side of the board
+_FILE_MASKS = {dc: np.uint64(sum(1 << i for i in range(64) if 0 <= i % 8 - dc <= 7)) for dc in range(-2, 3)}
+
+
+class FeatureBatch:
+    def __init__(self, planes: np.ndarray, turn: np.ndarray, castling: np.ndarray, en_passant: np.ndarray,
+                 halfmoves: np.ndarray, fullmoves: np.ndarray) -> None:
+        """
+        Holds the features of many positions as arrays whose first axis is the position
+        :param planes: (N, 12, 8, 8) bool array, one plane per PLANE_PIECES entry
+        :param turn: (N,) int8 array of WHITE or BLACK
+        :param castling: (N, 4) bool array of the rights in the order KQkq
+        :param en_passant: (N,) int8 array of the en passant square index, -1 if there is none
+        :param halfmoves: (N,) uint16 array of halfmove clocks
+        :param fullmoves: (N,) uint16 array of fullmove numbers
+        """
+        self.planes = planes
+        self.turn = turn
+        self.castling = castling
+        self.en_passant = en_passant
+        self.halfmoves = halfmoves
+        self.fullmoves = fullmoves
+
+    def bitboards(self) -> np.ndarray:
+        """
+        :return: (N, 12) uint64 array with bit i set when square i of the plane is occupied
+        """
+        return planes_to_bitboards(self.planes)
+
+    def attacks(self) -> np.ndarray:
+        """
+        :return: (N, 2, 8, 8) bool array of the squares attacked by white and then by black
+        """
+        return attack_maps(self.bitboards())
+
+    def counts(self) -> np.ndarray:
+        """
+        :return: (N, 12) uint8 array of the number of pieces on each plane
+        """
+        return self.planes.sum(axis=(2, 3), dtype=np.uint8)
+
+    def material(self) -> np.ndarray:
+        """
+        :return: (N, 2) int16 array of the material of white and then black, in the piece values of constants.py
+        """
+        return (self.counts().astype(np.int16) * PLANE_VALUES).reshape(-1, 2, 6).sum(axis=2, dtype=np.int16)
+
+    def mobility(self, attacks: np.ndarray = None) -> np.ndarray:
+        """
+        Counts the squares each side attacks that are not occupied by its own pieces
+        :param attacks: result of attacks, computed if not given
+        :return: (N, 2) uint8 array for white and then black
+        """
+        if attacks is None: attacks = self.attacks()
+        own = self.planes.reshape(-1, 2, 6, 8, 8).any(axis=2)
+        return (attacks & ~own).sum(axis=(2, 3), dtype=np.uint8)
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """
+        :return: dictionary of every one of FIELDS to its array
+        """
+        attacks = self.attacks()
+        return {"planes": self.planes, "turn": self.turn, "castling": self.castling, "en_passant": self.en_passant,
+                "halfmoves": self.halfmoves, "fullmoves": self.fullmoves, "attacks": attacks,
+                "mobility": self.mobility(attacks), "material": self.material()}
+
+    def __len__(self):
+        return len(self.planes)
+
+
+def load_fens(fens: Sequence[str]) -> FeatureBatch:
+    """
+    Parses many FENs at once, decoding every piece placement with a single lookup into a plane array
+    :param fens: sequence of FEN strings
+    :return: FeatureBatch of the positions in the same order
+    """
+    fields = [fen.split() for fen in fens]
+    n = len(fields)
+    placement = "".join(f[0].translate(_EXPAND) for f in fields)
+    if len(placement) != 64 * n or not placement.isascii():
+        bad = next(fen for fen, f in zip(fens, fields) if len(f[0].translate(_EXPAND)) != 64 or not f[0].isascii())
+        raise ValueError(f"invalid piece placement in '{bad}'")
+    chars = np.frombuffer(placement.encode("ascii"), np.uint8).reshape(n, 64)
+    codes = _PLANE_CODES[chars]
+    unknown = (codes == _EMPTY) & (chars != ord("."))
+    if unknown.any(): raise ValueError(f"invalid piece placement in '{fens[int(unknown.any(axis=1).argmax())]}'")
+
+    planes = np.zeros((n, 12, 64), bool)
+    rows, squares = np.nonzero(codes != _EMPTY)
+    planes[rows, codes[rows, squares], squares] = True
+
+    turn = np.array([BLACK if len(f) > 1 and f[1] == "b" else WHITE for f in fields], np.int8)
+    castling = np.array([[len(f) > 2 and char in f[2] for char in "KQkq"] for f in fields], bool).reshape(n, 4)
+    en_passant = np.array([algebraic_to_index(f[3]) if len(f) > 3 and f[3] != "-" else -1 for f in fields], np.int8)
+    halfmoves = np.array([int(f[4]) if len(f) > 4 else 0 for f in fields], np.uint16)
+    fullmoves = np.array([int(f[5]) if len(f) > 5 else 1 for f in fields], np.uint16)
+    return FeatureBatch(planes.reshape(n, 12, 8, 8), turn, castling, en_passant, halfmoves, fullmoves)
+
+
+def planes_to_bitboards(planes: np.ndarray) -> np.ndarray:
+    """
+    Packs boolean (..., 8, 8) maps into 64-bit masks with bit i set when square i is set
+    :param planes: bool array whose last two axes are the board
+    :return: uint64 array without the last two axes
+    """
+    packed = np.packbits(planes.reshape(*planes.shape[:-2], 64), axis=-1, bitorder="little")
+    return packed.view("<u8").reshape(planes.shape[:-2]).astype(np.uint64)
+
+
+def bitboards_to_planes(bitboards: np.ndarray) -> np.ndarray:
+    """
+    Unpacks 64-bit masks into boolean maps, the reverse of planes_to_bitboards
+    :param bitboards: uint64 array
+    :return: bool array with two more axes of (8, 8)
+    """
+    data = np.ascontiguousarray(bitboards, "<u8").view(np.uint8).reshape(*bitboards.shape, 8)
+    return np.unpackbits(data, axis=-1, bitorder="little").reshape(*bitboards.shape, 8, 8).view(bool)
+
+
+def _shift(boards: np.ndarray, dc: int, dr: int) -> np.ndarray:
+    # moves every set square dc columns and dr rows, dropping those that leave the board
+    amount = 8 * dr + dc
+    boards = boards << np.uint64(amount) if amount > 0 else boards >> np.uint64(-amount)
+    return boards & _FILE_MASKS[dc]
+
+
+def _slide(sliders: np.ndarray, empty: np.ndarray, directions: list[tuple[int, int]]) -> np.ndarray:
+    # squares attacked along rays, up to and including the first occupied square
+    attacks = np.zeros_like(sliders)
+    for dc, dr in directions:
+        ray = sliders
+        for _ in range(7):
+            ray = _shift(ray, dc, dr)
+            attacks |= ray
+            ray = ray & empty
+    return attacks
+
+
+def attack_maps(bitboards: np.ndarray) -> np.ndarray:
+    """
+    Finds the squares each side attacks in every position, shifting the masks of whole batches at a time
+    :param bitboards: (N, 12) uint64 array from planes_to_bitboards
+    :return: (N, 2, 8, 8) bool array of the squares attacked by white and then by black
+    """
+    empty = ~np.bitwise_or.reduce(bitboards, axis=1)
+    attacks = np.zeros((len(bitboards), 2), np.uint64)
+    for side, colour in enumerate([WHITE, BLACK]):
+        pawns, knights, bishops, rooks, queens, king = (bitboards[:, 6 * side + i] for i in range(6))
+        result = _shift(pawns, 1, -colour) | _shift(pawns, -1, -colour)
+        for dc, dr in KNIGHT_OFFSETS:
+            result |= _shift(knights, dc, dr)
+        for dc, dr in KING_OFFSETS:
+            result |= _shift(king, dc, dr)
+        result |= _slide(bishops | queens, empty, BISHOP_DIRECTIONS)
+        result |= _slide(rooks | queens, empty, ROOK_DIRECTIONS)
+        attacks[:, side] = result
+    return bitboards_to_planes(attacks)
+
+
+def save(batch: FeatureBatch, prefix: str) -> None:
+    """
+    Writes every one of FIELDS to "<prefix>_<field>.npy"
+    :param batch: FeatureBatch to write
+    :param prefix: path prefix of the files
+    """
+    for field, array in batch.arrays().items():
+        np.save(f"{prefix}_{field}.npy", array)
+
+
+def load(prefix: str, mmap_mode: str = "r") -> dict[str, np.ndarray]:
+    """
+    Opens the files written by save or write
+    :param prefix: path prefix of the files
+    :param mmap_mode: numpy memory map mode, None to read the arrays into memory
+    :return: dictionary of every one of FIELDS to its array
+    """
+    return {field: np.load(f"{prefix}_{field}.npy", mmap_mode=mmap_mode) for field in FIELDS}
+
+
+def write(fens: Iterable[str], count: int, prefix: str, chunk_size: int = 65536) -> int:
+    """
+    Extracts the features of a stream of FENs a chunk at a time into memory mapped .npy files, so memory use does not
+    grow with the number of positions
+    :param fens: iterable of FEN strings, such as an open file with one per line
+    :param count: maximum number of positions, the size the files are created with
+    :param prefix: path prefix of the files, written as by save
+    :param chunk_size: number of FENs extracted at a time
+    :return: number of positions written; if fewer than count the arrays are cut to this length
+    """
+    fens = (line.strip() for line in fens)
+    fens = (fen for fen in fens if fen)
+    outputs = None
+    written = 0
+    while written < count:
+        chunk = list(islice(fens, min(chunk_size, count - written)))
+        if not chunk: break
+        arrays = load_fens(chunk).arrays()
+        if outputs is None:
+            outputs = {field: np.lib.format.open_memmap(f"{prefix}_{field}.npy", "w+", array.dtype,
+                                                        (count, *array.shape[1:]))
+                       for field, array in arrays.items()}
+        for field, array in arrays.items():
+            outputs[field][written:written + len(chunk)] = array
+        written += len(chunk)
+
+    if outputs is None:
+        save(load_fens([]), prefix)
+        return 0
+    for output in outputs.values():
+        output.flush()
+    if written < count:
+        # the header of an .npy file fixes its length, so rewrite files that were made too long
+        arrays = {field: np.array(output[:written]) for field, output in outputs.items()}
+        outputs.clear()
+        for field, array in arrays.items():
+            np.save(f"{prefix}_{field}.npy", array)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract NumPy features from a file of FENs")
+    parser.add_argument("file", help="file of FENs, one per line")
+    parser.add_argument("prefix", help="path prefix of the .npy files to write")
+    parser.add_argument("--chunk-size", type=int, default=65536)
+    args = parser.parse_args()
+
+    with open(args.file) as f:
+        total = sum(1 for line in f if line.strip())
+    t1 = time.perf_counter()
+    with open(args.file) as f:
+        n = write(f, total, args.prefix, args.chunk_size)
+    t2 = time.perf_counter()
+    print(f"Positions: {n}  Time: {t2 - t1:.3f}s  Positions/s: {n / max(t2 - t1, 1e-9):.0f}", file=sys.stderr)
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import argparse
+import functools
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from chess import Board, Move, SaveState
+from constants import *
+from perft import perft
+
+# methods whose calls and cumulative time are recorded; times include any instrumented methods they call
+TIMED = [
+    (Board, "get_legal_moves"),
+    (Move, "is_valid"),
+    (Board, "make_move"),
+    (Board, "unmake_move"),
+    (Board, "is_check"),
+    (Board, "is_attacked"),
+]
+COUNTERS = ["candidates", "accepted", "save_states"]
+
+_timings = {name: [0, 0.0] for _, name in TIMED}  # name -> [calls, seconds], mutated in place by the wrappers
+_counters = dict.fromkeys(COUNTERS, 0)
+_originals = []  # (class, attribute name, original function) of every installed wrapper
+
+
+def _timed(name: str, function):
+    entry = _timings[name]
+    perf_counter = time.perf_counter
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            entry[0] += 1
+            entry[1] += perf_counter() - start
+
+    return wrapper
+
+
+def _candidates(function):
+    # moves generated by get_piece_moves before the legality filter
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        moves = function(*args, **kwargs)
+        _counters["candidates"] += len(moves)
+        return moves
+
+    return wrapper
+
+
+def _accepted(function):
+    # candidates that pass is_legal
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        legal = function(*args, **kwargs)
+        if legal: _counters["accepted"] += 1
+        return legal
+
+    return wrapper
+
+
+def _allocations(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        _counters["save_states"] += 1
+        function(*args, **kwargs)
+
+    return wrapper
+
+
+def is_enabled() -> bool:
+    return bool(_originals)
+
+
+def enable() -> None:
+    """
+    Installs the counting wrappers; until then the instrumented methods run unwrapped and cost nothing extra
+    """
+    if is_enabled(): return
+    wrappers = [(cls, name, _timed(name, getattr(cls, name))) for cls, name in TIMED]
+    wrappers += [(Board, "get_piece_moves", _candidates(Board.get_piece_moves)),
+                 (Board, "is_legal", _accepted(Board.is_legal)),
+                 (SaveState, "__init__", _allocations(SaveState.__init__))]
+    for cls, name, wrapper in wrappers:
+        _originals.append((cls, name, cls.__dict__[name]))
+        setattr(cls, name, wrapper)
+
+
+def disable() -> None:
+    """
+    Restores the original methods, keeping the counts recorded so far
+    """
+    while _originals:
+        cls, name, original = _originals.pop()
+        setattr(cls, name, original)
+
+
+def reset() -> None:
+    """
+    Sets every count and time back to zero
+    """
+    for entry in _timings.values():
+        entry[0], entry[1] = 0, 0.0
+    for name in _counters:
+        _counters[name] = 0
+
+
+def snapshot() -> dict[str, dict[str, int | float] | int]:
+    """
+    Copies the counts recorded while enabled
+    :return: dictionary of each timed method's name to {"calls", "seconds"}, and of each of COUNTERS to its count
+    """
+    stats = {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in _timings.items()}
+    stats.update(_counters)
+    return stats
+
+
+def difference(after: dict, before: dict) -> dict:
+    """
+    Subtracts one snapshot from a later one
+    :return: a snapshot of what was recorded between the two
+    """
+    return {name: difference(value, before[name]) if isinstance(value, dict) else value - before[name]
+            for name, value in after.items()}
+
+
+@contextmanager
+def instrument() -> Iterator[dict]:
+    """
+    Records a workload, enabling instrumentation for its duration unless it is already enabled; blocks can be nested
+    to attribute time to phases
+    :return: a dictionary filled in on exit with a snapshot of only what the workload recorded
+    """
+    was_enabled = is_enabled()
+    enable()
+    stats = {}
+    before = snapshot()
+    try:
+        yield stats
+    finally:
+        stats.update(difference(snapshot(), before))
+        if not was_enabled: disable()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Instrumented perft")
+    parser.add_argument("--fen", default=START_FEN)
+    parser.add_argument("--depth", type=int, default=3)
+    args = parser.parse_args()
+
+    with instrument() as result:
+        perft(Board(args.fen), args.depth)
+    for key, value in result.items():
+        if isinstance(value, dict):
+            print(f"{key:<16} {value['calls']:>10} calls {value['seconds']:>9.3f}s")
+        else:
+            print(f"{key:<16} {value:>10}")
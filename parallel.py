@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+from chess import Board, Move
+from constants import *
+from perft import perft
+from search import MATE_SCORE, MAX_PLY, Searcher, SearchResult
+
+# Boards are sent to workers as a FEN plus the packed moves leading to the subtree, never as pickled Board objects
+
+
+def _board_after(fen: str, path: tuple[int, ...]) -> Board:
+    """
+    Rebuilds a position in a worker process
+    :param fen: FEN string of the root position
+    :param path: packed Move data of the moves made from the root
+    :return: Board instance after the moves
+    """
+    board = Board(fen)
+    for data in path:
+        board.make_move(Move.from_data(data))
+    return board
+
+
+def _perft_task(fen: str, path: tuple[int, ...], depth: int) -> tuple[tuple[int, ...], int]:
+    return path, perft(_board_after(fen, path), depth)
+
+
+def _search_task(fen: str, move: int, depth: int, deadline: float | None,
+                 node_limit: int | None) -> tuple[int, int, list[int], int, int, bool]:
+    board = _board_after(fen, (move,))
+    searcher = Searcher()
+    if depth > 0:
+        time_limit = None
+        if deadline is not None:
+            time_limit = deadline - time.time()
+            if time_limit <= 0: depth, time_limit = 1, None  # queued past the deadline; still score the move
+        result = searcher.search(board, depth, time_limit, node_limit)
+        # a position without legal moves is scored exactly at depth 0
+        if result.depth > 0 or result.best_move is None:
+            return move, result.score, [m.data for m in result.pv], result.depth, result.nodes, True
+    # no depth left, or the budget ran out before the first iteration finished; the quiescence score stands in, but
+    # is only complete when no deeper search was asked for
+    result = searcher.quiesce(board)
+    return move, result.score, [m.data for m in result.pv], 0, result.nodes, depth <= 0
+
+
+def _split(fen: str, depth: int, min_tasks: int) -> tuple[list[tuple[int, ...]], int]:
+    """
+    Expands the move tree breadth first, at least past the root, until there are enough subtrees to keep every worker
+    busy
+    :param fen: FEN string of the root position
+    :param depth: perft depth from the root, at least 1
+    :param min_tasks: number of subtrees to aim for
+    :return: (paths of packed moves to each subtree, remaining depth below the subtrees)
+    """
+    paths = [()]
+    split_depth = 0
+    while split_depth == 0 or (split_depth < depth - 1 and len(paths) < min_tasks):
+        expanded = []
+        for path in paths:
+            board = _board_after(fen, path)
+            expanded += [path + (move.data,) for move in board.get_legal_moves()]
+        paths = expanded
+        split_depth += 1
+    return paths, depth - split_depth
+
+
+def parallel_divide(fen: str, depth: int, workers: int = None, executor: Executor = None) -> dict[str, int]:
+    """
+    Runs perft with the subtrees of the root split across a process pool, broken down per root move
+    :param fen: FEN string of the position
+    :param depth: number of plies to count, at least 1
+    :param workers: number of processes, defaults to the number of CPUs
+    :param executor: existing pool to submit to instead of starting one
+    :return: dictionary of each root move's printable form to its leaf count
+    """
+    workers = workers or os.cpu_count() or 1
+    paths, remaining = _split(fen, depth, workers * 4)
+    counts = {str(move): 0 for move in Board(fen).get_legal_moves()}
+    pool = executor or ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [pool.submit(_perft_task, fen, path, remaining) for path in paths]
+        for future in futures:
+            path, nodes = future.result()
+            counts[str(Move.from_data(path[0]))] += nodes
+    finally:
+        if executor is None: pool.shutdown()
+    return counts
+
+
+def parallel_perft(fen: str, depth: int, workers: int = None, executor: Executor = None) -> int:
+    """
+    Counts the leaf nodes of the legal move tree using a process pool
+    :param fen: FEN string of the position
+    :param depth: number of plies to count
+    :param workers: number of processes, defaults to the number of CPUs
+    :param executor: existing pool to submit to instead of starting one
+    :return: number of positions reached after exactly depth plies
+    """
+    if depth == 0: return 1
+    return sum(parallel_divide(fen, depth, workers, executor).values())
+
+
+def parallel_search(fen: str, depth: int = MAX_PLY, time_limit: float = None, node_limit: int = None,
+                    workers: int = None, executor: Executor = None) -> SearchResult:
+    """
+    Searches every root move in its own process and keeps the best; root moves do not share alpha-beta bounds, so
+    this trades some search efficiency for using every core
+    :param fen: FEN string of the position
+    :param depth: deepest iteration to run, including the root move
+    :param time_limit: hard limit in seconds for the whole search
+    :param node_limit: hard limit on the number of nodes per root move
+    :param workers: number of processes, defaults to the number of CPUs
+    :param executor: existing pool to submit to instead of starting one
+    :return: a SearchResult with node counts summed over the workers
+    """
+    start_time = time.perf_counter()
+    board = Board(fen)
+    moves = board.get_legal_moves()
+    if not moves:
+        score = -MATE_SCORE if board.is_check(board.turn) else 0
+        return SearchResult(None, score, [], 0, 0, time.perf_counter() - start_time)
+    deadline = None if time_limit is None else time.time() + time_limit
+
+    pool = executor or ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+    try:
+        futures = [pool.submit(_search_task, fen, move.data, depth - 1, deadline, node_limit) for move in moves]
+        results = [future.result() for future in futures]
+    finally:
+        if executor is None: pool.shutdown()
+
+    best = None
+    nodes = 0
+    for move, child_score, child_pv, child_depth, child_nodes, complete in results:
+        nodes += child_nodes + 1
+        score = -child_score
+        # mate scores count plies from the root, one more than from the child
+        if score >= MATE_SCORE - MAX_PLY: score -= 1
+        elif score <= -MATE_SCORE + MAX_PLY: score += 1
+        # moves whose search did not finish are only chosen if no search finished
+        if best is None or (complete, score) > (best[4], best[1]):
+            best = move, score, child_pv, child_depth, complete
+    move, score, child_pv, child_depth, complete = best
+    pv = [Move.from_data(data) for data in (move, *child_pv)]
+    return SearchResult(pv[0], score, pv, child_depth + 1 if complete else 0, nodes, time.perf_counter() - start_time)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multiprocess perft and search")
+    parser.add_argument("command", choices=["perft", "divide", "search"])
+    parser.add_argument("--fen", default=START_FEN)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--time", type=float, help="search time limit in seconds")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes, defaults to the CPU count")
+    args = parser.parse_args()
+
+    t1 = time.perf_counter()
+    if args.command == "search":
+        print(parallel_search(args.fen, args.depth, args.time, workers=args.workers))
+    else:
+        counts = parallel_divide(args.fen, args.depth, args.workers)
+        if args.command == "divide":
+            for m, n in counts.items():
+                print(f"{m}: {n}")
+        total = sum(counts.values())
+        t2 = time.perf_counter()
+        print(f"Nodes: {total}  Time: {t2 - t1:.3f}s  Nodes/s: {total / max(t2 - t1, 1e-9):.0f}")
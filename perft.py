@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+
+from bitboard import BitBoard
+from chess import Board
+from constants import *
+
+# (name, FEN, node counts for depth 1, 2, ...) from https://www.chessprogramming.org/Perft_Results
+REFERENCE_POSITIONS = [
+    ("start", START_FEN, [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862, 4085603]),
+    ("position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+    ("position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467, 422333]),
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487]),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+BACKENDS = {"board": Board, "bitboard": BitBoard}
+
+
+def perft(board: Board | BitBoard, depth: int) -> int:
+    """
+    Counts the leaf nodes of the legal move tree
+    :param board: Board or BitBoard instance, left unchanged on return
+    :param depth: number of plies to search
+    :return: number of positions reached after exactly depth plies
+    """
+    if depth == 0: return 1
+    moves = board.get_legal_moves()
+    if depth == 1: return len(moves)
+    nodes = 0
+    for move in moves:
+        board.make_move(move)
+        nodes += perft(board, depth - 1)
+        board.unmake_move()
+    return nodes
+
+
+def divide(board: Board | BitBoard, depth: int) -> dict[str, int]:
+    """
+    Breaks a perft count down per root move
+    :param board: Board or BitBoard instance, left unchanged on return
+    :param depth: number of plies to search, including the root move
+    :return: dictionary of each root move's printable form to its leaf count
+    """
+    counts = {}
+    for move in board.get_legal_moves():
+        board.make_move(move)
+        counts[str(move)] = perft(board, depth - 1)
+        board.unmake_move()
+    return counts
+
+
+def run_benchmark(max_depth: int = 3, backend: str = "board", positions: list = None) -> bool:
+    """
+    Runs perft on the reference positions, printing nodes/second and checking the counts
+    :param max_depth: deepest perft to run, limited to the depths with known counts
+    :param backend: key of BACKENDS to benchmark
+    :param positions: (name, FEN, counts) entries, defaults to REFERENCE_POSITIONS
+    :return: true if every count matched
+    """
+    board_type = BACKENDS[backend]
+    passed = True
+    total_nodes, total_time = 0, 0.0
+    print(f"{'position':<12} {'depth':>5} {'nodes':>10} {'seconds':>9} {'nodes/s':>10}  result")
+    for name, fen, expected in positions or REFERENCE_POSITIONS:
+        board = board_type(fen)
+        for depth in range(1, min(max_depth, len(expected)) + 1):
+            t1 = time.perf_counter()
+            nodes = perft(board, depth)
+            t2 = time.perf_counter()
+            ok = nodes == expected[depth - 1]
+            passed = passed and ok
+            total_nodes += nodes
+            total_time += t2 - t1
+            result = "ok" if ok else f"FAIL (expected {expected[depth - 1]})"
+            print(f"{name:<12} {depth:>5} {nodes:>10} {t2 - t1:>9.3f} {nodes / max(t2 - t1, 1e-9):>10.0f}  {result}")
+    print(f"{'total':<12} {'':>5} {total_nodes:>10} {total_time:>9.3f} {total_nodes / max(total_time, 1e-9):>10.0f}")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perft move generation benchmark")
+    parser.add_argument("--depth", type=int, default=3, help="deepest perft to run")
+    parser.add_argument("--backend", choices=BACKENDS, default="board")
+    parser.add_argument("--fen", help="run perft on this position instead of the reference positions")
+    parser.add_argument("--divide", action="store_true", help="break the count for --fen down per root move")
+    args = parser.parse_args()
+
+    if args.fen is None:
+        sys.exit(0 if run_benchmark(args.depth, args.backend) else 1)
+    b = BACKENDS[args.backend](args.fen)
+    t1 = time.perf_counter()
+    if args.divide:
+        counts = divide(b, args.depth)
+        for m, n in counts.items():
+            print(f"{m}: {n}")
+        total = sum(counts.values())
+    else:
+        total = perft(b, args.depth)
+    t2 = time.perf_counter()
+    print(f"Nodes: {total}  Time: {t2 - t1:.3f}s  Nodes/s: {total / max(t2 - t1, 1e-9):.0f}")
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import argparse
+import re
+import sys
+import time
+from typing import Iterable, Iterator
+
+from chess import Board, Move
+from constants import *
+from conversions import *
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+SAN_PIECES = {PIECES[piece_type][WHITE]: piece_type for piece_type in PIECES}  # "N" -> KNIGHT
+PROMOTION_LETTERS = {PIECES[piece_type][BLACK]: piece_type for piece_type in LEGAL_PROMOTE_PIECES}  # "q" -> QUEEN
+
+HEADER_RE = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*]')
+TOKEN_RE = re.compile(r"[{}();]|[^\s{}();]+")
+MOVE_NUMBER_RE = re.compile(r"^\d+\.+")
+
+
+class PGNError(Exception):
+    pass
+
+
+class Game:
+    def __init__(self) -> None:
+        """
+        Creates an empty game record
+        """
+        self.headers = {}  # tag name -> value, in the order they were read
+        self.moves = []  # main line moves in SAN
+        self.result = "*"
+
+    @property
+    def fen(self) -> str:
+        return self.headers.get("FEN", START_FEN)
+
+    def __str__(self):
+        return f"{self.headers.get('White', '?')} - {self.headers.get('Black', '?')} {self.result}"
+
+
+def read_games(lines: Iterable[str]) -> Iterator[Game]:
+    """
+    Reads PGN games one at a time, so only the game being read is held in memory; comments, variations and numeric
+    annotation glyphs are skipped
+    :param lines: iterable of lines, such as an open file
+    :return: iterator of Game instances
+    """
+    game = Game()
+    in_movetext = False  # whether the current game has reached its moves
+    in_comment = False
+    variation_depth = 0
+    for line in lines:
+        if not in_comment and line.startswith("%"): continue  # escape line
+        if not in_comment and variation_depth == 0 and line.lstrip().startswith("["):
+            if in_movetext:
+                yield game  # a game without a termination marker
+                game, in_movetext = Game(), False
+            header = HEADER_RE.match(line.strip())
+            if header is not None: game.headers[header.group(1)] = header.group(2).replace('\\"', '"')
+            continue
+        for token in TOKEN_RE.findall(line):
+            if in_comment:
+                if token == "}": in_comment = False
+                continue
+            if token == "{": in_comment = True
+            elif token == ";": break
+            elif token == "(": variation_depth += 1
+            elif token == ")": variation_depth = max(variation_depth - 1, 0)
+            elif variation_depth > 0 or token.startswith("$"): continue
+            elif token in RESULTS:
+                game.result = token
+                yield game
+                game, in_movetext = Game(), False
+            else:
+                token = MOVE_NUMBER_RE.sub("", token)
+                if token:
+                    game.moves.append(token)
+                    in_movetext = True
+    if in_movetext or game.headers:
+        yield game
+
+
+def san_to_move(board: Board, san: str) -> Move:
+    """
+    Resolves a move in standard algebraic notation against the legal moves of a position
+    :param board: Board instance with the side to move about to play the move
+    :param san: move such as "e4", "Nbd7", "exd8=Q+" or "O-O"
+    :return: the matching legal Move
+    """
+    text = san.rstrip("+#!?")
+    moves = board.get_legal_moves()
+    position = board.position
+
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        king = board.king_squares[board.turn]
+        target = king + 2 if len(text) == 3 else king - 2
+        for move in moves:
+            if move.flag == MOVE_CASTLING and move.target_pos == target: return move
+        raise PGNError(f"illegal castling move '{san}'")
+
+    promotion = None
+    if "=" in text:
+        text, letter = text.split("=", 1)
+        promotion = SAN_PIECES.get(letter.upper())
+        if promotion is None: raise PGNError(f"invalid promotion piece in '{san}'")
+    elif len(text) > 2 and text[-1] in "NBRQ" and text[-2].isdigit():
+        promotion = SAN_PIECES[text[-1]]
+        text = text[:-1]
+    piece_type = PAWN
+    if text and text[0] in "NBRQK":
+        piece_type = SAN_PIECES[text[0]]
+        text = text[1:]
+    if len(text) < 2 or text[-2] not in LETTERS or text[-1] not in NUMBERS:
+        raise PGNError(f"invalid move '{san}'")
+    target = algebraic_to_index(text[-2:])
+    origin = text[:-2].replace("x", "").replace("-", "")  # disambiguating file, rank or square
+
+    found = None
+    for move in moves:
+        if move.target_pos != target or position[move.current_pos].piece.type != piece_type: continue
+        if origin and not all(char in index_to_algebraic(move.current_pos) for char in origin): continue
+        if (promotion is None) != (move.promotion_piece is None): continue
+        if promotion is not None and move.promotion_piece.type != promotion: continue
+        if found is not None: raise PGNError(f"ambiguous move '{san}'")
+        found = move
+    if found is None: raise PGNError(f"illegal move '{san}'")
+    return found
+
+
+def move_to_san(board: Board, move: Move) -> str:
+    """
+    Writes a legal move in standard algebraic notation
+    :param board: Board instance with the side to move about to play the move, left unchanged on return
+    :param move: legal Move to write
+    :return: move such as "Nbd7", "exd8=Q+" or "O-O"
+    """
+    position = board.position
+    piece = position[move.current_pos].piece
+    if move.flag == MOVE_CASTLING:
+        san = "O-O" if move.target_pos > move.current_pos else "O-O-O"
+    else:
+        start, target = index_to_algebraic(move.current_pos), index_to_algebraic(move.target_pos)
+        is_capture = position[move.target_pos].piece is not None or move.flag == MOVE_EN_PASSANT
+        if piece.type == PAWN:
+            san = (start[0] + "x" if is_capture else "") + target
+            if move.promotion_piece is not None: san += "=" + PIECES[move.promotion_piece.type][WHITE]
+        else:
+            # name the file, else the rank, else the square when another piece of the same type can reach the target
+            others = [index_to_algebraic(m.current_pos) for m in board.get_legal_moves()
+                      if m.target_pos == move.target_pos and m.current_pos != move.current_pos
+                      and position[m.current_pos].piece is piece]
+            origin = ""
+            if others:
+                if all(other[0] != start[0] for other in others): origin = start[0]
+                elif all(other[1] != start[1] for other in others): origin = start[1]
+                else: origin = start
+            san = PIECES[piece.type][WHITE] + origin + ("x" if is_capture else "") + target
+    board.make_move(move)
+    if board.is_check(board.turn):
+        san += "+" if board.has_legal_move() else "#"
+    board.unmake_move()
+    return san
+
+
+def move_to_uci(move: Move) -> str:
+    """
+    Writes a move in long algebraic notation
+    :param move: Move instance
+    :return: move such as "e2e4" or "e7e8q"
+    """
+    text = index_to_algebraic(move.current_pos) + index_to_algebraic(move.target_pos)
+    if move.promotion_piece is not None: text += PIECES[move.promotion_piece.type][BLACK]
+    return text
+
+
+def uci_to_move(board: Board, text: str) -> Move:
+    """
+    Resolves a move in long algebraic notation against the legal moves of a position
+    :param board: Board instance with the side to move about to play the move
+    :param text: move such as "e2e4" or "e7e8q"
+    :return: the matching legal Move
+    """
+    if len(text) not in (4, 5) or text[0] not in LETTERS or text[2] not in LETTERS or text[1] not in NUMBERS \
+            or text[3] not in NUMBERS or (len(text) == 5 and text[4] not in PROMOTION_LETTERS):
+        raise PGNError(f"invalid move '{text}'")
+    start, target = algebraic_to_index(text[:2]), algebraic_to_index(text[2:4])
+    promotion = PROMOTION_LETTERS.get(text[4:])
+    for move in board.get_legal_moves():
+        if move.current_pos == start and move.target_pos == target and \
+                (move.promotion_piece is None if promotion is None else move.promotion_piece.type == promotion):
+            return move
+    raise PGNError(f"illegal move '{text}'")
+
+
+def replay(game: Game, board: Board = None) -> Board:
+    """
+    Plays the moves of a game from its starting position
+    :param game: Game instance to replay
+    :param board: Board instance to reuse, a new one is created if None
+    :return: the board after the last move
+    """
+    if board is None: board = Board(game.fen)
+    else: board.load_fen(game.fen)
+    for ply, san in enumerate(game.moves):
+        try:
+            board.make_move(san_to_move(board, san))
+        except PGNError as e:
+            raise PGNError(f"{game}: ply {ply + 1}: {e}") from None
+    return board
+
+
+def replay_games(lines: Iterable[str], skip_errors: bool = False) -> Iterator[tuple[Game, Board]]:
+    """
+    Reads and replays PGN games one at a time through a single reused board
+    :param lines: iterable of lines, such as an open file
+    :param skip_errors: whether to skip games with illegal or unreadable moves instead of raising PGNError
+    :return: iterator of (Game, Board after its last move); the board is only valid until the next game is read
+    """
+    board = Board()
+    for game in read_games(lines):
+        try:
+            replay(game, board)
+        except PGNError:
+            if skip_errors: continue
+            raise
+        yield game, board
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay every game of a PGN file")
+    parser.add_argument("file", nargs="?", help="PGN file, defaults to stdin")
+    parser.add_argument("--skip-errors", action="store_true", help="skip games with illegal moves")
+    parser.add_argument("--every", type=int, default=1000, help="report progress every this many games")
+    args = parser.parse_args()
+
+    source = open(args.file, encoding="utf-8", errors="replace") if args.file else sys.stdin
+    t1 = time.perf_counter()
+    games, plies = 0, 0
+    with source:
+        for g, _ in replay_games(source, args.skip_errors):
+            games += 1
+            plies += len(g.moves)
+            if games % args.every == 0:
+                t2 = time.perf_counter()
+                print(f"Games: {games}  Games/s: {games / max(t2 - t1, 1e-9):.1f}", file=sys.stderr)
+    t2 = time.perf_counter()
+    print(f"Games: {games}  Plies: {plies}  Time: {t2 - t1:.3f}s  Games/s: {games / max(t2 - t1, 1e-9):.1f}  "
+          f"Plies/s: {plies / max(t2 - t1, 1e-9):.0f}")
@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import time
+
+from chess import Board, Move
+from constants import *
+from tablebase import Tablebase
+
+MATE_SCORE = 100000  # score of delivering mate now; mate in n plies scores MATE_SCORE - n
+INFINITY = 1000000
+MAX_PLY = 128
+
+# transposition table entry bounds
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# piece values used for move ordering
+PIECE_VALUES = {PAWN: 100, KNIGHT: 300, BISHOP: 300, ROOK: 500, QUEEN: 900, KING: 0}
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class SearchResult:
+    def __init__(self, best_move: Move | None, score: int, pv: list[Move], depth: int, nodes: int,
+                 seconds: float) -> None:
+        """
+        Holds the outcome of a search
+        :param best_move: the move to play, None if the side to move has no legal move
+        :param score: centipawn score of the best move from the side to move's point of view
+        :param pv: principal variation starting with the best move
+        :param depth: deepest iteration that completed
+        :param nodes: number of nodes searched, including quiescence nodes
+        :param seconds: time spent searching
+        """
+        self.best_move = best_move
+        self.score = score
+        self.pv = pv
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+
+    @property
+    def nps(self) -> float:
+        return self.nodes / max(self.seconds, 1e-9)
+
+    def is_mate(self) -> bool:
+        return abs(self.score) >= MATE_SCORE - MAX_PLY
+
+    def __str__(self):
+        pv = " ".join(map(str, self.pv))
+        return f"depth {self.depth} score {self.score} nodes {self.nodes} nps {self.nps:.0f} pv {pv}"
+
+
+class Searcher:
+    def __init__(self, tt_size: int = 1 << 20, tablebase: Tablebase = None) -> None:
+        """
+        Creates a negamax alpha-beta searcher whose transposition table and history persist between searches
+        :param tt_size: maximum number of transposition table entries before the table is cleared
+        :param tablebase: optional Tablebase whose results replace searching the endings it covers
+        """
+        self.tt_size = tt_size
+        self.tablebase = tablebase
+        self.tt = {}  # zobrist key -> (depth, score, bound, move data)
+        self.history = {}  # move data -> score of moves that caused cutoffs
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.pv_table = [[] for _ in range(MAX_PLY + 1)]
+        self.nodes = 0
+        self.deadline = None
+        self.check_mask = 1023  # the clock is read every check_mask + 1 nodes
+        self.node_limit = None
+
+    def search(self, board: Board, depth: int = MAX_PLY, time_limit: float = None, node_limit: int = None,
+               info=None) -> SearchResult:
+        """
+        Searches with iterative deepening until the depth is reached or the budget runs out, leaving the board as it
+        was; the result of the last completed iteration is returned
+        :param board: Board instance to search
+        :param depth: deepest iteration to run
+        :param time_limit: hard limit in seconds
+        :param node_limit: hard limit on the number of nodes
+        :param info: optional callable given the SearchResult of every completed iteration
+        :return: a SearchResult
+        """
+        start_time = time.perf_counter()
+        self.deadline = None if time_limit is None else start_time + time_limit
+        # reading the clock less often is cheaper, but short budgets would be overshot by a large share
+        self.check_mask = 1023 if time_limit is None or time_limit >= 1 else 63
+        self.node_limit = node_limit
+        self.nodes = 0
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        saves = len(board.saves)
+
+        moves = board.get_legal_moves()
+        if not moves:
+            score = -MATE_SCORE if board.is_check(board.turn) else 0
+            return SearchResult(None, score, [], 0, 0, time.perf_counter() - start_time)
+        result = SearchResult(moves[0], 0, [moves[0]], 0, 0, 0)
+
+        for d in range(1, min(depth, MAX_PLY - 1) + 1):
+            if d > 1 and self.deadline is not None and time.perf_counter() >= self.deadline:
+                break  # the next iteration could not finish
+            try:
+                score = self._negamax(board, d, -INFINITY, INFINITY, 0)
+            except SearchTimeout:
+                while len(board.saves) > saves:
+                    board.unmake_move()
+                break
+            pv = list(self.pv_table[0])
+            result = SearchResult(pv[0], score, pv, d, self.nodes, time.perf_counter() - start_time)
+            if info is not None: info(result)
+            if abs(score) >= MATE_SCORE - d:
+                break  # a shorter mate cannot be found deeper
+            if self.tablebase is not None and self.tablebase.probe(board) is not None:
+                break  # every move was scored exactly by the tablebase
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start_time
+        return result
+
+    def quiesce(self, board: Board) -> SearchResult:
+        """
+        Scores a position with only the quiescence search, which always finishes, for when there is no depth or
+        budget left for a full iteration
+        :param board: Board instance to score, left unchanged on return
+        :return: a SearchResult of depth 0 whose principal variation holds any captures it played out
+        """
+        start_time = time.perf_counter()
+        self.deadline = None
+        self.node_limit = None
+        self.nodes = 0
+        moves = board.get_legal_moves()
+        if not moves:
+            score = -MATE_SCORE if board.is_check(board.turn) else 0
+            return SearchResult(None, score, [], 0, 0, time.perf_counter() - start_time)
+        score = self._quiescence(board, -INFINITY, INFINITY, 0)
+        pv = list(self.pv_table[0])
+        return SearchResult(pv[0] if pv else None, score, pv, 0, self.nodes, time.perf_counter() - start_time)
+
+    def _check_budget(self) -> None:
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout()
+        if self.deadline is not None and self.nodes & self.check_mask == 0 and time.perf_counter() >= self.deadline:
+            raise SearchTimeout()
+
+    def _order_moves(self, board: Board, moves: list[Move], tt_move: int | None, ply: int) -> list[Move]:
+        """
+        Sorts moves with the transposition table move first, then captures by most valuable victim / least valuable
+        attacker, then killer moves, then by history score
+        """
+        position = board.position
+        killers = self.killers[ply]
+
+        def key(move: Move) -> int:
+            data = move.data
+            if data == tt_move: return 1 << 30
+            victim = position[data >> 6 & 63].piece
+            if victim is not None or move.flag == MOVE_EN_PASSANT or move.flag == MOVE_PROMOTION:
+                attacker = position[data & 63].piece
+                victim_value = PIECE_VALUES[victim.type] if victim is not None else PIECE_VALUES[PAWN]
+                if move.flag == MOVE_PROMOTION: victim_value += PIECE_VALUES[move.promotion_piece.type]
+                return (1 << 20) + victim_value * 16 - PIECE_VALUES[attacker.type] // 100
+            if data == killers[0] or data == killers[1]: return 1 << 19
+            return self.history.get(data, 0)
+
+        return sorted(moves, key=key, reverse=True)
+
+    def _store(self, key: int, depth: int, score: int, bound: int, move: Move | None, ply: int) -> None:
+        if len(self.tt) >= self.tt_size: self.tt.clear()
+        # mate scores are stored relative to this node rather than the root
+        if score >= MATE_SCORE - MAX_PLY: score += ply
+        elif score <= -MATE_SCORE + MAX_PLY: score -= ply
+        self.tt[key] = (depth, score, bound, None if move is None else move.data)
+
+    def _probe(self, board: Board, ply: int) -> int | None:
+        # exact score of a position covered by the tablebase, with mates counted from the root
+        result = self.tablebase.probe(board)
+        if result is None: return None
+        winner, plies = result
+        if winner == DRAW: return 0
+        return MATE_SCORE - ply - plies if winner == board.turn else -MATE_SCORE + ply + plies
+
+    def _negamax(self, board: Board, depth: int, alpha: int, beta: int, ply: int) -> int:
+        if depth <= 0 or ply >= MAX_PLY - 1: return self._quiescence(board, alpha, beta, ply)
+        self.nodes += 1
+        self._check_budget()
+        self.pv_table[ply] = []
+
+        if ply > 0 and (board.halfmoves >= 100 or board.is_repetition(2)): return 0
+        if ply > 0 and self.tablebase is not None:
+            score = self._probe(board, ply)
+            if score is not None: return score
+
+        key = board.zobrist_key
+        entry = self.tt.get(key)
+        tt_move = None
+        if entry is not None:
+            entry_depth, score, bound, tt_move = entry
+            if ply > 0 and entry_depth >= depth:
+                if score >= MATE_SCORE - MAX_PLY: score -= ply
+                elif score <= -MATE_SCORE + MAX_PLY: score += ply
+                if bound == EXACT or (bound == LOWER and score >= beta) or (bound == UPPER and score <= alpha):
+                    return score
+
+        moves = board.get_legal_moves()
+        if not moves:
+            return -MATE_SCORE + ply if board.is_check(board.turn) else 0
+
+        original_alpha = alpha
+        best_score, best_move = -INFINITY, None
+        for move in self._order_moves(board, moves, tt_move, ply):
+            is_quiet = board.position[move.target_pos].piece is None and move.flag in (MOVE_NORMAL, MOVE_CASTLING)
+            board.make_move(move)
+            score = -self._negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score > best_score:
+                best_score, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+            if alpha >= beta:
+                if is_quiet:
+                    killers = self.killers[ply]
+                    if killers[0] != move.data: killers[0], killers[1] = move.data, killers[0]
+                    self.history[move.data] = self.history.get(move.data, 0) + depth * depth
+                break
+
+        if best_score <= original_alpha: bound = UPPER
+        elif best_score >= beta: bound = LOWER
+        else: bound = EXACT
+        self._store(key, depth, best_score, bound, best_move, ply)
+        return best_score
+
+    def _quiescence(self, board: Board, alpha: int, beta: int, ply: int) -> int:
+        self.nodes += 1
+        self._check_budget()
+        self.pv_table[ply] = []
+        if self.tablebase is not None:
+            score = self._probe(board, ply)
+            if score is not None: return score
+
+        in_check = board.is_check(board.turn)
+        if not in_check:
+            stand_pat = board.evaluate()
+            if stand_pat >= beta or ply >= MAX_PLY - 1: return stand_pat
+            alpha = max(alpha, stand_pat)
+
+        if in_check:
+            moves = self._order_moves(board, board.get_legal_moves(), None, ply)
+            if not moves: return -MATE_SCORE + ply
+        else:
+            # only captures and promotions once the position is quiet, already in order, leaving out those that lose
+            # material in the exchange they start
+            moves = [move for move in board.get_tactical_moves() if board.see(move) >= 0]
+
+        best_score = alpha if not in_check else -INFINITY
+        for move in moves:
+            board.make_move(move)
+            score = -self._quiescence(board, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score > best_score:
+                best_score = score
+            if score > alpha:
+                alpha = score
+                self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+                if alpha >= beta: break
+        return best_score
+
+
+def search(board: Board, depth: int = MAX_PLY, time_limit: float = None, node_limit: int = None) -> SearchResult:
+    """
+    Searches a position with a fresh Searcher
+    :param board: Board instance to search, left unchanged on return
+    :param depth: deepest iteration to run
+    :param time_limit: hard limit in seconds
+    :param node_limit: hard limit on the number of nodes
+    :return: a SearchResult
+    """
+    return Searcher().search(board, depth, time_limit, node_limit)
+
+
+if __name__ == "__main__":
+    import sys
+
+    b = Board(" ".join(sys.argv[1:]) or START_FEN)
+    Searcher().search(b, time_limit=5, info=print)
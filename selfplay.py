@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed
+from typing import Callable, Iterator
+
+from chess import Board, Move
+from constants import *
+from pgn import move_to_uci
+from search import Searcher
+
+# a move chooser picks the move to play from a position with at least one legal move; choosers are sent to worker
+# processes, so they must be picklable, such as module level functions or instances of module level classes
+Chooser = Callable[[Board, random.Random], Move]
+
+RESULT_NAMES = {WHITE: "1-0", BLACK: "0-1", DRAW: "1/2-1/2"}
+
+
+def random_player(board: Board, rng: random.Random) -> Move:
+    return rng.choice(board.get_legal_moves())
+
+
+def first_player(board: Board, rng: random.Random) -> Move:
+    return board.get_legal_moves()[0]
+
+
+class SearchPlayer:
+    def __init__(self, depth: int = 2, time_limit: float = None, node_limit: int = None) -> None:
+        """
+        Plays the best move found by a search of every position
+        :param depth: deepest iteration of each search
+        :param time_limit: limit in seconds on each search
+        :param node_limit: limit on the nodes of each search
+        """
+        self.depth = depth
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.searcher = None  # created on first use, so the transposition table is never pickled
+
+    def __call__(self, board: Board, rng: random.Random) -> Move:
+        if self.searcher is None: self.searcher = Searcher()
+        return self.searcher.search(board, self.depth, self.time_limit, self.node_limit).best_move
+
+    def __getstate__(self) -> dict:
+        return {**self.__dict__, "searcher": None}
+
+
+def make_player(spec: str) -> Chooser:
+    """
+    Creates a move chooser from its command line name
+    :param spec: "random", "first" or "search", optionally followed by the depth as in "search:3"
+    :return: the move chooser
+    """
+    name, _, argument = spec.partition(":")
+    if name == "random" and not argument: return random_player
+    if name == "first" and not argument: return first_player
+    if name == "search" and (not argument or argument.isdigit()): return SearchPlayer(int(argument or 2))
+    raise ValueError(f"unknown player '{spec}'")
+
+
+def termination(board: Board, result: int) -> str:
+    """
+    Names the rule that ended a game
+    :param board: Board instance at the end of the game
+    :param result: the board's win state
+    :return: "checkmate", "stalemate", "fifty moves", "repetition" or "insufficient material"
+    """
+    if result != DRAW: return "checkmate"
+    if not board.has_legal_move(): return "stalemate"
+    if board.halfmoves >= 100: return "fifty moves"
+    if board.is_repetition(): return "repetition"
+    return "insufficient material"
+
+
+def play_game(white: Chooser, black: Chooser, fen: str = START_FEN, max_plies: int = 400,
+              rng: random.Random = None) -> dict:
+    """
+    Plays a game until get_win_state ends it, or until it is adjudicated a draw after a number of plies
+    :param white: move chooser of white
+    :param black: move chooser of black
+    :param fen: FEN string of the starting position
+    :param max_plies: number of plies after which the game is drawn
+    :param rng: source of randomness passed to the choosers
+    :return: dictionary of "fen", "result" as in PGN, "termination", "plies", "moves" in long algebraic notation and
+             "seconds"
+    """
+    start_time = time.perf_counter()
+    if rng is None: rng = random.Random()
+    board = Board(fen)
+    players = {WHITE: white, BLACK: black}
+    moves = []
+    result = board.get_win_state()
+    while result == NO_RESULT and len(moves) < max_plies:
+        move = players[board.turn](board, rng)
+        moves.append(move_to_uci(move))
+        board.make_move(move)
+        result = board.get_win_state()
+    return {
+        "fen": fen,
+        "result": RESULT_NAMES.get(result, "1/2-1/2"),
+        "termination": "max plies" if result == NO_RESULT else termination(board, result),
+        "plies": len(moves),
+        "moves": moves,
+        "seconds": time.perf_counter() - start_time,
+    }
+
+
+def _game_task(index: int, fen: str, white: tuple[str, Chooser], black: tuple[str, Chooser], seed: int,
+               max_plies: int) -> dict:
+    record = play_game(white[1], black[1], fen, max_plies, random.Random(seed))
+    return {"game": index, "white": white[0], "black": black[0], **record}
+
+
+def schedule(names: list[str], fens: list[str], games: int) -> Iterator[tuple[int, str, str, str]]:
+    """
+    Pairs every player with every other as both colours in turn, moving to the next starting position once every
+    pairing has played the current one
+    :param names: names of the players; a single player plays itself
+    :param fens: FEN strings of the starting positions, used in turn
+    :param games: number of games
+    :return: iterator of (game index, FEN, white's name, black's name)
+    """
+    pairings = [(white, black) for white in names for black in names if white != black] or [(names[0], names[0])]
+    for index in range(games):
+        white, black = pairings[index % len(pairings)]
+        yield index, fens[index // len(pairings) % len(fens)], white, black
+
+
+def run_tournament(players: dict[str, Chooser], games: int, fens: list[str] = None, workers: int = 1,
+                   max_plies: int = 400, seed: int = 0, executor: Executor = None) -> Iterator[dict]:
+    """
+    Plays a tournament, yielding each game's record as it finishes
+    :param players: dictionary of each player's name to its move chooser
+    :param games: number of games
+    :param fens: FEN strings of the starting positions, defaults to the starting position
+    :param workers: number of processes; 1 plays every game in this process
+    :param max_plies: number of plies after which a game is drawn
+    :param seed: seed of the randomness, game i using seed + i so a tournament can be replayed
+    :param executor: existing pool to submit to instead of starting one
+    :return: iterator of the records of play_game with the keys "game", "white" and "black" added
+    """
+    tasks = [(index, fen, (white, players[white]), (black, players[black]), seed + index, max_plies)
+             for index, fen, white, black in schedule(list(players), fens or [START_FEN], games)]
+    if workers == 1 and executor is None:
+        for task in tasks:
+            yield _game_task(*task)
+        return
+
+    pool = executor or ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+    futures = [pool.submit(_game_task, *task) for task in tasks]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        if executor is None: pool.shutdown()
+
+
+def summarise(records: list[dict], seconds: float) -> dict:
+    """
+    Collects the throughput and results of a tournament
+    :param records: the records of run_tournament
+    :param seconds: wall time the tournament took
+    :return: dictionary of "games", "seconds", "games_per_second", "average_plies", "moves_per_second",
+             "terminations" and "table", the table holding each player's games, wins, draws, losses and score
+    """
+    plies = sum(record["plies"] for record in records)
+    table = {}
+    terminations = {}
+    for record in records:
+        terminations[record["termination"]] = terminations.get(record["termination"], 0) + 1
+        for colour, name in [(WHITE, record["white"]), (BLACK, record["black"])]:
+            row = table.setdefault(name, {"games": 0, "wins": 0, "draws": 0, "losses": 0, "score": 0.0})
+            row["games"] += 1
+            if record["result"] == RESULT_NAMES[colour]: row["wins"] += 1
+            elif record["result"] == RESULT_NAMES[-colour]: row["losses"] += 1
+            else: row["draws"] += 1
+            row["score"] = row["wins"] + row["draws"] / 2
+    return {
+        "games": len(records),
+        "seconds": seconds,
+        "games_per_second": len(records) / max(seconds, 1e-9),
+        "average_plies": plies / max(len(records), 1),
+        "moves_per_second": plies / max(seconds, 1e-9),
+        "terminations": terminations,
+        "table": table,
+    }
+
+
+def format_summary(summary: dict) -> str:
+    lines = [f"Games: {summary['games']}  Time: {summary['seconds']:.3f}s  "
+             f"Games/s: {summary['games_per_second']:.2f}  Average plies: {summary['average_plies']:.1f}  "
+             f"Moves/s: {summary['moves_per_second']:.0f}",
+             "  ".join(f"{name}: {count}" for name, count in sorted(summary["terminations"].items())),
+             f"{'player':<16} {'games':>6} {'wins':>6} {'draws':>6} {'losses':>6} {'score':>7}"]
+    for name, row in sorted(summary["table"].items(), key=lambda item: -item[1]["score"]):
+        lines.append(f"{name:<16} {row['games']:>6} {row['wins']:>6} {row['draws']:>6} {row['losses']:>6} "
+                     f"{row['score']:>7.1f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Self-play tournament between move choosers")
+    parser.add_argument("players", nargs="+", help="random, first or search[:depth]; one player plays itself")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--fens", help="file of starting FENs, one per line, defaults to the starting position")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes, 0 for the CPU count")
+    parser.add_argument("--max-plies", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write a JSON line per game to")
+    args = parser.parse_args()
+
+    starts = None
+    if args.fens:
+        with open(args.fens) as f:
+            starts = [line.strip() for line in f if line.strip()]
+    choosers = {spec: make_player(spec) for spec in args.players}
+    output = open(args.output, "w") if args.output else None
+    t1 = time.perf_counter()
+    results = []
+    try:
+        for r in run_tournament(choosers, args.games, starts, args.workers, args.max_plies, args.seed):
+            results.append(r)
+            if output is not None: output.write(json.dumps(r) + "\n")
+    finally:
+        if output is not None: output.close()
+    print(format_summary(summarise(results, time.perf_counter() - t1)), file=sys.stderr)
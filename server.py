@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+from chess import Board, Move, Piece
+from constants import *
+from perft import perft
+from pgn import PGNError, move_to_uci, uci_to_move
+from search import MATE_SCORE, MAX_PLY, Searcher
+
+STATE_NAMES = {WHITE: "white", BLACK: "black", DRAW: "draw", NO_RESULT: "none"}
+
+
+class CommandError(Exception):
+    pass
+
+
+def _is_playable(board: Board, fen: str) -> bool:
+    # the board loads many FENs it cannot play from, such as ones without kings or with the side not to move in check
+    fields = fen.split()
+    return len(fields) > 1 and fields[1] in ("w", "b") and board.piece_counts[Piece(KING, WHITE)] == 1 and \
+        board.piece_counts[Piece(KING, BLACK)] == 1 and not board.is_check(-board.turn)
+
+
+def _replay(fen: str, moves: tuple[int, ...]) -> Board:
+    # rebuilds a session's board in a worker, keeping the history needed to detect repetitions
+    board = Board(fen)
+    for data in moves:
+        board.make_move(Move.from_data(data))
+    return board
+
+
+def _search_task(fen: str, moves: tuple[int, ...], depth: int, time_limit: float,
+                 node_limit: int | None) -> tuple[int | None, int, int, int, list[int]]:
+    result = Searcher().search(_replay(fen, moves), depth, time_limit, node_limit)
+    best = None if result.best_move is None else result.best_move.data
+    return best, result.score, result.depth, result.nodes, [move.data for move in result.pv]
+
+
+def _perft_task(fen: str, moves: tuple[int, ...], depth: int) -> int:
+    return perft(_replay(fen, moves), depth)
+
+
+class Session:
+    def __init__(self, session_id: int) -> None:
+        """
+        Holds the game of one connection
+        :param session_id: number identifying the session
+        """
+        self.id = session_id
+        self.fen = START_FEN
+        self.moves = []  # packed data of the moves made from fen
+        self.board = Board()
+
+
+class EngineServer:
+    def __init__(self, workers: int = None, max_sessions: int = 10000, max_pending: int = None,
+                 idle_timeout: float = 300.0, queue_timeout: float = 5.0, max_search_time: float = 10.0,
+                 max_perft_depth: int = 5, executor: Executor = None) -> None:
+        """
+        Creates a server that plays one game per connection over a line protocol, running searches in a process pool
+        :param workers: number of processes, defaults to the number of CPUs
+        :param max_sessions: connections beyond this are refused
+        :param max_pending: number of pool jobs allowed at once, defaults to twice the number of workers
+        :param idle_timeout: seconds a session may wait between commands before it is closed
+        :param queue_timeout: seconds a command may wait for a free pool slot before it is refused as busy
+        :param max_search_time: cap on the seconds of every search
+        :param max_perft_depth: cap on the depth of perft commands
+        :param executor: existing pool to submit to instead of starting one
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = executor or ProcessPoolExecutor(max_workers=self.workers)
+        self.owns_executor = executor is None
+        self.max_sessions = max_sessions
+        self.max_pending = max_pending or 2 * self.workers
+        self.idle_timeout = idle_timeout
+        self.queue_timeout = queue_timeout
+        self.max_search_time = max_search_time
+        self.max_perft_depth = max_perft_depth
+        self.sessions = {}  # session id -> Session
+        self.slots = None  # semaphore of max_pending, created on the server's event loop
+        self._ids = itertools.count(1)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0, path: str = None) -> asyncio.AbstractServer:
+        """
+        Starts listening
+        :param host: TCP host
+        :param port: TCP port, 0 for any free port
+        :param path: path of a Unix socket to listen on instead of TCP
+        :return: the asyncio server
+        """
+        self.slots = asyncio.Semaphore(self.max_pending)
+        if path is not None: return await asyncio.start_unix_server(self.handle, path)
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self) -> None:
+        if self.owns_executor: self.executor.shutdown(cancel_futures=True)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serves one connection, answering each command before reading the next so a client cannot queue up work
+        """
+        if len(self.sessions) >= self.max_sessions:
+            writer.write(b"error busy\n")
+            await self._close(writer)
+            return
+        session = Session(next(self._ids))
+        self.sessions[session.id] = session
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    writer.write(b"error idle timeout\n")
+                    break
+                except ValueError:
+                    writer.write(b"error line too long\n")
+                    break
+                if not line: break
+                command = line.decode(errors="replace").strip()
+                if not command: continue
+                if command == "quit": break
+                try:
+                    replies = await self.execute(session, command)
+                except CommandError as e:
+                    replies = [f"error {e}"]
+                except Exception:
+                    # such as a broken process pool; the game survives for the client to retry
+                    replies = ["error internal"]
+                writer.write("".join(reply + "\n" for reply in replies).encode())
+                # waits while a slow client's buffer is full
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            del self.sessions[session.id]
+            await self._close(writer)
+
+    @staticmethod
+    async def _close(writer: asyncio.StreamWriter) -> None:
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def execute(self, session: Session, command: str) -> list[str]:
+        """
+        Runs one command
+        :param session: Session of the connection
+        :param command: line such as "position startpos moves e2e4", "legal", "state", "fen" or "go depth 5"
+        :return: lines to reply with
+        """
+        name, *args = command.split()
+        match name:
+            case "isready":
+                return ["readyok"]
+            case "position":
+                self._position(session, args)
+                return ["ok"]
+            case "legal":
+                return [" ".join(["legal"] + [move_to_uci(move) for move in session.board.get_legal_moves()])]
+            case "state":
+                return [f"state {STATE_NAMES[session.board.get_win_state()]}"]
+            case "fen":
+                return [f"fen {session.board.to_fen()}"]
+            case "go":
+                return await self._go(session, args)
+        raise CommandError(f"unknown command '{name}'")
+
+    def _position(self, session: Session, args: list[str]) -> None:
+        # position startpos|fen <fen> [moves <move>...]
+        split = args.index("moves") if "moves" in args else len(args)
+        if args[:1] == ["startpos"] and split == 1: fen = START_FEN
+        elif args[:1] == ["fen"] and split > 1: fen = " ".join(args[1:split])
+        else: raise CommandError("expected 'position startpos' or 'position fen <fen>'")
+        texts = args[split + 1:]
+
+        board, moves = session.board, session.moves
+        if fen != session.fen or len(texts) < len(moves) or \
+                any(move_to_uci(Move.from_data(data)) != text for data, text in zip(moves, texts)):
+            # not a continuation of the current game
+            try:
+                board, moves = Board(fen), []
+            except Exception:
+                raise CommandError("invalid fen") from None
+            if not _is_playable(board, fen): raise CommandError("invalid fen")
+        else:
+            board, moves = board.clone(), moves.copy()  # the session is left untouched if a move is illegal
+        for text in texts[len(moves):]:
+            try:
+                move = uci_to_move(board, text)
+            except PGNError as e:
+                raise CommandError(str(e)) from None
+            board.make_move(move)
+            moves.append(move.data)
+        session.fen, session.moves, session.board = fen, moves, board
+
+    async def _go(self, session: Session, args: list[str]) -> list[str]:
+        # go [depth <plies>] [movetime <ms>] [nodes <count>] | go perft <depth>
+        if len(args) % 2: raise CommandError(f"missing value for go option '{args[-1]}'")
+        options = {}
+        for key, value in zip(args[::2], args[1::2]):
+            if key not in ("depth", "movetime", "nodes", "perft") or not value.isdigit():
+                raise CommandError(f"invalid go option '{key} {value}'")
+            options[key] = int(value)
+        payload = (session.fen, tuple(session.moves))
+        if "perft" in options:
+            depth = min(options["perft"], self.max_perft_depth)
+            nodes = await self._offload(None, _perft_task, *payload, depth)
+            return [f"nodes {nodes}"]
+
+        time_limit = min(options.get("movetime", self.max_search_time * 1000) / 1000, self.max_search_time)
+        depth = min(options.get("depth", MAX_PLY), MAX_PLY)
+        best, score, depth, nodes, pv = await self._offload(time_limit + 1, _search_task, *payload, depth,
+                                                            time_limit, options.get("nodes"))
+        if abs(score) >= MATE_SCORE - MAX_PLY:
+            plies = MATE_SCORE - abs(score)
+            score_text = f"mate {(plies + 1) // 2 if score > 0 else -(plies // 2)}"
+        else:
+            score_text = f"cp {score}"
+        pv_text = " ".join(move_to_uci(Move.from_data(data)) for data in pv)
+        return [f"info depth {depth} score {score_text} nodes {nodes} pv {pv_text}".rstrip(),
+                f"bestmove {'(none)' if best is None else move_to_uci(Move.from_data(best))}"]
+
+    async def _offload(self, timeout: float | None, function, *args):
+        """
+        Runs a function in the process pool once one of the max_pending slots is free
+        :param timeout: seconds to wait for the result, None to wait until it finishes
+        :return: the function's return value
+        """
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise CommandError("busy") from None
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        # a job that times out keeps running in the pool, so its slot is only freed once it really finishes
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            raise CommandError("timeout") from None
+
+    def _release(self, future: asyncio.Future) -> None:
+        self.slots.release()
+        # retrieves the exception of a job nobody is waiting for any more, so it is not logged as unhandled
+        if not future.cancelled(): future.exception()
+
+
+async def serve(host: str = "127.0.0.1", port: int = 7777, path: str = None, **options) -> None:
+    """
+    Runs an EngineServer until cancelled
+    :param options: keyword arguments of EngineServer
+    """
+    engine = EngineServer(**options)
+    server = await engine.start(host, port, path)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        engine.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Line protocol engine server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--unix", help="path of a Unix socket to listen on instead of TCP")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes, defaults to the CPU count")
+    parser.add_argument("--max-sessions", type=int, default=10000)
+    parser.add_argument("--idle-timeout", type=float, default=300.0)
+    parser.add_argument("--max-search-time", type=float, default=10.0)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, workers=args.workers, max_sessions=args.max_sessions,
+                          idle_timeout=args.idle_timeout, max_search_time=args.max_search_time))
+    except KeyboardInterrupt:
+        pass
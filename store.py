@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import argparse
+import mmap
+import os
+import sys
+import time
+from typing import Iterable, Iterator
+
+from chess import Board
+from encoding import POSITION_SIZE
+
+
+class PositionStore:
+    def __init__(self, path: str, readonly: bool = False) -> None:
+        """
+        Opens a file of fixed-size encoded positions, creating it if it does not exist; positions are appended to the
+        end of the file and read back by index through a memory map
+        :param path: path of the store file
+        :param readonly: whether to open the file without allowing appends
+        """
+        self.path = path
+        self.readonly = readonly
+        self.file = open(path, "rb" if readonly else "a+b")
+        size = os.fstat(self.file.fileno()).st_size
+        if size % POSITION_SIZE:
+            self.file.close()
+            raise Exception(f"{path} is not a position store: its size is not a multiple of {POSITION_SIZE} bytes")
+        self.count = size // POSITION_SIZE
+        self.map = None
+        self.mapped = 0  # number of positions covered by the memory map
+
+    def append(self, board: Board) -> int:
+        """
+        Adds a position to the end of the store
+        :param board: Board instance to encode
+        :return: index of the new position
+        """
+        if self.readonly: raise Exception(f"{self.path} was opened read only")
+        self.file.write(board.to_bytes())
+        self.count += 1
+        return self.count - 1
+
+    def extend(self, boards: Iterable[Board]) -> None:
+        """
+        Adds positions to the end of the store
+        :param boards: iterable of Board instances, which may be the same board moved between positions
+        """
+        for board in boards:
+            self.append(board)
+
+    def get_bytes(self, index: int) -> bytes:
+        """
+        Reads an encoded position
+        :param index: index of the position, negative indices count from the end
+        :return: POSITION_SIZE bytes
+        """
+        if index < 0: index += self.count
+        if not 0 <= index < self.count: raise IndexError("position store index out of range")
+        if index >= self.mapped: self._remap()
+        offset = index * POSITION_SIZE
+        return self.map[offset:offset + POSITION_SIZE]
+
+    def load(self, index: int, board: Board) -> Board:
+        """
+        Reads a position onto an existing board, avoiding creating a new one
+        :param index: index of the position, negative indices count from the end
+        :param board: Board instance to load the position onto
+        :return: the board
+        """
+        board.load_bytes(self.get_bytes(index))
+        return board
+
+    def _remap(self) -> None:
+        # appends are buffered and beyond the end of the old map, so flush them and map the whole file again
+        if not self.readonly: self.file.flush()
+        if self.map is not None: self.map.close()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mapped = len(self.map) // POSITION_SIZE
+
+    def flush(self) -> None:
+        if not self.readonly: self.file.flush()
+
+    def close(self) -> None:
+        if self.map is not None: self.map.close()
+        self.map = None
+        self.mapped = 0
+        self.file.close()
+
+    def __getitem__(self, index: int) -> Board:
+        board = Board()
+        return self.load(index, board)
+
+    def __iter__(self) -> Iterator[Board]:
+        # yields the same board loaded with each position in turn
+        board = Board()
+        for index in range(self.count):
+            yield self.load(index, board)
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self) -> PositionStore:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a file of FENs to a position store, or print one as FENs")
+    parser.add_argument("command", choices=["pack", "unpack"])
+    parser.add_argument("store", help="position store file")
+    parser.add_argument("file", nargs="?", help="file of FENs to pack, one per line, defaults to stdin")
+    args = parser.parse_args()
+
+    t1 = time.perf_counter()
+    if args.command == "pack":
+        source = open(args.file) if args.file else sys.stdin
+        b = Board()
+        with source, PositionStore(args.store) as store:
+            for line in source:
+                if line.strip():
+                    b.load_fen(line.strip())
+                    store.append(b)
+            n = len(store)
+    else:
+        with PositionStore(args.store, readonly=True) as store:
+            for b in store:
+                print(b.to_fen())
+            n = len(store)
+    t2 = time.perf_counter()
+    print(f"Positions: {n}  Time: {t2 - t1:.3f}s  Positions/s: {n / max(t2 - t1, 1e-9):.0f}", file=sys.stderr)
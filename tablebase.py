@@ -0,0 +1,387 @@
+from __future__ import annotations
+
+import argparse
+import mmap
+import os
+import time
+
+from chess import Board
+from constants import *
+from conversions import *
+from tables import *
+
+# a table holds one byte per index: 0 for a draw, INVALID for an index that is not a canonical legal position,
+# otherwise 1 + the number of plies to mate with best play; an odd number of plies is a win for the side to move and an
+# even number a loss, with 0 plies meaning the side to move is checkmated
+INVALID = 255
+MAX_PLIES = 253
+
+MAX_PIECES = 4
+SAN_LETTERS = {KING: "K", QUEEN: "Q", ROOK: "R", BISHOP: "B", KNIGHT: "N"}
+LETTER_TYPES = {letter: piece_type for piece_type, letter in SAN_LETTERS.items()}
+
+
+def _transforms() -> list[list[int]]:
+    # the eight symmetries of the board, which all preserve pawnless positions without castling rights
+    tables = []
+    for flip_cols in (False, True):
+        for flip_rows in (False, True):
+            for transpose in (False, True):
+                table = []
+                for i in range(64):
+                    c, r = index_to_coordinate(i)
+                    if flip_cols: c = 7 - c
+                    if flip_rows: r = 7 - r
+                    if transpose: c, r = r, c
+                    table.append(coordinate_to_index((c, r)))
+                tables.append(table)
+    return tables
+
+
+TRANSFORMS = _transforms()
+# squares of the a1-d1-d4 triangle that the white king is moved into
+KING_SQUARES = [i for i in range(64) if 7 - index_to_coordinate(i)[1] <= index_to_coordinate(i)[0] <= 3]
+KING_SLOTS = {square: slot for slot, square in enumerate(KING_SQUARES)}
+# for every square, the symmetries that move it into the triangle; squares on the diagonal have two
+KING_TRANSFORMS = [[t for t in TRANSFORMS if t[i] in KING_SLOTS] for i in range(64)]
+
+
+def _between() -> dict[int, dict[int, tuple[int, ...]]]:
+    # for each slider, squares strictly between every pair of squares it could move between on an empty board
+    between = {}
+    for piece_type, rays in SLIDER_RAYS.items():
+        pairs = between[piece_type] = {}
+        for i in range(64):
+            for ray in rays[i]:
+                for k, target in enumerate(ray):
+                    pairs[i * 64 + target] = tuple(ray[:k])
+    return between
+
+
+BETWEEN = _between()
+KING_TARGET_SETS = [set(targets) for targets in KING_TARGETS]
+KNIGHT_TARGET_SETS = [set(targets) for targets in KNIGHT_TARGETS]
+
+
+def material_name(white: list[int], black: list[int]) -> str:
+    """
+    Names a material set with each side's pieces in descending value, such as "KQKR"
+    :param white: piece types of white, including the king
+    :param black: piece types of black, including the king
+    :return: the name of the material set
+    """
+    return "".join(SAN_LETTERS[t] for t in sorted(white, reverse=True)) + \
+        "".join(SAN_LETTERS[t] for t in sorted(black, reverse=True))
+
+
+def parse_name(name: str) -> tuple[list[int], list[int]]:
+    """
+    Splits a material set name into each side's piece types
+    :param name: name such as "KQKR", with the second king starting black's pieces
+    :return: (white piece types, black piece types)
+    """
+    split = name.index("K", 1)
+    return [LETTER_TYPES[char] for char in name[:split]], [LETTER_TYPES[char] for char in name[split:]]
+
+
+def canonical_name(white: list[int], black: list[int]) -> tuple[str, bool]:
+    """
+    Gets the name of the table that holds a material set, whose stronger side is white
+    :param white: piece types of white, including the king
+    :param black: piece types of black, including the king
+    :return: (table name, whether colours must be swapped to look up the position)
+    """
+    def strength(types: list[int]) -> tuple[int, str]:
+        return sum(types), material_name(types, [])
+
+    if strength(white) >= strength(black): return material_name(white, black), False
+    return material_name(black, white), True
+
+
+class EndgameTable:
+    def __init__(self, name: str, values: bytearray | mmap.mmap) -> None:
+        """
+        Wraps the values of a pawnless material set; pieces are indexed as the white king, the rest of white's pieces
+        then black's king and pieces, in the order of the name
+        :param name: material set name such as "KQKR"
+        :param values: one byte per index as described by INVALID
+        """
+        self.name = name
+        white, black = parse_name(name)
+        self.pieces = [(t, WHITE) for t in white] + [(t, BLACK) for t in black]
+        self.values = values
+        self.size = 2 * len(KING_SQUARES) * 64 ** (len(self.pieces) - 1)
+        # pairs of slots holding identical pieces, whose squares are kept in order
+        self.identical = [(a, b) for a in range(len(self.pieces)) for b in range(a + 1, len(self.pieces))
+                          if self.pieces[a] == self.pieces[b]]
+
+    def canonical(self, squares: tuple[int, ...]) -> tuple[int, ...]:
+        """
+        Picks one representative of the positions equal to this one under symmetry and swapping identical pieces
+        :param squares: square of each piece in table order
+        :return: the representative squares
+        """
+        best = None
+        for transform in KING_TRANSFORMS[squares[0]]:
+            mapped = [transform[square] for square in squares]
+            for a, b in self.identical:
+                if mapped[a] > mapped[b]: mapped[a], mapped[b] = mapped[b], mapped[a]
+            mapped = tuple(mapped)
+            if best is None or mapped < best: best = mapped
+        return best
+
+    def index(self, squares: tuple[int, ...], turn: int) -> int:
+        """
+        Gets the index of a position
+        :param squares: square of each piece in table order
+        :param turn: WHITE or BLACK
+        :return: index into values
+        """
+        squares = self.canonical(squares)
+        index = KING_SLOTS[squares[0]] + (len(KING_SQUARES) if turn == BLACK else 0)
+        for square in squares[1:]:
+            index = index * 64 + square
+        return index
+
+    def decode(self, index: int) -> tuple[tuple[int, ...], int]:
+        """
+        Gets the position of an index, which may not be legal or canonical
+        :param index: index into values
+        :return: (square of each piece in table order, turn)
+        """
+        squares = []
+        for _ in range(len(self.pieces) - 1):
+            index, square = divmod(index, 64)
+            squares.append(square)
+        turn, slot = divmod(index, len(KING_SQUARES))
+        return (KING_SQUARES[slot], *reversed(squares)), BLACK if turn else WHITE
+
+    def probe(self, squares: tuple[int, ...], turn: int) -> int:
+        return self.values[self.index(squares, turn)]
+
+
+def _is_attacked(square: int, pieces: list[tuple[int, int]], squares: tuple[int, ...], colour: int,
+                 skip: int = -1) -> bool:
+    """
+    Checks if any piece of a colour attacks a square
+    :param skip: slot of a piece that has been captured
+    """
+    occupied = set(squares)
+    for slot, (piece_type, piece_colour) in enumerate(pieces):
+        if piece_colour != colour or slot == skip: continue
+        origin = squares[slot]
+        if piece_type == KING:
+            if square in KING_TARGET_SETS[origin]: return True
+        elif piece_type == KNIGHT:
+            if square in KNIGHT_TARGET_SETS[origin]: return True
+        else:
+            between = BETWEEN[piece_type].get(origin * 64 + square)
+            if between is not None and not occupied.intersection(between): return True
+    return False
+
+
+def _targets(piece_type: int, origin: int, occupied: set[int]) -> list[int]:
+    # squares a piece can move to or capture on, ignoring the colour of the piece it lands on
+    if piece_type == KING: return KING_TARGETS[origin]
+    if piece_type == KNIGHT: return KNIGHT_TARGETS[origin]
+    targets = []
+    for ray in SLIDER_RAYS[piece_type][origin]:
+        for square in ray:
+            targets.append(square)
+            if square in occupied: break
+    return targets
+
+
+class Tablebase:
+    def __init__(self, directory: str = None) -> None:
+        """
+        Holds endgame tables for pawnless material sets of up to MAX_PIECES pieces, loading files lazily from a
+        directory through memory maps
+        :param directory: directory of .bin table files, None to only use tables built in memory
+        """
+        self.directory = directory
+        self.tables = {}  # name -> EndgameTable, or None if there is no file
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.bin")
+
+    def table(self, name: str) -> EndgameTable | None:
+        """
+        Gets a table, loading it if it is available on disk
+        :param name: canonical material set name
+        :return: an EndgameTable or None
+        """
+        if name not in self.tables:
+            table = None
+            if self.directory is not None and os.path.exists(self.path(name)):
+                with open(self.path(name), "rb") as f:
+                    table = EndgameTable(name, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            self.tables[name] = table
+        return self.tables[name]
+
+    def probe_pieces(self, pieces: list[tuple[int, int, int]], turn: int) -> int | None:
+        """
+        Looks up a position given as a list of pieces
+        :param pieces: (type, colour, square) of every piece
+        :param turn: WHITE or BLACK
+        :return: the stored byte, or None if the table is not available
+        """
+        white = [t for t, colour, _ in pieces if colour == WHITE]
+        black = [t for t, colour, _ in pieces if colour == BLACK]
+        if len(white) + len(black) == 2: return 0  # bare kings
+        name, swap = canonical_name(white, black)
+        table = self.table(name)
+        if table is None: return None
+        if swap:
+            # mirror the board top to bottom and swap the colours
+            pieces = [(t, -colour, square ^ 56) for t, colour, square in pieces]
+            turn = -turn
+        # assign squares to table slots in order
+        remaining = sorted(pieces, key=lambda piece: (-piece[1], -piece[0]))
+        return table.probe(tuple(square for _, _, square in remaining), turn)
+
+    def probe(self, board: Board) -> tuple[int, int] | None:
+        """
+        Looks up the result of a position with perfect play; the fifty move rule is ignored
+        :param board: Board instance
+        :return: (WHITE, BLACK or DRAW for the winner, plies to mate or 0 for a draw), or None if the position is not
+                 covered by a loaded table
+        """
+        if sum(board.piece_counts.values()) > MAX_PIECES or any(board.castling): return None
+        pieces = []
+        for square in board.position:
+            piece = square.piece
+            if piece is not None:
+                if piece.type == PAWN: return None
+                pieces.append((piece.type, piece.colour, square.index))
+        value = self.probe_pieces(pieces, board.turn)
+        if value is None or value == INVALID: return None
+        if value == 0: return DRAW, 0
+        plies = value - 1
+        return (board.turn if plies % 2 else -board.turn), plies
+
+    def build(self, name: str, info=None) -> EndgameTable:
+        """
+        Builds a table and any smaller tables it captures into by retrograde analysis, saving them if there is a
+        directory
+        :param name: material set name such as "KQKR", pawnless and with white the stronger side
+        :param info: optional callable given a progress message
+        :return: the EndgameTable
+        """
+        white, black = parse_name(name)
+        if canonical_name(white, black) != (name, False) or PAWN in white + black:
+            raise Exception(f"{name} is not a canonical pawnless material set")
+        if len(white) + len(black) > MAX_PIECES: raise Exception(f"{name} has more than {MAX_PIECES} pieces")
+        table = self.table(name)
+        if table is not None: return table
+        # every capture leads to a table with one piece fewer
+        for i, piece_type in enumerate(white + black):
+            if piece_type == KING: continue
+            if i < len(white): smaller = white[:i] + white[i + 1:], black
+            else: smaller = white, black[:i - len(white)] + black[i - len(white) + 1:]
+            if len(smaller[0]) + len(smaller[1]) > 2: self.build(canonical_name(*smaller)[0], info)
+
+        t1 = time.perf_counter()
+        table = self.tables[name] = EndgameTable(name, bytearray(_retrograde(self, EndgameTable(name, None))))
+        if info is not None: info(f"{name}: {table.size} positions in {time.perf_counter() - t1:.1f}s")
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path(name), "wb") as f:
+                f.write(table.values)
+        return table
+
+
+def _retrograde(tablebase: Tablebase, table: EndgameTable) -> bytearray:
+    """
+    Solves every position of a table, starting from mates and captures into solved tables and working back through
+    the moves that lead to them, one ply at a time
+    :return: the table values
+    """
+    pieces = table.pieces
+    size = table.size
+    values = bytearray(size)
+    remaining = bytearray(size)  # number of different positions in this table each position can move to
+    capture_loss = bytearray(size)  # longest loss among captures that lose
+    escapes = bytearray(size)  # whether a capture draws or wins, so that the position cannot be lost
+    levels = [[] for _ in range(MAX_PLIES + 1)]  # indices to resolve at each number of plies to mate
+    kings = {WHITE: 0, BLACK: next(slot for slot, piece in enumerate(pieces) if piece == (KING, BLACK))}
+
+    def is_legal(squares: tuple[int, ...], turn: int) -> bool:
+        # distinct squares, and the side that just moved is not in check (which also keeps the kings apart)
+        if len(set(squares)) != len(squares): return False
+        return not _is_attacked(squares[kings[-turn]], pieces, squares, turn)
+
+    # find mates and the result of every capture, and count the moves within the table
+    for index in range(size):
+        squares, turn = table.decode(index)
+        if table.canonical(squares) != squares or not is_legal(squares, turn):
+            values[index] = INVALID
+            continue
+        occupied = set(squares)
+        children = set()
+        has_move = False
+        best_win = None
+        for slot, (piece_type, colour) in enumerate(pieces):
+            if colour != turn: continue
+            for target in _targets(piece_type, squares[slot], occupied):
+                captured = squares.index(target) if target in occupied else -1
+                if captured != -1 and (pieces[captured][1] == turn or pieces[captured][0] == KING): continue
+                moved = squares[:slot] + (target,) + squares[slot + 1:]
+                king = target if slot == kings[turn] else squares[kings[turn]]
+                if _is_attacked(king, pieces, moved, -turn, captured): continue
+                has_move = True
+                if captured == -1:
+                    children.add(table.index(moved, -turn))
+                    continue
+                value = tablebase.probe_pieces([(*pieces[s], moved[s]) for s in range(len(pieces)) if s != captured],
+                                               -turn)
+                if value == 0:
+                    escapes[index] = 1
+                elif (value - 1) % 2 == 0:  # the opponent is mated
+                    escapes[index] = 1
+                    if best_win is None or value < best_win: best_win = value
+                else:
+                    capture_loss[index] = max(capture_loss[index], value)
+        if not has_move:
+            if _is_attacked(squares[kings[turn]], pieces, squares, -turn): levels[0].append(index)
+            continue
+        remaining[index] = len(children)
+        if best_win is not None: levels[best_win].append(index)
+        elif not children and not escapes[index]: levels[capture_loss[index]].append(index)
+
+    # positions resolved with n plies to mate make their predecessors wins in n + 1 or, once every move of a
+    # predecessor is known to lose, losses
+    for plies in range(MAX_PLIES):
+        for index in levels[plies]:
+            if values[index]: continue
+            values[index] = plies + 1
+            squares, turn = table.decode(index)
+            occupied = set(squares)
+            predecessors = set()
+            for slot, (piece_type, colour) in enumerate(pieces):
+                if colour == turn: continue
+                # pawnless pieces move back the same way they move forward, onto empty squares
+                for origin in _targets(piece_type, squares[slot], occupied):
+                    if origin in occupied: continue
+                    before = squares[:slot] + (origin,) + squares[slot + 1:]
+                    if is_legal(before, -turn): predecessors.add(table.index(before, -turn))
+            for predecessor in predecessors:
+                if values[predecessor]: continue
+                if plies % 2 == 0:
+                    levels[plies + 1].append(predecessor)
+                else:
+                    remaining[predecessor] -= 1
+                    if remaining[predecessor] == 0 and not escapes[predecessor]:
+                        levels[max(plies + 1, capture_loss[predecessor])].append(predecessor)
+    return values
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build pawnless endgame tables by retrograde analysis")
+    parser.add_argument("names", nargs="+", help="material sets such as KQK KRK KQKR")
+    parser.add_argument("--directory", default="tablebases")
+    args = parser.parse_args()
+
+    tb = Tablebase(args.directory)
+    for n in args.names:
+        tb.build(n, info=print)
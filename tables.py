@@ -0,0 +1,52 @@
+from constants import *
+from conversions import *
+
+
+def _jump_targets(offsets: list[tuple[int, int]]) -> list[list[int]]:
+    """
+    Precomputes the squares reachable in one jump from every square
+    :param offsets: list of (col, row) offsets
+    :return: list indexed by square of target square indices
+    """
+    targets = []
+    for i in range(64):
+        c, r = index_to_coordinate(i)
+        targets.append([coordinate_to_index((c + dc, r + dr)) for dc, dr in offsets
+                        if 0 <= c + dc <= 7 and 0 <= r + dr <= 7])
+    return targets
+
+
+def _rays(directions: list[tuple[int, int]]) -> list[list[list[int]]]:
+    """
+    Precomputes the rays leaving every square, nearest square first
+    :param directions: list of (col, row) steps
+    :return: list indexed by square of non-empty rays
+    """
+    rays = []
+    for i in range(64):
+        square_rays = []
+        for dc, dr in directions:
+            c, r = index_to_coordinate(i)
+            ray = []
+            c, r = c + dc, r + dr
+            while 0 <= c <= 7 and 0 <= r <= 7:
+                ray.append(coordinate_to_index((c, r)))
+                c, r = c + dc, r + dr
+            if ray: square_rays.append(ray)
+        rays.append(square_rays)
+    return rays
+
+
+KNIGHT_TARGETS = _jump_targets(KNIGHT_OFFSETS)
+KING_TARGETS = _jump_targets(KING_OFFSETS)
+
+# squares a pawn of the given colour attacks (white pawns move towards row 0)
+PAWN_ATTACKS = {
+    WHITE: _jump_targets([(1, -1), (-1, -1)]),
+    BLACK: _jump_targets([(1, 1), (-1, 1)]),
+}
+
+BISHOP_RAYS = _rays(BISHOP_DIRECTIONS)
+ROOK_RAYS = _rays(ROOK_DIRECTIONS)
+QUEEN_RAYS = _rays(QUEEN_DIRECTIONS)
+SLIDER_RAYS = {BISHOP: BISHOP_RAYS, ROOK: ROOK_RAYS, QUEEN: QUEEN_RAYS}
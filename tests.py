@@ -1,6 +1,28 @@
+import asyncio
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+
 import pytest
-from chess import Board
+from batch import classify, classify_fen
+from book import BookBuilder, OpeningBook
+from bitboard import BitBoard, mask_to_squares
+from cache import PositionCache
+from chess import Board, Move, Piece
 from constants import *
+from encoding import POSITION_SIZE
+import instrumentation
+from conversions import *
+from evaluation import score_position
+from parallel import parallel_divide, parallel_perft, parallel_search
+from pgn import PGNError, move_to_san, move_to_uci, read_games, replay_games, san_to_move, uci_to_move
+from perft import BACKENDS, REFERENCE_POSITIONS, divide, perft
+from search import MATE_SCORE, Searcher, search
+from selfplay import SearchPlayer, first_player, play_game, random_player, run_tournament, schedule, summarise
+from server import CommandError, EngineServer
+from store import PositionStore
+from tablebase import Tablebase
 
 @pytest.mark.parametrize(
     "fen",
@@ -59,8 +81,757 @@ def test_game_state_stalemate(fen):
         ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR b KQkq - 0 1", 20),
         ("R6R/3Q4/1Q4Q1/4Q3/2Q4Q/Q4Q2/pp1Q4/kBNNK1B1 w - - 0 1", 216),
         ("r1bq1rk1/pppp1ppp/3n1b2/8/8/2N5/PPPP1PPP/R1BQRBK1 b - - 4 10", 26),
+        ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", 48),
+        ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", 6),
+        ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", 44),
     ]
 )
 def test_legal_moves(fen, moves):
     b = Board(fen)
-    assert len(b.get_legal_moves()) == moves
\ No newline at end of file
+    assert len(b.get_legal_moves()) == moves
+
+@pytest.mark.parametrize(
+    "fen",
+    [
+        START_FEN,
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+    ]
+)
+def test_unmake_move_restores_position(fen):
+    b = Board(fen)
+    before = (str(b), b.turn, b.castling.copy(), b.en_passant.index, b.halfmoves, b.moves)
+    for move in b.get_legal_moves():
+        b.make_move(move)
+        b.unmake_move()
+        assert (str(b), b.turn, b.castling, b.en_passant.index, b.halfmoves, b.moves) == before
+    assert len(b.saves) == 0
+
+@pytest.mark.parametrize(
+    "fen",
+    [
+        START_FEN,
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+        "r1bqkbnr/p1pp1Qpp/1pn5/4p3/2B1P3/8/PPPP1PPP/RNB1K1NR b KQkq - 0 4",
+        "8/8/2q5/K7/2k5/8/8/8 w - - 0 1",
+    ]
+)
+def test_bitboard_matches_board(fen):
+    b = Board(fen)
+    bb = BitBoard(fen)
+    assert sorted(map(str, bb.get_legal_moves())) == sorted(map(str, b.get_legal_moves()))
+    assert bb.get_win_state() == b.get_win_state()
+    assert bb.is_check(bb.turn) == b.is_check(b.turn)
+    assert bb.to_fen() == fen
+    assert BitBoard.from_board(b).to_fen() == fen
+    assert str(bb.to_board()) == str(b)
+
+@pytest.mark.parametrize(
+    "fen",
+    [
+        START_FEN,
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+    ]
+)
+def test_zobrist_key_is_incremental(fen):
+    b = Board(fen)
+    start_key = b.zobrist_key
+    for move in b.get_legal_moves():
+        b.make_move(move)
+        assert b.zobrist_key == b.compute_zobrist_key()
+        for reply in b.get_legal_moves():
+            b.make_move(reply)
+            assert b.zobrist_key == b.compute_zobrist_key()
+            b.unmake_move()
+        b.unmake_move()
+        assert b.zobrist_key == start_key
+
+def test_zobrist_key_transposition():
+    b = Board()
+    for m in ["g1 f3", "g8 f6", "f3 g1", "f6 g8"]:
+        b.make_move(Move(*map(algebraic_to_index, m.split(" "))))
+    assert b.zobrist_key == Board().zobrist_key
+    b.load_fen("rnbqkbnr/pppppppp/8/8/8/5N2/PPPPPPPP/RNBQKB1R b KQkq - 1 1")
+    assert b.zobrist_key != Board().zobrist_key
+
+@pytest.mark.parametrize("backend", ["board", "bitboard"])
+@pytest.mark.parametrize(("name", "fen", "counts"), REFERENCE_POSITIONS)
+def test_perft(backend, name, fen, counts):
+    b = BACKENDS[backend](fen)
+    assert perft(b, 2) == counts[1]
+    assert sum(divide(b, 2).values()) == counts[1]
+
+@pytest.mark.parametrize(
+    ("fen", "has_move"),
+    [
+        (START_FEN, True),
+        ("8/8/2q5/K7/2k5/8/8/8 w - - 0 1", False),
+        ("rnb1kbnr/pppp1ppp/8/4p3/5PPq/8/PPPPP2P/RNBQKBNR w KQkq - 1 3", False),
+        ("2k1R3/pp3p2/3K2b1/1p1p1r2/P2R4/8/8/8 b - - 1 60", False),
+        ("k7/8/2Q5/8/8/8/8/7K b - - 0 1", True),
+    ]
+)
+def test_has_legal_move(fen, has_move):
+    b = Board(fen)
+    assert b.has_legal_move() == has_move
+    assert BitBoard(fen).has_legal_move() == has_move
+    assert list(map(str, b.iter_legal_moves())) == list(map(str, b.get_legal_moves()))
+
+@pytest.mark.parametrize(
+    ("fen", "move", "legal"),
+    [
+        ("8/8/8/KPp4r/8/8/8/7k w - c6 0 1", "b5 > c6", False),  # en passant uncovers a check along the rank
+        ("8/8/8/1Pp5/K7/8/8/7k w - c6 0 1", "b5 > c6", True),
+        ("4k3/8/8/8/8/8/8/4K2R w K - 0 1", "e1 > g1", True),
+        ("4k3/8/8/8/8/8/5r2/4K2R w K - 0 1", "e1 > g1", False),  # through check
+        ("4k3/8/8/8/8/8/8/r3K2R w K - 0 1", "e1 > g1", False),  # out of check
+        ("4k3/4r3/8/8/8/8/4B3/4K3 w - - 0 1", "e2 > d3", False),  # pinned
+        ("4k3/4r3/8/8/8/8/4R3/4K3 w - - 0 1", "e2 > e7", True),  # capturing the pinner
+        ("4k3/8/8/8/1b6/5N2/8/4K3 w - - 0 1", "f3 > d2", True),  # blocking the check
+        ("4k3/8/8/8/1b6/5N2/8/4K3 w - - 0 1", "f3 > e5", False),
+    ]
+)
+def test_move_legality(fen, move, legal):
+    b = Board(fen)
+    assert (move in map(str, b.get_legal_moves())) == legal
+    assert (move in map(str, BitBoard(fen).get_legal_moves())) == legal
+
+@pytest.mark.parametrize(
+    ("fen", "state"),
+    [
+        ("8/8/4k3/8/8/3K4/8/8 w - - 0 1", DRAW),
+        ("8/8/4k3/8/8/3KN3/8/8 w - - 0 1", DRAW),
+        ("8/2b5/4k3/8/8/3KB3/8/8 w - - 0 1", DRAW),  # bishops on squares of one colour
+        ("8/3b4/4k3/8/8/3KB3/8/8 w - - 0 1", NO_RESULT),
+        ("8/8/4k3/8/8/3K4/3P4/8 w - - 99 80", NO_RESULT),
+        ("8/8/4k3/8/8/3K4/3P4/8 w - - 100 80", DRAW),
+        ("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1", NO_RESULT),
+        ("3R2k1/5ppp/8/8/8/8/5PPP/6K1 b - - 1 1", WHITE),
+        ("8/8/2q5/K7/2k5/8/8/8 w - - 0 1", DRAW),
+    ]
+)
+def test_win_state_backends_agree(fen, state):
+    b, bb = Board(fen), BitBoard(fen)
+    assert b.get_win_state() == bb.get_win_state() == state
+
+
+def test_bitboard_repetition():
+    b, bb = Board(), BitBoard()
+    for m in ["g1 f3", "g8 f6", "f3 g1", "f6 g8"] * 2:
+        assert b.get_win_state() == bb.get_win_state() == NO_RESULT
+        move = Move(*map(algebraic_to_index, m.split(" ")))
+        b.make_move(move)
+        bb.make_move(move)
+    assert b.get_win_state() == bb.get_win_state() == DRAW and bb.repetition_count() == 3
+    bb.unmake_move()
+    assert bb.get_win_state() == NO_RESULT and bb.zobrist_key == Board(bb.to_fen()).zobrist_key
+
+
+@pytest.mark.parametrize(
+    "fen",
+    [
+        START_FEN,
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    ]
+)
+def test_attackers_of(fen):
+    b = Board(fen)
+    bb = BitBoard(fen)
+    for square in range(64):
+        for colour in [WHITE, BLACK]:
+            expected = set(mask_to_squares(bb.attackers_mask(square, colour)))
+            assert b.attackers_of(square, colour) == expected
+            assert b.is_attacked(square, colour) == bool(expected)
+
+def test_attackers_of_reverse_lookup():
+    b = Board("4k3/8/8/3p4/4P3/1QN2Q2/8/4K2R w - - 0 1")
+    assert b.attackers_of(algebraic_to_index("d5"), WHITE) == {algebraic_to_index("e4"), algebraic_to_index("c3"),
+                                                                algebraic_to_index("b3")}
+    assert b.attackers_of(algebraic_to_index("e4"), BLACK) == {algebraic_to_index("d5")}
+    assert not b.is_attacked(algebraic_to_index("h5"), BLACK)
+
+def test_pieces_are_flyweights():
+    assert Piece(QUEEN, WHITE) is Piece.from_str("Q")
+    assert Piece(QUEEN, WHITE) is not Piece(QUEEN, BLACK)
+    assert pickle.loads(pickle.dumps(Piece(KNIGHT, BLACK))) is Piece(KNIGHT, BLACK)
+    assert deepcopy(Piece(ROOK, WHITE)) is Piece(ROOK, WHITE)
+    b = Board()
+    assert b.position[0].piece is b.position[7].piece
+
+@pytest.mark.parametrize(
+    ("start", "target", "promotion", "flag"),
+    [
+        ("e2", "e4", None, MOVE_NORMAL),
+        ("e1", "g1", None, MOVE_CASTLING),
+        ("d5", "e6", None, MOVE_EN_PASSANT),
+        ("b7", "a8", Piece(KNIGHT, WHITE), MOVE_PROMOTION),
+        ("h2", "h1", Piece(QUEEN, BLACK), MOVE_PROMOTION),
+    ]
+)
+def test_move_packing(start, target, promotion, flag):
+    m = Move(algebraic_to_index(start), algebraic_to_index(target), promotion,
+             flag=MOVE_NORMAL if promotion else flag)
+    assert not hasattr(m, "__dict__")
+    assert 0 <= m.data < 1 << 16
+    copy = Move.from_data(m.data)
+    assert index_to_algebraic(copy.current_pos) == start
+    assert index_to_algebraic(copy.target_pos) == target
+    assert copy.promotion_piece is promotion
+    assert copy.flag == flag
+    assert str(copy) == str(m)
+    m.promotion_piece = None
+    assert m.promotion_piece is None
+    with pytest.raises(ValueError):
+        Move(algebraic_to_index("b7"), algebraic_to_index("b8"), Piece(KING, WHITE))
+
+def test_clone_is_independent():
+    b = Board()
+    for m in ["e2 e4", "e7 e5", "e1 e2"]:
+        b.make_move(Move(*map(algebraic_to_index, m.split(" "))))
+    before = str(b), b.castling.copy(), b.zobrist_key
+    c = b.clone()
+    for move in c.get_legal_moves():
+        c.make_move(move)
+        assert c.zobrist_key == c.compute_zobrist_key()
+        c.unmake_move()
+    c.make_move(Move(algebraic_to_index("e8"), algebraic_to_index("e7")))
+    assert (str(b), b.castling, b.zobrist_key) == before
+    while c.saves:
+        c.unmake_move()
+    assert str(c) == str(Board()) and c.castling == [True] * 4
+    assert (str(b), b.castling, b.zobrist_key) == before
+    assert len(b.clone(history=False).saves) == 0
+
+@pytest.mark.parametrize(
+    ("fen", "best"),
+    [
+        ("r1bqkbnr/p1pp1ppp/1pn5/4p3/2B1P3/5Q2/PPPP1PPP/RNB1K1NR w KQkq - 0 4", "f3 > f7"),
+        ("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1", "d1 > d8"),
+        ("6k1/5ppp/8/8/3q4/8/3R1PPP/6K1 w - - 0 1", "d2 > d4"),
+    ]
+)
+def test_search_finds_best_move(fen, best):
+    b = Board(fen)
+    result = Searcher().search(b, depth=3)
+    assert str(result.best_move) == best
+    assert str(result.pv[0]) == best
+    assert b.zobrist_key == Board(fen).zobrist_key and len(b.saves) == 0
+
+
+def test_search_mate_score():
+    result = search(Board("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1"), depth=4)
+    assert result.is_mate() and result.score == MATE_SCORE - 1
+
+
+def test_search_respects_budget():
+    b = Board("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+    result = search(b, node_limit=2000)
+    assert result.nodes <= 2000 and result.best_move is not None
+    result = search(b, time_limit=0)
+    assert result.depth <= 1 and result.nodes <= 64 and result.best_move is not None
+    t = time.perf_counter()
+    result = search(b, time_limit=0.3)
+    assert time.perf_counter() - t < 1
+    assert result.best_move in b.get_legal_moves()
+    assert len(b.saves) == 0 and b.zobrist_key == b.compute_zobrist_key()
+
+@pytest.mark.parametrize(
+    "fen",
+    [
+        START_FEN,
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+    ]
+)
+def test_evaluation_is_incremental(fen):
+    b = Board(fen)
+    start = b.evaluate()
+    for move in b.get_legal_moves():
+        b.make_move(move)
+        assert (b.mg_score, b.eg_score, b.phase) == score_position(b.position)
+        b.unmake_move()
+        assert b.evaluate() == start
+
+
+def test_evaluation_is_symmetric():
+    assert Board().evaluate() == 0
+    white = Board("r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3")
+    black = Board("rnbqkb1r/pppp1ppp/5n2/4p3/4P3/2N5/PPPP1PPP/R1BQKBNR b KQkq - 2 3")
+    assert white.evaluate() == black.evaluate()
+    assert Board("4k3/8/8/8/8/8/8/3QK3 w - - 0 1").evaluate() > 800
+    assert Board("4k3/8/8/8/8/8/8/3QK3 b - - 0 1").evaluate() < -800
+
+def test_position_cache():
+    cache = PositionCache(maxsize=2)
+    b = Board(cache=cache)
+    uncached = list(map(str, Board().get_legal_moves()))
+    assert list(map(str, b.get_legal_moves())) == uncached
+    assert cache.stats()["misses"] == 1 and cache.hits == 0
+    assert list(map(str, b.get_legal_moves())) == uncached
+    assert b.get_win_state() == NO_RESULT and b.get_win_state() == NO_RESULT
+    assert cache.hits == 2 and len(cache) == 1
+
+    b.make_move(Move(algebraic_to_index("e2"), algebraic_to_index("e4")))
+    assert len(b.get_legal_moves()) == 20 and len(cache) == 2
+    b.load_fen("8/8/2q5/K7/2k5/8/8/8 w - - 0 1")
+    assert b.get_legal_moves() == [] and b.get_win_state() == DRAW
+    assert len(cache) == 2 and Board().zobrist_key not in cache.entries  # least recently used evicted
+
+    b.load_fen("4k3/8/8/8/8/8/8/4K2R w K - 99 80")
+    assert b.get_win_state() == NO_RESULT
+    b.make_move(Move(algebraic_to_index("h1"), algebraic_to_index("h2")))
+    assert b.get_win_state() == DRAW  # 50 move rule applies to cached results too
+    cache.clear()
+    assert len(cache) == 0 and cache.hits == 0
+
+def test_threefold_repetition():
+    b = Board()
+    shuffle = ["g1 f3", "g8 f6", "f3 g1", "f6 g8"]
+    for m in shuffle:
+        b.make_move(Move(*map(algebraic_to_index, m.split(" "))))
+    assert b.repetition_count() == 2 and not b.is_repetition()
+    for m in shuffle:
+        b.make_move(Move(*map(algebraic_to_index, m.split(" "))))
+    assert b.repetition_count() == 3 and b.is_repetition()
+    assert b.get_win_state() == DRAW
+    b.unmake_move()
+    assert b.get_win_state() == NO_RESULT
+    b.make_move(Move(algebraic_to_index("e2"), algebraic_to_index("e4")))
+    assert b.history == [] and b.repetition_count() == 1
+    b.unmake_move()
+    assert len(b.history) == 7
+
+
+@pytest.mark.parametrize(
+    ("fen", "insufficient"),
+    [
+        ("8/8/4k3/8/8/3K4/8/8 w - - 0 1", True),
+        ("8/8/4k3/8/8/3KN3/8/8 w - - 0 1", True),
+        ("8/8/4k3/8/8/3KB3/8/8 w - - 0 1", True),
+        ("8/8/4kb2/8/8/3KB3/8/8 w - - 0 1", True),  # bishops on the same colour
+        ("8/8/2b1k3/8/8/3KB3/8/8 w - - 0 1", False),
+        ("8/8/4kn2/8/8/3KB3/8/8 w - - 0 1", False),
+        ("8/8/4k3/8/8/3KNN2/8/8 w - - 0 1", False),
+        ("8/8/4k3/8/8/3KP3/8/8 w - - 0 1", False),
+        (START_FEN, False),
+    ]
+)
+def test_insufficient_material(fen, insufficient):
+    b = Board(fen)
+    assert b.is_insufficient_material() == insufficient
+    assert (b.get_win_state() == DRAW) == insufficient
+
+
+def test_insufficient_material_after_capture():
+    b = Board("8/8/4k3/8/8/3K1r2/8/8 b - - 0 1")
+    b.make_move(Move(algebraic_to_index("f3"), algebraic_to_index("d3")))
+    b.unmake_move()
+    assert not b.is_insufficient_material()
+    b = Board("8/8/4k3/8/8/3K1r2/8/8 w - - 0 1")
+    b.make_move(Move(algebraic_to_index("d3"), algebraic_to_index("e3")))
+    b.make_move(Move(algebraic_to_index("f3"), algebraic_to_index("f2")))
+    b.make_move(Move(algebraic_to_index("e3"), algebraic_to_index("f2")))
+    assert b.is_insufficient_material() and b.get_win_state() == DRAW
+    b.unmake_move()
+    assert not b.is_insufficient_material()
+    b = Board("8/1P2k3/8/8/8/3K4/8/8 w - - 0 1")
+    b.make_move(Move(algebraic_to_index("b7"), algebraic_to_index("b8"), Piece(BISHOP, WHITE)))
+    assert b.is_insufficient_material()
+    b.unmake_move()
+    assert not b.is_insufficient_material()
+
+
+def test_parallel_perft():
+    fen = REFERENCE_POSITIONS[1][1]
+    assert parallel_divide(fen, 2, workers=2) == divide(Board(fen), 2)
+    assert parallel_perft(fen, 3, workers=2) == perft(Board(fen), 3)
+    assert parallel_perft(fen, 1, workers=2) == perft(Board(fen), 1)
+
+
+def test_parallel_search():
+    result = parallel_search("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1", depth=3, workers=2)
+    assert str(result.best_move) == "d1 > d8" and result.score == MATE_SCORE - 1
+    fen = REFERENCE_POSITIONS[1][1]
+    expected = Searcher().search(Board(fen), depth=1)
+    result = parallel_search(fen, depth=1, workers=2)
+    assert (result.score, result.pv, result.depth) == (expected.score, expected.pv, 1)
+    # a queen down, so a move whose search never finished must not be scored as level
+    fen = "3qk3/8/8/8/8/8/3P4/4K3 w - - 0 1"
+    assert parallel_search(fen, depth=6, time_limit=0.01, workers=2).score < -500
+    result = parallel_search(fen, depth=6, node_limit=1, workers=2)
+    assert result.depth == 0 and result.score < -500
+
+
+def test_classify_fens():
+    fens = [START_FEN, "k7/8/2Q5/8/8/8/8/7K b - - 0 1", "8/8/2q5/K7/2k5/8/8/8 w - - 0 1",
+            "rnb1kbnr/pppp1ppp/8/4p3/5PPq/8/PPPPP2P/RNBQKBNR w KQkq - 1 3", "8/8/4k3/8/8/3K4/8/8 w - - 0 1"]
+    expected = [(NO_RESULT, 20, False), (NO_RESULT, 2, True), (DRAW, 0, False), (BLACK, 0, True), (DRAW, 8, False)]
+    assert [result[1:] for result in classify(fen + "\n" for fen in fens)] == expected
+    assert [result[0] for result in classify(fens, workers=2, chunk_size=2)] == fens
+    assert [result[1:] for result in classify(fens, workers=2, chunk_size=2)] == expected
+    b = Board()
+    assert [classify_fen(b, fen) for fen in fens] == expected
+    for fen in fens:
+        b.load_fen(fen)
+        state, moves, in_check = b.get_position_state()
+        assert (state, moves, in_check) == (b.get_win_state(), b.get_legal_moves(), b.is_check(b.turn))
+
+
+def test_features(tmp_path):
+    np = pytest.importorskip("numpy")
+    import features
+
+    fens = [START_FEN, "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+            "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3", "7k/8/8/8/8/8/8/R3K3 b Q - 5 40"]
+    batch = features.load_fens(fens)
+    assert batch.planes.shape == (4, 12, 8, 8) and batch.planes[0].sum() == 32
+    assert batch.planes[0, 0, 6].all() and batch.planes[0, 11, 0, 4]  # white pawns and the black king
+    assert batch.turn.tolist() == [WHITE, WHITE, WHITE, BLACK]
+    assert batch.castling[3].tolist() == [False, True, False, False]
+    assert batch.en_passant.tolist() == [-1, -1, algebraic_to_index("f6"), -1]
+    assert batch.halfmoves.tolist() == [0, 0, 0, 5] and batch.fullmoves.tolist() == [1, 1, 3, 40]
+    assert batch.material()[0].tolist() == [37, 37] and batch.material()[3].tolist() == [5, 0]
+    assert batch.mobility()[0].tolist() == [8, 8]
+
+    attacks = batch.attacks()
+    for n, fen in enumerate(fens):
+        b = Board(fen)
+        for side, colour in enumerate([WHITE, BLACK]):
+            assert attacks[n, side].reshape(64).tolist() == [b.is_attacked(square, colour) for square in range(64)]
+
+    prefix = str(tmp_path / "features")
+    assert features.write(fens * 3, 20, prefix, chunk_size=5) == 12
+    arrays = features.load(prefix)
+    assert arrays["planes"].shape == (12, 12, 8, 8) and isinstance(arrays["planes"], np.memmap)
+    assert (arrays["attacks"][8:] == attacks).all()
+    with pytest.raises(ValueError):
+        features.load_fens(["rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"])
+
+
+OPERA_GAME = """[Event "Paris"]
+[White "Morphy, Paul"]
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 d6 3. d4 Bg4 {This is a weak move
+already.} 4. dxe5 Bxf3 (4... dxe5 5. Qxd8+ Kxd8) 5. Qxf3 dxe5 6. Bc4 Nf6 7. Qb3 Qe7
+8. Nc3 c6 9. Bg5 $2 b5 10. Nxb5 cxb5 11. Bxb5+ Nbd7 12. O-O-O Rd8 13. Rxd7 Rxd7 ; comment
+14. Rd1 Qe6 15. Bxd7+ Nxd7 16. Qb8+ Nxb8 17. Rd8# 1-0
+
+[FEN "8/P6k/8/8/8/8/6pK/8 w - - 0 1"]
+
+1. a8=Q g1=N 2. Kxg1 *
+1.e4 a6 2.e5 d5 3.exd6 *
+"""
+
+
+def test_read_pgn():
+    games = list(read_games(OPERA_GAME.splitlines(keepends=True)))
+    assert [len(game.moves) for game in games] == [33, 3, 5]
+    assert [game.result for game in games] == ["1-0", "*", "*"]
+    assert games[0].headers["White"] == "Morphy, Paul" and games[0].moves[21:23] == ["Nbd7", "O-O-O"]
+    assert games[1].fen == "8/P6k/8/8/8/8/6pK/8 w - - 0 1"
+    states = [board.get_win_state() for _, board in replay_games(OPERA_GAME.splitlines())]
+    assert states == [WHITE, NO_RESULT, NO_RESULT]
+
+
+@pytest.mark.parametrize(("name", "fen", "counts"), REFERENCE_POSITIONS)
+def test_san_round_trip(name, fen, counts):
+    b = Board(fen)
+    for move in b.get_legal_moves():
+        assert san_to_move(b, move_to_san(b, move)).data == move.data
+        assert uci_to_move(b, move_to_uci(move)).data == move.data
+
+
+def test_san_errors():
+    b = Board("4k3/8/8/8/8/8/4K3/R6R w - - 0 1")
+    assert str(san_to_move(b, "Rad1")) == "a1 > d1"
+    for san in ["Rd1", "O-O", "Nf3", "e9", "a1=Q"]:
+        with pytest.raises(PGNError):
+            san_to_move(b, san)
+    for text in ["a1a9", "h1h2k", "e1e3"]:
+        with pytest.raises(PGNError):
+            uci_to_move(b, text)
+    with pytest.raises(PGNError):
+        list(replay_games(["1. e4 e5 2. Ke3 *"]))
+    assert list(replay_games(["1. e4 e5 2. Ke3 *", "1. d4 *"], skip_errors=True))[0][0].moves == ["d4"]
+
+
+@pytest.mark.parametrize(("name", "fen", "counts"), REFERENCE_POSITIONS)
+def test_fen_and_bytes_round_trip(name, fen, counts):
+    b = Board(fen)
+    assert b.to_fen() == fen
+    for move in b.get_legal_moves():
+        b.make_move(move)
+        data = b.to_bytes()
+        assert len(data) == POSITION_SIZE
+        loaded = Board()
+        loaded.load_bytes(data)
+        assert loaded.to_fen() == b.to_fen() == BitBoard.from_board(b).to_fen()
+        assert loaded.zobrist_key == b.zobrist_key and loaded.evaluate() == b.evaluate()
+        b.unmake_move()
+
+
+def test_fullmove_number():
+    b = Board("4k3/8/8/8/8/8/8/4K3 b - - 3 40")
+    b.make_move(Move(algebraic_to_index("e8"), algebraic_to_index("d8")))
+    assert b.to_fen() == "3k4/8/8/8/8/8/8/4K3 w - - 4 41"
+
+
+def test_position_store(tmp_path):
+    path = str(tmp_path / "positions.bin")
+    fens = [position[1] for position in REFERENCE_POSITIONS]
+    with PositionStore(path) as store:
+        b = Board()
+        for fen in fens[:3]:
+            b.load_fen(fen)
+            store.append(b)
+        assert store[1].to_fen() == fens[1]
+        for fen in fens[3:]:
+            b.load_fen(fen)
+            store.append(b)
+        assert len(store) == len(fens) and store[-1].to_fen() == fens[-1]
+    with PositionStore(path, readonly=True) as store:
+        assert [b.to_fen() for b in store] == fens
+        assert store.load(2, Board()).to_fen() == fens[2]
+        with pytest.raises(IndexError):
+            store.get_bytes(len(fens))
+
+
+def test_en_passant_key_needs_a_capture():
+    b = Board()
+    b.make_move(Move(algebraic_to_index("e2"), algebraic_to_index("e4")))
+    assert b.en_passant.index == algebraic_to_index("e3")
+    assert b.zobrist_key == Board("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1").zobrist_key
+    b = Board("4k3/8/8/8/3p4/8/4P3/4K3 w - - 0 1")
+    b.make_move(Move(algebraic_to_index("e2"), algebraic_to_index("e4")))
+    assert b.zobrist_key != Board("4k3/8/8/8/3pP3/8/8/4K3 b - - 0 1").zobrist_key
+    assert b.zobrist_key == Board("4k3/8/8/8/3pP3/8/8/4K3 b - e3 0 1").zobrist_key
+
+
+def test_opening_book(tmp_path):
+    path = str(tmp_path / "book.bin")
+    builder = BookBuilder()
+    assert builder.add_pgn(OPERA_GAME.splitlines(), plies=4) == 3
+    builder.add_fens([START_FEN + ";d4;5", START_FEN + ";e4", "",
+                      "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1;c5"])
+    assert builder.write(path) == 12
+    with OpeningBook(path) as book:
+        b = Board()
+        assert [(move_to_san(b, move), weight) for move, weight in b.get_book_moves(book)] == [("d4", 5), ("e4", 3)]
+        b.make_move(san_to_move(b, "e4"))
+        assert sorted(move_to_san(b, move) for move, _ in b.get_book_moves(book)) == ["a6", "c5", "e5"]
+        assert str(book.choose(b)) in ["a7 > a6", "c7 > c5", "e7 > e5"]
+        b.make_move(san_to_move(b, "c5"))
+        assert b.get_book_moves(book) == [] and book.choose(b) is None
+    open(path, "wb").close()
+    with OpeningBook(path) as book:
+        assert len(book) == 0 and Board().get_book_moves(book) == []
+
+
+@pytest.fixture(scope="module")
+def tablebase(tmp_path_factory):
+    tb = Tablebase(str(tmp_path_factory.mktemp("tablebases")))
+    tb.build("KQK")
+    return tb
+
+
+@pytest.mark.parametrize(
+    ("fen", "result"),
+    [
+        ("k7/8/1K6/8/8/8/8/6Q1 w - - 0 1", (WHITE, 1)),
+        ("k7/2Q5/1K6/8/8/8/8/8 b - - 0 1", (DRAW, 0)),
+        ("k7/1Q6/1K6/8/8/8/8/8 b - - 0 1", (WHITE, 0)),
+        ("8/8/8/3K4/8/8/8/kq6 b - - 0 1", (BLACK, 17)),
+        ("8/8/8/3k4/8/8/8/KQ6 w - - 0 1", (WHITE, 17)),
+        ("8/8/8/3k4/8/8/8/KR6 w - - 0 1", None),
+        ("8/8/8/3k4/8/8/8/K7 w - - 0 1", (DRAW, 0)),
+    ]
+)
+def test_tablebase_probe(tablebase, fen, result):
+    assert tablebase.probe(Board(fen)) == result
+
+
+def test_tablebase_is_consistent(tablebase):
+    # every position's result follows from the best result among its moves
+    b = Board("8/8/8/3k4/8/8/8/KQ6 w - - 0 1")
+    for _ in range(12):
+        winner, plies = tablebase.probe(b)
+        children = []
+        for move in b.get_legal_moves():
+            b.make_move(move)
+            children.append((tablebase.probe(b), move))
+            b.unmake_move()
+        # the winner mates as fast as possible and the loser delays mate as long as possible
+        if winner == b.turn:
+            children = [child for child in children if child[0][0] == winner]
+            (child_winner, child_plies), best = min(children, key=lambda child: child[0][1])
+        else: (child_winner, child_plies), best = max(children, key=lambda child: child[0][1])
+        assert (child_winner, child_plies + 1) == (winner, plies)
+        b.make_move(best)
+    assert Tablebase(tablebase.directory).probe(b) == tablebase.probe(b)
+
+
+def test_search_uses_tablebase(tablebase):
+    b = Board("8/8/8/3k4/8/8/8/KQ6 w - - 0 1")
+    result = Searcher(tablebase=tablebase).search(b, depth=20)
+    assert result.score == MATE_SCORE - 17 and result.depth == 1
+
+
+def test_instrumentation():
+    make_move = Board.make_move
+    b = Board()
+    with instrumentation.instrument() as stats:
+        assert Board.make_move is not make_move
+        perft(b, 2)
+        with instrumentation.instrument() as inner:
+            assert Move(algebraic_to_index("e2"), algebraic_to_index("e4")).is_valid(b)
+            b.is_check(WHITE)
+    assert Board.make_move is make_move and not instrumentation.is_enabled()
+    assert stats["get_legal_moves"]["calls"] == 21 and stats["make_move"]["calls"] == 20
+    assert stats["unmake_move"]["calls"] == 20 and stats["save_states"] == 20
+    assert stats["accepted"] == 420 + 1 and stats["candidates"] == 420 + 2
+    assert inner["is_valid"]["calls"] == 1 and inner["is_check"]["calls"] == 1 and inner["make_move"]["calls"] == 0
+    assert inner["is_attacked"]["calls"] == 1
+    assert stats["get_legal_moves"]["seconds"] > 0
+    instrumentation.enable()
+    instrumentation.reset()
+    perft(b, 1)
+    assert instrumentation.snapshot()["get_legal_moves"]["calls"] == 1
+    instrumentation.disable()
+    perft(b, 1)
+    assert instrumentation.snapshot()["get_legal_moves"]["calls"] == 1
+
+
+def test_engine_server():
+    async def run():
+        engine = EngineServer(workers=1, max_sessions=2, idle_timeout=1)
+        server = await engine.start()
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+        async def send(command, lines=1):
+            writer.write(f"{command}\n".encode())
+            return [(await reader.readline()).decode().strip() for _ in range(lines)]
+
+        assert await send("isready") == ["readyok"]
+        assert await send("position startpos moves e2e4 e7e5") == ["ok"]
+        assert len((await send("legal"))[0].split()) == 30
+        assert await send("position startpos moves e2e4 e7e5 g1f3 b8x6") == ["error invalid move 'b8x6'"]
+        assert await send("fen") == ["fen rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e6 0 2"]
+        for fen in ["8/8/8/8/8/8/8/8 w - - 0 1", "6k1/5ppp/8/8/8/8/5PPP/3R2K1 x - - 0 1",
+                    "3R2k1/5ppp/8/8/8/8/5PPP/6K1 w - - 0 1", "6k1/8/8/8/8/8/8/3KK3 w - - 0 1"]:
+            assert await send(f"position fen {fen}") == ["error invalid fen"]
+        assert await send("fen") == ["fen rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e6 0 2"]
+        assert await send("position fen 6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1") == ["ok"]
+        assert await send("go depth 3", 2) == ["info depth 1 score mate 1 nodes 21 pv d1d8", "bestmove d1d8"]
+        assert await send("go perft 2") == ["nodes 152"]
+        assert await send("go depth") == ["error missing value for go option 'depth'"]
+        assert await send("position startpos moves f2f3 e7e5 g2g4 d8h4") == ["ok"]
+        assert await send("state") == ["state black"]
+        assert await send("go depth 2", 2) == ["info depth 0 score mate 0 nodes 0 pv", "bestmove (none)"]
+        assert await send("castle") == ["error unknown command 'castle'"]
+
+        other = await asyncio.open_connection("127.0.0.1", port)
+        refused_reader, _ = await asyncio.open_connection("127.0.0.1", port)
+        assert await refused_reader.readline() == b"error busy\n"
+        other[1].close()
+        assert await reader.readline() == b"error idle timeout\n"
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        engine.close()
+
+    asyncio.run(run())
+
+
+def test_engine_server_backpressure():
+    async def run():
+        pool = ThreadPoolExecutor(max_workers=1)
+        engine = EngineServer(max_pending=1, queue_timeout=0.1, executor=pool)
+        server = await engine.start()
+        with pytest.raises(CommandError, match="timeout"):
+            await engine._offload(0.05, time.sleep, 0.5)
+        # the timed out job still holds the only slot until it finishes
+        with pytest.raises(CommandError, match="busy"):
+            await engine._offload(None, time.sleep, 0)
+        await asyncio.sleep(0.5)
+        assert await engine._offload(None, sum, [1, 2]) == 3
+
+        pool.shutdown()
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"go perft 1\nisready\n")
+        assert await reader.readline() == b"error internal\n"
+        assert await reader.readline() == b"readyok\n"
+        writer.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize(("name", "fen", "counts"), REFERENCE_POSITIONS)
+def test_tactical_moves(name, fen, counts):
+    b = Board(fen)
+    for move in b.get_legal_moves()[:8] + [None]:
+        if move is not None: b.make_move(move)
+        expected = {m.data for m in b.get_legal_moves() if b.position[m.target_pos].piece is not None
+                    or m.flag == MOVE_EN_PASSANT or m.flag == MOVE_PROMOTION}
+        tactical = [m.data for m in b.get_tactical_moves()]
+        assert len(tactical) == len(expected) and set(tactical) == expected
+        if move is not None: b.unmake_move()
+
+
+def test_tactical_move_order():
+    b = Board("4k3/8/8/3q4/2P1r3/8/5N2/3Q2K1 w - - 0 1")
+    assert list(map(str, b.get_tactical_moves())) == ["c4 > d5", "d1 > d5", "f2 > e4"]
+    b = Board("3rk3/2P5/8/8/8/8/8/4K3 w - - 0 1")
+    assert list(map(str, b.get_tactical_moves()))[:4] == ["c7 > d8 = Q", "c7 > d8 = R", "c7 > c8 = Q", "c7 > d8 = B"]
+
+
+@pytest.mark.parametrize(
+    ("fen", "move", "value"),
+    [
+        ("4k3/8/8/3p4/8/8/8/3RK3 w - - 0 1", "d1 > d5", 1),  # undefended
+        ("4k3/8/4p3/3p4/8/8/8/3RK3 w - - 0 1", "d1 > d5", -4),  # defended by a pawn
+        ("3rk3/8/8/3p4/8/8/3R4/3RK3 w - - 0 1", "d2 > d5", 1),  # the rook behind joins the exchange
+        ("3rk3/3r4/8/3p4/8/8/3R4/3RK3 w - - 0 1", "d2 > d5", -4),
+        ("8/8/4k3/3p4/8/8/8/3RK3 w - - 0 1", "d1 > d5", -4),  # the king recaptures
+        ("8/8/4k3/3p4/8/8/3R4/3RK3 w - - 0 1", "d2 > d5", 1),  # but not onto a defended square
+        ("4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1", "e5 > d6", 1),  # en passant
+        ("3r4/2P5/8/8/8/8/8/k3K3 w - - 0 1", "c7 > d8 = Q", 13),  # capture promoting to a queen
+        ("3r4/2P2k2/8/8/8/8/8/4K3 w - - 0 1", "c7 > c8 = Q", -1),  # the new queen is lost to the rook
+        ("2r5/2P2k2/8/8/8/8/8/3RK3 w - - 0 1", "d1 > d8", 0),  # promotion by recapture
+    ]
+)
+def test_see(fen, move, value):
+    b = Board(fen)
+    assert b.see(next(m for m in b.get_legal_moves() if str(m) == move)) == value
+
+
+def test_self_play():
+    game = play_game(SearchPlayer(depth=2), first_player, "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1")
+    assert (game["result"], game["termination"], game["moves"]) == ("1-0", "checkmate", ["d1d8"])
+    game = play_game(first_player, first_player, "8/8/4k3/8/8/3K4/8/8 w - - 0 1")
+    assert (game["result"], game["termination"], game["plies"]) == ("1/2-1/2", "insufficient material", 0)
+    game = play_game(random_player, random_player, max_plies=10)
+    assert (game["result"], game["termination"], game["plies"]) == ("1/2-1/2", "max plies", 10)
+
+    assert [pairing[1:] for pairing in schedule(["a", "b"], ["x", "y"], 5)] == [
+        ("x", "a", "b"), ("x", "b", "a"), ("y", "a", "b"), ("y", "b", "a"), ("x", "a", "b")]
+    players = {"random": random_player, "first": first_player}
+    records = list(run_tournament(players, 6, max_plies=60, seed=1))
+    parallel = sorted(run_tournament(players, 6, max_plies=60, seed=1, workers=2), key=lambda r: r["game"])
+    assert [{**r, "seconds": 0} for r in records] == [{**r, "seconds": 0} for r in parallel]
+    summary = summarise(records, 1.0)
+    assert summary["games"] == 6 and summary["moves_per_second"] == sum(r["plies"] for r in records)
+    assert summary["table"]["random"]["games"] == summary["table"]["first"]["games"] == 6
+    assert sum(row["score"] for row in summary["table"].values()) == 6
@@ -0,0 +1,52 @@
+from random import Random
+
+from constants import *
+from tables import PAWN_ATTACKS
+
+# fixed seed so keys are identical across processes and runs, letting hashes be stored on disk
+_random = Random(0x5EED)
+
+
+def _key() -> int:
+    return _random.getrandbits(64)
+
+
+PIECE_KEYS = {piece_type: {colour: [_key() for _ in range(64)] for colour in [WHITE, BLACK]} for piece_type in PIECES}
+TURN_KEY = _key()  # xored in when black is to move
+CASTLING_KEYS = [_key() for _ in range(4)]  # indexed like Board.castling
+EN_PASSANT_KEYS = [_key() for _ in range(8)]  # indexed by file
+
+
+def en_passant_key(position: list, en_passant: int, turn: int) -> int:
+    """
+    Gets the part of the key for an en passant square, which only counts when a pawn could capture onto it; otherwise
+    positions reached by a double pawn push would never match the same position loaded from a FEN
+    :param position: list of Square instances starting from a8
+    :param en_passant: index of the en passant square or -1
+    :param turn: WHITE or BLACK constant of the side to move
+    :return: the key of the en passant file, or 0
+    """
+    if en_passant == -1: return 0
+    for index in PAWN_ATTACKS[-turn][en_passant]:
+        piece = position[index].piece
+        if piece is not None and piece.type == PAWN and piece.colour == turn: return EN_PASSANT_KEYS[en_passant % 8]
+    return 0
+
+
+def hash_position(position: list, turn: int, castling: list[bool], en_passant: int) -> int:
+    """
+    Computes the Zobrist key of a position from scratch
+    :param position: list of Square instances starting from a8
+    :param turn: WHITE or BLACK constant of the side to move
+    :param castling: the four castling rights in KQkq order
+    :param en_passant: index of the en passant square or -1
+    :return: 64-bit hash of the position
+    """
+    key = 0
+    for square in position:
+        if square.piece is not None:
+            key ^= PIECE_KEYS[square.piece.type][square.piece.colour][square.index]
+    if turn == BLACK: key ^= TURN_KEY
+    for i, right in enumerate(castling):
+        if right: key ^= CASTLING_KEYS[i]
+    return key ^ en_passant_key(position, en_passant, turn)